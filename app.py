@@ -1,27 +1,303 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from http import HTTPStatus
-from typing import List
+from typing import List, Literal, Optional, Union
 
-from fastapi import Depends, FastAPI, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import bindparam, func, insert, select, update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
-from database import get_session
+from busca import MINIMO_TRIGRAMA, busca_usuarios
+from cache import cache_usuarios
+from coalescencia import estatisticas as estatisticas_coalescencia, voo_unico, voo_unico_async
+from compactacao import Compactador
+from compressao import MiddlewareCompressao, algoritmos_compressao
+from condicional import cabecalhos, confere_if_match, responde
+from database import (
+    aquece,
+    descarta,
+    get_engine,
+    get_replicas,
+    get_session,
+    get_session_leitura,
+    status_pool,
+    url_primario,
+    urls_replicas,
+)
+from eventos import barramento, fluxo_sse, fluxo_ws, publica_usuario
+from exportacao import exporta_csv, exporta_ndjson
+from importacao import importa
+from limites import ESCRITA, MiddlewareAdmissao, admissao, limitador
+from metricas import MiddlewareMetricas, metricas
 from models import User
-from schema import UsuarioPublic, BaseUsuario, Usuario
+from mudancas import lista_mudancas
+from replicas import MiddlewareLeituraPropria
+from regras import (
+    ATIVO,
+    COLUNAS_PAYLOAD,
+    busca_payload,
+    detalhe_conflito,
+    formato_pedido,
+    le_campos,
+    mesmo_email,
+    mesmo_nome,
+    monta_lista,
+    monta_lookup,
+    monta_pagina,
+    payload_usuario,
+    query_listagem,
+    senha_eh_forte,
+)
+from schema import (
+    UsuarioPublic, BaseUsuario, Usuario, PaginaUsuarios, ResultadoImportacao, Login, UsuarioParcial,
+    PedidoLookup, ResultadoLookup, PedidoRemocao, ResultadoRemocao, PaginaMudancas,
+)
+from seguranca import SobrecargaHash, senhas
+from settings import get_settings
 
-app = FastAPI(title='API de Receitas e Usuarios')
+settings = get_settings()
+compactador = Compactador(get_engine, settings)
 
-#Funcao Auxiliar
-def senha_eh_forte(senha: str) -> bool:
-    # Verifica se tem letras E numeros
-    tem_letra = any(c.isalpha() for c in senha)
-    tem_numero = any(c.isdigit() for c in senha)
-    return tem_letra and tem_numero
+# Rodadas uma vez no startup so pra compilar o SQL (o valor nao importa)
+CONSULTAS_QUENTES = (
+    select(*COLUNAS_PAYLOAD).where(User.id == 0, ATIVO),
+    select(*COLUNAS_PAYLOAD).where(mesmo_nome(''), ATIVO),
+    query_listagem(0, 100, 'offset', None, 'id')[0],
+)
+
+
+async def aquece_rotas(app: FastAPI):
+    # Uma requisicao interna (sem rede) pela pilha toda: o FastAPI monta as
+    # dependencias e os campos pydantic de cada rota so no primeiro uso, e
+    # ela ainda passa pelo threadpool e pelo banco. O 404 nao entra no cache
+    # nem nas metricas
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': '/usuarios/0', 'raw_path': b'/usuarios/0',
+        'query_string': b'', 'root_path': '', 'headers': [], 'client': None, 'server': None,
+        'aquecimento': True,
+    }
+
+    async def recebe():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def envia(_mensagem):
+        pass
+
+    await app(scope, recebe, envia)
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Nada de banco e criado no import: os engines nascem aqui e ja abrem as
+    # conexoes, pra primeira requisicao nao pagar isso. Sem DATABASE_URL o
+    # startup ja falha, mesmo sem aquecimento
+    url_primario(settings)
+    if settings.AQUECIMENTO_ATIVO:
+        await aquece(CONSULTAS_QUENTES)
+        await aquece_rotas(app)
+
+    # Tarefas de fundo que vivem junto com o app
+    tarefas = []
+    if settings.COMPACTACAO_ATIVA:
+        tarefas.append(asyncio.create_task(compactador.roda()))
+    replicas = get_replicas()
+    if replicas is not None:
+        tarefas.append(asyncio.create_task(replicas.monitora(settings.DB_REPLICA_CHECAGEM)))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+        with suppress(asyncio.CancelledError):
+            await tarefa
+    await descarta()
+
+
+app = FastAPI(title='API de Receitas e Usuarios', lifespan=ciclo_de_vida)
+if admissao.ativa:
+    # Dentro do MiddlewareMetricas, pra os 503 aparecerem no /metrics
+    app.add_middleware(MiddlewareAdmissao, admissao=admissao)
+app.add_middleware(MiddlewareMetricas)
+if urls_replicas(settings):
+    # Leitura da propria escrita com replicas (ver replicas.py)
+    app.add_middleware(MiddlewareLeituraPropria, segundos=settings.DB_REPLICA_LEITURA_PROPRIA)
+if algoritmos := algoritmos_compressao(settings):
+    # Por fora de tudo: os outros middlewares veem a resposta sem compressao
+    app.add_middleware(MiddlewareCompressao, algoritmos=algoritmos, minimo=settings.COMPRESSAO_MINIMO)
+
+@app.exception_handler(SobrecargaHash)
+def sobrecarga_hash(request: Request, erro: SobrecargaHash):
+    # Fila de hash de senha cheia: melhor recusar rapido do que travar todo mundo
+    return JSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={'detail': 'Servidor ocupado, tente novamente'},
+        headers={'Retry-After': '1'},
+    )
+
+# CRUD de usuarios. Com DB_MODE=async essas rotas sao trocadas pelas de
+# rotas_async.py (mesmos caminhos, usando AsyncSession)
+rotas = APIRouter()
 
 #ROTAS DE USUÁRIOS
 
-@app.post("/usuarios", status_code=HTTPStatus.CREATED, response_model=UsuarioPublic)
+# Fica fora de `rotas` pra existir tanto no modo sync quanto no async
+@app.post("/usuarios/bulk", status_code=HTTPStatus.OK, response_model=ResultadoImportacao, dependencies=ESCRITA)
+async def importa_usuarios(request: Request, session: Session = Depends(get_session)):
+    # Corpo: array JSON ou JSON-lines com username, email e password
+    corpo = await request.body()
+    try:
+        return await run_in_threadpool(importa, session, corpo, settings.BULK_CHUNK_SIZE)
+    except (ValueError, UnicodeDecodeError) as erro:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(erro))
+
+@app.post("/login", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+def login(dados: Login, session: Session = Depends(get_session)):
+    linha = session.execute(
+        select(User.id, User.username, User.email, User.password).where(mesmo_nome(dados.username), ATIVO)
+    ).one_or_none()
+    # Devolve a conexao antes do hash: o argon2 leva dezenas de ms e um pico
+    # de logins seguraria o pool inteiro esperando CPU
+    session.close()
+
+    confere, hash_novo = senhas.verifica(dados.password, linha.password if linha else None)
+    if not confere:
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail='Usuario ou senha invalidos')
+
+    if hash_novo:
+        # Hash antigo (outro esquema, parametros velhos ou texto puro):
+        # troca agora que temos a senha em maos. So se ninguem trocou a
+        # senha enquanto o hash era conferido
+        session.execute(
+            update(User)
+            .where(User.id == linha.id, User.password == linha.password)
+            .values(password=hash_novo)
+        )
+        session.commit()
+    return {'id': linha.id, 'username': linha.username, 'email': linha.email}
+
+@app.get("/usuarios/busca", status_code=HTTPStatus.OK, response_model=List[UsuarioPublic])
+def pesquisa_usuarios(
+    q: str = Query(min_length=1, max_length=254),
+    modo: Literal['prefixo', 'contem'] = 'contem',
+    skip: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    # Prefixo ou trecho do username/email, usando o indice de trigramas.
+    # Menos de 3 letras o indice nao atende e viraria varredura da tabela
+    if len(q) < MINIMO_TRIGRAMA:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f'A busca precisa de pelo menos {MINIMO_TRIGRAMA} caracteres',
+        )
+    return monta_lista(busca_usuarios(session, q, modo, skip, limit))
+
+@app.post("/usuarios/lookup", status_code=HTTPStatus.OK, response_model=ResultadoLookup)
+def lookup_usuarios(pedido: PedidoLookup, session: Session = Depends(get_session)):
+    # Resolve uma lista de ids de uma vez: o que estiver no cache sai de la e
+    # o resto vem num SELECT ... IN por lote, em vez de um GET por id
+    if len(pedido.ids) > settings.LOOKUP_MAX_IDS:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f'Maximo de {settings.LOOKUP_MAX_IDS} ids por pedido',
+        )
+    ids = list(dict.fromkeys(pedido.ids))
+    marca = cache_usuarios.marca()
+    achados = cache_usuarios.por_ids(ids)
+    faltando = [id for id in ids if id not in achados]
+
+    for inicio in range(0, len(faltando), settings.LOOKUP_CHUNK_SIZE):
+        lote = faltando[inicio:inicio + settings.LOOKUP_CHUNK_SIZE]
+        payloads = [payload_usuario(linha) for linha in session.execute(
+            select(*COLUNAS_PAYLOAD).where(User.id.in_(lote), ATIVO)
+        )]
+        cache_usuarios.guarda_varios(payloads, marca)
+        achados.update((payload['id'], payload) for payload in payloads)
+
+    return monta_lookup(ids, achados)
+
+@app.delete("/usuarios", status_code=HTTPStatus.OK, response_model=ResultadoRemocao, dependencies=ESCRITA)
+def delete_usuarios(pedido: PedidoRemocao, session: Session = Depends(get_session)):
+    # Delete logico de uma lista de ids num UPDATE so. Os ids vao literais no
+    # SQL (sao int ja validados), entao a lista nao esbarra no limite de
+    # variaveis do SQLite
+    if len(pedido.ids) > settings.BULK_DELETE_MAX_IDS:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f'Maximo de {settings.BULK_DELETE_MAX_IDS} ids por pedido',
+        )
+    ids = list(dict.fromkeys(pedido.ids))
+    if not ids:
+        return {'removidos': [], 'nao_encontrados': []}
+
+    linhas = session.execute(
+        update(User)
+        .where(User.id.in_(bindparam('ids', ids, expanding=True, literal_execute=True)), ATIVO)
+        .values(deleted_at=func.now())
+        .returning(User.id, User.username),
+        execution_options={'synchronize_session': False},
+    ).all()
+    session.commit()
+    cache_usuarios.invalida_varios(linhas)
+    for linha in linhas:
+        publica_usuario('removido', linha.id)
+
+    removidos = {linha.id for linha in linhas}
+    return {
+        'removidos': [id for id in ids if id in removidos],
+        'nao_encontrados': [id for id in ids if id not in removidos],
+    }
+
+@app.get("/usuarios/export", status_code=HTTPStatus.OK)
+def exporta_usuarios(formato: Literal['ndjson', 'csv'] = 'ndjson'):
+    # Tabela inteira em streaming, sem carregar tudo na memoria
+    if formato == 'csv':
+        return StreamingResponse(
+            exporta_csv(get_engine()),
+            media_type='text/csv',
+            headers={'Content-Disposition': 'attachment; filename="usuarios.csv"'},
+        )
+    return StreamingResponse(exporta_ndjson(get_engine()), media_type='application/x-ndjson')
+
+@app.get("/usuarios/changes", status_code=HTTPStatus.OK, response_model=PaginaMudancas)
+def mudancas_usuarios(
+    since: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=settings.MUDANCAS_LIMITE_MAX),
+    session: Session = Depends(get_session),
+):
+    # Criados/alterados/apagados depois do watermark, pra sincronizar sem
+    # reler a tabela. Le do primario: replica atrasada poderia pular linhas
+    return lista_mudancas(session, since, limit, settings)
+
+@app.get("/usuarios/eventos", status_code=HTTPStatus.OK, response_class=StreamingResponse)
+async def eventos_sse():
+    # Server-Sent Events com cada usuario criado/alterado/apagado neste
+    # worker (ver eventos.py)
+    if barramento.lotado():
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail='Conexoes de eventos demais, tente novamente',
+            headers={'Retry-After': '5'},
+        )
+    return StreamingResponse(
+        fluxo_sse(settings.EVENTOS_PING),
+        media_type='text/event-stream',
+        # Sem cache e sem buffer no proxy (nginx), senao o evento nao chega na hora
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.websocket("/usuarios/eventos/ws")
+async def eventos_ws(websocket: WebSocket):
+    # Mesmos eventos do SSE, um JSON por mensagem
+    if barramento.lotado():
+        await websocket.close(code=1013, reason='conexoes de eventos demais')
+        return
+    await websocket.accept()
+    await fluxo_ws(websocket, settings.EVENTOS_PING)
+
+@rotas.post("/usuarios", status_code=HTTPStatus.CREATED, response_model=UsuarioPublic, dependencies=ESCRITA)
 def create_usuario(user: BaseUsuario, session: Session = Depends(get_session)):
     # Valida senha
     if not senha_eh_forte(user.password):
@@ -30,63 +306,98 @@ def create_usuario(user: BaseUsuario, session: Session = Depends(get_session)):
             detail='A senha precisa ter letras e numeros'
         )
 
+    senha_hash = senhas.gera(user.password)
+
+    if not settings.CREATE_PRECHECK:
+        # Um INSERT ... RETURNING so; se username/email ja existirem a unique
+        # constraint acusa e o erro vira o mesmo 409 do jeito antigo
+        try:
+            criado = session.execute(
+                insert(User)
+                .values(username=user.username, email=user.email, password=senha_hash)
+                .returning(User.id, User.username, User.email)
+            )
+            novo_usuario = criado.one()._asdict()
+            session.commit()
+        except IntegrityError as erro:
+            session.rollback()
+            raise HTTPException(status_code=409, detail=detalhe_conflito(erro))
+        publica_usuario('criado', **novo_usuario)
+        return novo_usuario
+
     # Verifica duplicados
     db_user = session.scalar(
         select(User).where(
-            (User.username == user.username) | (User.email == user.email)
+            mesmo_nome(user.username) | mesmo_email(user.email)
         )
     )
 
     if db_user:
-        if db_user.username == user.username:
+        if db_user.username.lower() == user.username.lower():
             raise HTTPException(status_code=409, detail='Nome de usuario ja existe')
-        elif db_user.email == user.email:
+        elif db_user.email.lower() == user.email.lower():
             raise HTTPException(status_code=409, detail='Email ja existe')
 
     # Cria no banco
     novo_usuario = User(
         username=user.username,
         email=user.email,
-        password=user.password
+        password=senha_hash
     )
     
     session.add(novo_usuario)
     session.commit()
     session.refresh(novo_usuario)
+    publica_usuario('criado', novo_usuario.id, novo_usuario.username, novo_usuario.email)
 
     return novo_usuario
 
-@app.get("/usuarios", status_code=HTTPStatus.OK, response_model=List[UsuarioPublic])
-def get_todos_usuarios(skip: int = 0, limit: int = 100, session: Session = Depends(get_session)):
-    users = session.scalars(select(User).offset(skip).limit(limit)).all()
-    return users
+@rotas.get(
+    "/usuarios",
+    status_code=HTTPStatus.OK,
+    response_model=Union[List[UsuarioPublic], PaginaUsuarios],
+)
+def get_todos_usuarios(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.LISTAGEM_LIMITE_MAX),
+    paginacao: Literal['offset', 'cursor'] = 'offset',
+    cursor: Optional[str] = None,
+    ordem: Literal['id', 'created_at'] = 'id',
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session_leitura),
+):
+    # fields=id,username: so essas chaves (e so essas colunas no SELECT).
+    # Accept: application/msgpack responde em MessagePack
+    campos = le_campos(fields)
+    formato = formato_pedido(request.headers.get('accept'))
+    query, modo_cursor = query_listagem(skip, limit, paginacao, cursor, ordem, campos)
+    linhas = session.execute(query).all()
 
-@app.get("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
-def get_usuario_por_id(id: int, session: Session = Depends(get_session)):
-    db_user = session.scalar(select(User).where(User.id == id))
-    
-    if not db_user:
-        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
-        
-    return db_user
+    if not modo_cursor:
+        return monta_lista(linhas, campos, formato)
+    return monta_pagina(linhas, limit, ordem, campos, formato)
 
-@app.get("/usuarios/busca/{nome}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
-def get_usuario_por_nome(nome: str, session: Session = Depends(get_session)):
-    # Busca exata pelo username
-    db_user = session.scalar(select(User).where(User.username == nome))
-    
-    if not db_user:
+@rotas.get("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
+def get_usuario_por_id(id: int, request: Request, response: Response, session: Session = Depends(get_session_leitura)):
+    payload = busca_payload(session, ('id', id), User.id == id)
+    if payload is None:
         raise HTTPException(status_code=404, detail='Usuario nao encontrado')
-    
-    return db_user
 
-@app.put("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
-def update_usuario(id: int, user: BaseUsuario, session: Session = Depends(get_session)):
-    db_user = session.scalar(select(User).where(User.id == id))
-    
-    if not db_user:
+    # 304 se o cliente mandou o ETag/data da versao atual
+    return responde(request, response, payload)
+
+@rotas.get("/usuarios/busca/{nome}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
+def get_usuario_por_nome(nome: str, request: Request, response: Response, session: Session = Depends(get_session_leitura)):
+    # Busca exata pelo username (sem diferenciar maiusculas)
+    payload = busca_payload(session, ('nome', nome), mesmo_nome(nome))
+    if payload is None:
         raise HTTPException(status_code=404, detail='Usuario nao encontrado')
-    
+
+    return responde(request, response, payload)
+
+@rotas.put("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+def update_usuario(id: int, user: BaseUsuario, request: Request, response: Response, session: Session = Depends(get_session)):
     # Valida senha na atualizacao tambem
     if not senha_eh_forte(user.password):
         raise HTTPException(
@@ -94,27 +405,188 @@ def update_usuario(id: int, user: BaseUsuario, session: Session = Depends(get_se
             detail='A senha precisa ter letras e numeros'
         )
 
+    # Hash antes de ir ao banco pra nao segurar conexao do pool enquanto calcula
+    senha_hash = senhas.gera(user.password)
+
+    query = select(User).where(User.id == id, ATIVO)
+    if 'if-match' in request.headers:
+        # Trava a linha entre conferir a versao e gravar (no SQLite nao faz nada,
+        # la a escrita ja e serializada)
+        query = query.with_for_update()
+    db_user = session.scalar(query)
+    
+    if not db_user:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    confere_if_match(request, payload_usuario(db_user))
+
+    nome_antigo = db_user.username
     try:
         db_user.username = user.username
         db_user.email = user.email
-        db_user.password = user.password
+        db_user.password = senha_hash
         
         session.commit()
         session.refresh(db_user)
+        cache_usuarios.invalida(id, nome_antigo, db_user.username)
+        publica_usuario('atualizado', id, db_user.username, db_user.email)
+        response.headers.update(cabecalhos(payload_usuario(db_user)))
         return db_user
         
     except IntegrityError:
         session.rollback()
         raise HTTPException(status_code=409, detail='Nome ou Email ja existe')
 
-@app.delete("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
-def delete_usuario(id: int, session: Session = Depends(get_session)):
-    db_user = session.scalar(select(User).where(User.id == id))
+@rotas.patch("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+def patch_usuario(id: int, user: UsuarioParcial, request: Request, response: Response, session: Session = Depends(get_session)):
+    # Atualiza so os campos enviados, num UPDATE ... RETURNING sem ler a linha antes
+    campos = user.model_dump(exclude_unset=True, exclude_none=True)
+
+    if 'password' in campos:
+        if not senha_eh_forte(campos['password']):
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail='A senha precisa ter letras e numeros'
+            )
+        campos['password'] = senhas.gera(campos['password'])
+
+    if not campos or 'if-match' in request.headers:
+        # Sem nada pra mudar, ou com If-Match: ai precisa ler a versao atual
+        db_user = session.scalar(select(User).where(User.id == id, ATIVO).with_for_update())
+        if not db_user:
+            raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+        confere_if_match(request, payload_usuario(db_user))
+        if not campos:
+            return db_user
+
+    # updated_at sobe sozinho pelo onupdate da coluna
+    try:
+        resultado = session.execute(
+            update(User)
+            .where(User.id == id, ATIVO)
+            .values(**campos)
+            .returning(*COLUNAS_PAYLOAD),
+            execution_options={'synchronize_session': False},
+        )
+        linha = resultado.one_or_none()
+        session.commit()
+    except IntegrityError as erro:
+        session.rollback()
+        raise HTTPException(status_code=409, detail=detalhe_conflito(erro))
+
+    if linha is None:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    # O username antigo nao e conhecido aqui, mas invalidar o id ja basta
+    # (ver cache.py); o novo tambem sai pra nao sobrar mapeamento velho
+    cache_usuarios.invalida(id, *([campos['username']] if 'username' in campos else []))
+    publica_usuario('atualizado', id, linha.username, linha.email)
+    response.headers.update(cabecalhos(payload_usuario(linha)))
+    return linha._asdict()
+
+@rotas.delete("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+def delete_usuario(id: int, request: Request, session: Session = Depends(get_session)):
+    query = select(User).where(User.id == id, ATIVO)
+    if 'if-match' in request.headers:
+        query = query.with_for_update()
+    db_user = session.scalar(query)
     
     if not db_user:
         raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    confere_if_match(request, payload_usuario(db_user))
     
-    session.delete(db_user)
+    # Vira lapide; a compactacao apaga de vez depois (compactacao.py)
+    db_user.deleted_at = func.now()
     session.commit()
+    cache_usuarios.invalida(id, db_user.username)
+    publica_usuario('removido', id)
     
-    return db_user
\ No newline at end of file
+    return db_user
+
+
+#METRICAS
+
+@app.get("/metrics", status_code=HTTPStatus.OK, response_class=PlainTextResponse)
+def get_metricas():
+    # Formato texto do Prometheus: latencia e status por rota, consultas por
+    # requisicao e por operacao, mais o estado do pool e do cache
+    pool = status_pool()
+    cache = cache_usuarios.estatisticas()
+    extras = {
+        'crud_pool_esperas_total': ('counter', 'Checkouts do pool', pool['esperas']),
+        'crud_pool_espera_media_segundos': ('gauge', 'Espera media por conexao', round(pool['espera_media_ms'] / 1000, 6)),
+        'crud_pool_espera_max_segundos': ('gauge', 'Maior espera por conexao', round(pool['espera_max_ms'] / 1000, 6)),
+        'crud_pool_timeouts_total': ('counter', 'Checkouts que estouraram DB_POOL_TIMEOUT', pool['timeouts']),
+    }
+    if 'checkedout' in pool:
+        extras['crud_pool_conexoes_em_uso'] = ('gauge', 'Conexoes emprestadas agora', pool['checkedout'])
+        extras['crud_pool_overflow'] = ('gauge', 'Conexoes alem do pool_size', pool['overflow'])
+    if 'checkedout' in pool.get('sync', {}):
+        extras['crud_pool_sync_conexoes_em_uso'] = (
+            'gauge', 'Conexoes emprestadas agora do pool sync (DB_MODE=async)', pool['sync']['checkedout'],
+        )
+    extras['crud_pool_espera_recente_segundos'] = (
+        'gauge', 'Media recente da espera por conexao (controle de admissao)',
+        round(pool['espera_recente_ms'] / 1000, 6),
+    )
+    extras['crud_requisicoes_em_andamento'] = ('gauge', 'Requisicoes em andamento no worker', admissao.em_andamento)
+    extras['crud_admissao_recusadas_total'] = ('counter', 'Requisicoes recusadas com 503 na entrada', admissao.recusadas)
+    extras['crud_rate_limit_recusadas_total'] = ('counter', 'Escritas recusadas com 429', limitador.recusadas)
+    extras['crud_compactacao_apagados_total'] = ('counter', 'Lapides apagadas de vez', compactador.apagados)
+    extras['crud_compactacao_adiadas_total'] = ('counter', 'Compactacoes adiadas por trafego', compactador.adiadas)
+    coalescencia = estatisticas_coalescencia(voo_unico, voo_unico_async)
+    extras['crud_leituras_lideres_total'] = ('counter', 'Leituras por id/nome que foram ao banco', coalescencia['lideres'])
+    extras['crud_leituras_coalescidas_total'] = (
+        'counter', 'Leituras que esperaram a consulta igual em andamento', coalescencia['coalescidas'],
+    )
+    eventos = barramento.estatisticas()
+    extras['crud_eventos_assinantes'] = ('gauge', 'Conexoes SSE/WebSocket de eventos', eventos['assinantes'])
+    extras['crud_eventos_publicados_total'] = ('counter', 'Eventos de usuario publicados', eventos['publicados'])
+    extras['crud_eventos_descartados_total'] = (
+        'counter', 'Eventos jogados fora por fila cheia de assinante', eventos['descartados'],
+    )
+    extras['crud_eventos_desconectados_total'] = (
+        'counter', 'Assinantes desconectados por fila cheia', eventos['desconectados'],
+    )
+    replicas = get_replicas()
+    if replicas is not None:
+        estado = replicas.estatisticas()
+        extras['crud_replicas_saudaveis'] = (
+            'gauge', 'Replicas de leitura na roda', sum(r['saudavel'] for r in estado['replicas']),
+        )
+        extras['crud_replicas_leituras_total'] = (
+            'counter', 'Leituras atendidas por replica', sum(r['leituras'] for r in estado['replicas']),
+        )
+        extras['crud_replicas_leituras_primario_total'] = (
+            'counter', 'Leituras que cairam no primario sem replica saudavel', estado['leituras_primario'],
+        )
+    for nome in ('hits', 'misses', 'evictions', 'expirados'):
+        if isinstance(cache.get(nome), (int, float)):
+            extras[f'crud_cache_{nome}_total'] = ('counter', f'Cache de usuarios: {nome}', cache[nome])
+    return PlainTextResponse(metricas.exporta(extras), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get("/metrics/pool", status_code=HTTPStatus.OK)
+def get_metricas_pool():
+    # Conexoes em uso, overflow e tempo de espera pelo pool (do primario; a
+    # espera soma as replicas e, no modo async, o pool sync tambem), mais o
+    # estado das replicas
+    status = status_pool()
+    replicas = get_replicas()
+    if replicas is not None:
+        status['replicas'] = replicas.estatisticas()
+    return status
+
+@app.get("/metrics/cache", status_code=HTTPStatus.OK)
+def get_metricas_cache():
+    # Hits, misses e evictions do cache de leituras de usuario, mais quantas
+    # leituras foram juntadas pelo single-flight
+    return {**cache_usuarios.estatisticas(), **estatisticas_coalescencia(voo_unico, voo_unico_async)}
+
+
+if settings.DB_MODE == 'async':
+    from rotas_async import rotas as rotas_usuarios
+else:
+    rotas_usuarios = rotas
+
+app.include_router(rotas_usuarios)
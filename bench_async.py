@@ -0,0 +1,81 @@
+# Teste de carga comparando DB_MODE=sync e DB_MODE=async.
+# Roda o app em processo (ASGI) com muitas requisicoes ao mesmo tempo.
+# Uso: python bench_async.py [conexoes] [segundos]
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+USUARIOS = 10_000
+# Requisicao que passar disso conta como erro (no modo sync com muitas conexoes
+# o threadpool e o pool do banco travam um ao outro e tudo fica esperando)
+TIMEOUT = 5.0
+
+
+async def carga(conexoes: int, segundos: float) -> dict:
+    import httpx
+
+    from app import app
+
+    # Erro do app (ex: timeout do pool) vira 500 e entra na contagem de erros
+    transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    feitas = 0
+    erros = 0
+    fim = time.perf_counter() + segundos
+
+    async with httpx.AsyncClient(transport=transporte, base_url='http://bench') as client:
+        async def conexao():
+            nonlocal feitas, erros
+            while time.perf_counter() < fim:
+                try:
+                    resposta = await asyncio.wait_for(
+                        client.get(f'/usuarios/{random.randint(1, USUARIOS)}'), TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    erros += 1
+                    continue
+                if resposta.status_code == 200:
+                    feitas += 1
+                else:
+                    erros += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(conexao() for _ in range(conexoes)))
+        duracao = time.perf_counter() - inicio
+
+    return {
+        'modo': os.environ['DB_MODE'],
+        'conexoes': conexoes,
+        'requisicoes': feitas,
+        'erros': erros,
+        'req_por_segundo': round(feitas / duracao, 1),
+    }
+
+
+def roda_modo(modo: str, conexoes: int, segundos: float) -> dict:
+    env = dict(os.environ, DB_MODE=modo)
+    saida = subprocess.run(
+        [sys.executable, __file__, '--filho', str(conexoes), str(segundos)],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--filho']:
+        resultado = asyncio.run(carga(int(sys.argv[2]), float(sys.argv[3])))
+        print(json.dumps(resultado), flush=True)
+        # Nao espera as threads que ficaram presas no pool
+        os._exit(0)
+
+    from bench_comum import prepara_banco
+
+    conexoes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    segundos = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    prepara_banco(USUARIOS)
+
+    for modo in ('sync', 'async'):
+        print(roda_modo(modo, conexoes, segundos))
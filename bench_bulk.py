@@ -0,0 +1,47 @@
+# Importacao de 100k usuarios pelo POST /usuarios/bulk comparada com POST /usuarios
+# um por um (o um por um roda com uma amostra e e extrapolado).
+# Uso: python bench_bulk.py [linhas]
+import json
+import os
+import sys
+import time
+
+from bench_comum import prepara_banco
+
+LINHAS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+AMOSTRA_INDIVIDUAL = 1_000
+
+# Aqui interessa o custo do banco, nao o do hash de senha (ver bench_hash.py)
+os.environ.setdefault('HASH_SCHEME', 'pbkdf2_sha256')
+os.environ.setdefault('PBKDF2_ITERATIONS', '1')
+# Todas as requisicoes saem do mesmo "IP"
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'desligado')
+
+prepara_banco(0)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import app  # noqa: E402
+
+client = TestClient(app)
+
+corpo = '\n'.join(
+    json.dumps({'username': f'bulk{i}', 'email': f'bulk{i}@bench.com', 'password': f'senha{i}x'})
+    for i in range(LINHAS)
+)
+
+inicio = time.perf_counter()
+resposta = client.post('/usuarios/bulk', content=corpo, headers={'content-type': 'application/x-ndjson'})
+duracao_bulk = time.perf_counter() - inicio
+resultado = resposta.json()
+assert resultado['criados'] == LINHAS, resultado['erros']
+
+inicio = time.perf_counter()
+for i in range(AMOSTRA_INDIVIDUAL):
+    client.post('/usuarios', json={
+        'username': f'um{i}', 'email': f'um{i}@bench.com', 'password': f'senha{i}x',
+    })
+duracao_um = (time.perf_counter() - inicio) / AMOSTRA_INDIVIDUAL * LINHAS
+
+print(f'bulk: {LINHAS} linhas em {duracao_bulk:.2f}s ({LINHAS / duracao_bulk:,.0f} linhas/s)')
+print(f'um por um (estimado): {duracao_um:.2f}s ({LINHAS / duracao_um:,.0f} linhas/s)')
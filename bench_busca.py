@@ -0,0 +1,32 @@
+# Latencia da busca por prefixo/trecho com 1M de usuarios e o indice de
+# trigramas da migration (meta: p99 abaixo de 10ms por consulta)
+# Uso: python bench_busca.py [usuarios]
+import sys
+
+from bench_comum import mede, prepara_banco
+
+USUARIOS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+prepara_banco(USUARIOS, migracoes=True)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import app  # noqa: E402
+
+client = TestClient(app)
+
+CONSULTAS = [
+    ('prefixo raro', {'q': 'usuario99999', 'modo': 'prefixo'}),
+    ('prefixo comum', {'q': 'usuario1', 'modo': 'prefixo'}),
+    ('prefixo curto', {'q': 'usu', 'modo': 'prefixo'}),
+    ('pagina funda', {'q': 'bench', 'modo': 'contem', 'skip': 5000}),
+    ('trecho raro', {'q': '54321', 'modo': 'contem'}),
+    ('trecho comum', {'q': 'bench', 'modo': 'contem'}),
+    ('sem resultado', {'q': 'ninguem', 'modo': 'contem'}),
+]
+
+for nome, params in CONSULTAS:
+    assert client.get('/usuarios/busca', params=params).status_code == 200
+    resultado = mede(lambda: client.get('/usuarios/busca', params=params))
+    situacao = 'ok' if resultado['p99_ms'] < 10 else 'ACIMA DA META'
+    print(f'{nome:14} {params["q"]!r:16} {resultado} {situacao}')
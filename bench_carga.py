@@ -0,0 +1,281 @@
+# Teste de carga com todas as rotas /usuarios misturadas (leitura e escrita).
+# Roda o app em processo (ASGI) contra um SQLite populado, com N conexoes ao
+# mesmo tempo, e grava vazao e p50/p95/p99 por rota num JSON. Com --comparar
+# confere contra o JSON de outro commit e sai com erro se alguma rota piorou.
+#
+# Uso: python bench_carga.py [--conexoes 20] [--segundos 10] [--saida bench_carga.json]
+#      python bench_carga.py --comparar base.json [--tolerancia 0.15]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from bench_comum import prepara_banco, resumo
+
+# Peso de cada operacao no sorteio (nao precisa somar 100)
+MISTURA = {
+    'ler_id': 30,
+    'ler_nome': 10,
+    'lookup': 4,
+    'listar': 8,
+    'listar_cursor': 8,
+    'buscar': 8,
+    'criar': 8,
+    'atualizar': 6,
+    'parcial': 6,
+    'deletar': 3,
+    'importar': 2,
+    'exportar': 1,
+}
+# Requisicao que passar disso conta como erro
+TIMEOUT = 10.0
+LINHAS_IMPORTACAO = 20
+
+
+class Carga:
+    # Estado de uma conexao: sorteia as operacoes e guarda o que ela criou
+    # (so apaga usuario criado por ela, assim as leituras dos usuarios do
+    # seed nunca dao 404)
+    def __init__(self, numero: int, usuarios: int, semente: int):
+        self.numero = numero
+        self.usuarios = usuarios
+        self.sorteio = random.Random(semente + numero)
+        self.contador = 0
+        self.criados = []
+        self.cursor = ''
+
+    def _novo_nome(self) -> str:
+        self.contador += 1
+        return f'carga{self.numero}x{self.contador}'
+
+    def _id_seed(self) -> int:
+        return self.sorteio.randint(1, self.usuarios)
+
+    async def ler_id(self, client):
+        return await client.get(f'/usuarios/{self._id_seed()}'), (200,)
+
+    async def ler_nome(self, client):
+        return await client.get(f'/usuarios/busca/usuario{self._id_seed() - 1}'), (200,)
+
+    async def lookup(self, client):
+        ids = [self._id_seed() for _ in range(100)]
+        return await client.post('/usuarios/lookup', json={'ids': ids}), (200,)
+
+    async def listar(self, client):
+        skip = self.sorteio.randint(0, max(0, self.usuarios - 50))
+        return await client.get('/usuarios', params={'skip': skip, 'limit': 50}), (200,)
+
+    async def listar_cursor(self, client):
+        # Cada conexao vai andando pelas paginas e volta pro inicio no fim
+        resposta = await client.get('/usuarios', params={
+            'paginacao': 'cursor', 'cursor': self.cursor, 'limit': 50,
+        })
+        if resposta.status_code == 200:
+            self.cursor = resposta.json()['next_cursor'] or ''
+        return resposta, (200,)
+
+    async def buscar(self, client):
+        termo = f'usuario{self.sorteio.randint(100, 999)}'
+        modo = self.sorteio.choice(('prefixo', 'contem'))
+        return await client.get('/usuarios/busca', params={'q': termo, 'modo': modo}), (200,)
+
+    async def criar(self, client):
+        nome = self._novo_nome()
+        resposta = await client.post('/usuarios', json={
+            'username': nome, 'email': f'{nome}@bench.com', 'password': 'senha123',
+        })
+        if resposta.status_code == 201:
+            self.criados.append(resposta.json()['id'])
+        return resposta, (201,)
+
+    async def atualizar(self, client):
+        id = self._id_seed()
+        return await client.put(f'/usuarios/{id}', json={
+            'username': f'usuario{id - 1}',
+            'email': f'usuario{id - 1}@bench.com',
+            'password': f'senha{self.sorteio.randint(0, 999)}abc',
+        }), (200,)
+
+    async def parcial(self, client):
+        id = self._id_seed()
+        email = self.sorteio.choice((f'usuario{id - 1}@bench.com', f'usuario{id - 1}@outro.com'))
+        return await client.patch(f'/usuarios/{id}', json={'email': email}), (200,)
+
+    async def deletar(self, client):
+        if not self.criados:
+            return await self.criar(client)
+        id = self.criados.pop(self.sorteio.randrange(len(self.criados)))
+        return await client.delete(f'/usuarios/{id}'), (200,)
+
+    async def importar(self, client):
+        linhas = []
+        for _ in range(LINHAS_IMPORTACAO):
+            nome = self._novo_nome()
+            linhas.append(json.dumps({'username': nome, 'email': f'{nome}@bench.com', 'password': 'senha123'}))
+        return await client.post('/usuarios/bulk', content='\n'.join(linhas)), (200,)
+
+    async def exportar(self, client):
+        return await client.get('/usuarios/export'), (200,)
+
+
+async def roda(args) -> dict:
+    import httpx
+
+    from app import app
+
+    operacoes = [nome for nome in MISTURA if MISTURA[nome] > 0]
+    pesos = [MISTURA[nome] for nome in operacoes]
+    tempos = {nome: [] for nome in operacoes}
+    erros = {nome: 0 for nome in operacoes}
+    status = {nome: {} for nome in operacoes}
+    medindo = False
+
+    # Erro do app vira 500 e entra na contagem de erros
+    transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transporte, base_url='http://bench') as client:
+        async def conexao(carga: Carga, fim: float):
+            while time.perf_counter() < fim:
+                nome = carga.sorteio.choices(operacoes, pesos)[0]
+                inicio = time.perf_counter()
+                try:
+                    resposta, esperado = await asyncio.wait_for(getattr(carga, nome)(client), TIMEOUT)
+                    codigo = resposta.status_code
+                except asyncio.TimeoutError:
+                    codigo, esperado = 'timeout', ()
+                if not medindo:
+                    continue
+                tempos[nome].append((time.perf_counter() - inicio) * 1000)
+                status[nome][str(codigo)] = status[nome].get(str(codigo), 0) + 1
+                if codigo not in esperado:
+                    erros[nome] += 1
+
+        cargas = [Carga(i, args.usuarios, args.semente) for i in range(args.conexoes)]
+
+        # Aquecimento: enche cache, pool e statement cache sem medir
+        if args.aquecimento > 0:
+            fim = time.perf_counter() + args.aquecimento
+            await asyncio.gather(*(conexao(carga, fim) for carga in cargas))
+
+        medindo = True
+        inicio = time.perf_counter()
+        fim = inicio + args.segundos
+        await asyncio.gather(*(conexao(carga, fim) for carga in cargas))
+        duracao = time.perf_counter() - inicio
+
+    rotas = {}
+    for nome in operacoes:
+        if not tempos[nome]:
+            continue
+        rotas[nome] = {
+            **resumo(tempos[nome]),
+            'erros': erros[nome],
+            'req_por_segundo': round(len(tempos[nome]) / duracao, 1),
+            'status': status[nome],
+        }
+    todos = [tempo for lista in tempos.values() for tempo in lista]
+    return {
+        'total': {
+            **resumo(todos),
+            'erros': sum(erros.values()),
+            'req_por_segundo': round(len(todos) / duracao, 1),
+        },
+        'rotas': rotas,
+    }
+
+
+def commit_atual() -> str | None:
+    try:
+        saida = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return saida.stdout.strip()
+
+
+def compara(atual: dict, base: dict, tolerancia: float) -> list[str]:
+    # Piorou se o p95 subiu ou a vazao caiu mais que a tolerancia
+    problemas = []
+    for nome, dados in atual['rotas'].items():
+        anterior = base['rotas'].get(nome)
+        if anterior is None:
+            continue
+        if dados['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+            problemas.append(f'{nome}: p95 {anterior["p95_ms"]}ms -> {dados["p95_ms"]}ms')
+        if dados['req_por_segundo'] < anterior['req_por_segundo'] * (1 - tolerancia):
+            problemas.append(f'{nome}: vazao {anterior["req_por_segundo"]} -> {dados["req_por_segundo"]} req/s')
+        if dados['erros'] > anterior['erros']:
+            problemas.append(f'{nome}: erros {anterior["erros"]} -> {dados["erros"]}')
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga das rotas /usuarios')
+    parser.add_argument('--usuarios', type=int, default=10_000, help='usuarios no banco antes da carga')
+    parser.add_argument('--conexoes', type=int, default=20)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--aquecimento', type=float, default=2)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--modo', choices=('sync', 'async'), default=os.environ.get('DB_MODE', 'sync'))
+    parser.add_argument('--hash-real', action='store_true',
+                        help='usa o hash de senha configurado (por padrao usa um barato, ver bench_hash.py)')
+    parser.add_argument('--saida', default='bench_carga.json')
+    parser.add_argument('--comparar', help='JSON de outra rodada pra comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.15)
+    args = parser.parse_args()
+
+    os.environ['DB_MODE'] = args.modo
+    if not args.hash_real:
+        os.environ.setdefault('HASH_SCHEME', 'pbkdf2_sha256')
+        os.environ.setdefault('PBKDF2_ITERATIONS', '1')
+    # Todas as conexoes saem do mesmo "IP"; o que se mede aqui e o app, nao o limite
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'desligado')
+    prepara_banco(args.usuarios, migracoes=True)
+
+    resultado = {
+        'commit': commit_atual(),
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {
+            'usuarios': args.usuarios,
+            'conexoes': args.conexoes,
+            'segundos': args.segundos,
+            'semente': args.semente,
+            'db_mode': args.modo,
+            'hash': os.environ.get('HASH_SCHEME', 'padrao'),
+            'mistura': MISTURA,
+        },
+        **asyncio.run(roda(args)),
+    }
+
+    with open(args.saida, 'w') as arquivo:
+        json.dump(resultado, arquivo, indent=2)
+
+    print(f'{"rota":14} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"erros":>6}')
+    for nome, dados in [*resultado['rotas'].items(), ('TOTAL', resultado['total'])]:
+        print(f'{nome:14} {dados["req_por_segundo"]:8} {dados["p50_ms"]:8} '
+              f'{dados["p95_ms"]:8} {dados["p99_ms"]:8} {dados["erros"]:6}')
+    print(f'resultado em {args.saida}')
+
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            base = json.load(arquivo)
+        if base.get('config') != resultado['config']:
+            print('aviso: configuracao diferente da rodada base, a comparacao pode nao valer')
+        problemas = compara(resultado, base, args.tolerancia)
+        for problema in problemas:
+            print(f'PIOROU {problema}')
+        if problemas:
+            sys.exit(1)
+        print(f'sem regressao em relacao a {base.get("commit") or args.comparar}')
+
+
+if __name__ == '__main__':
+    main()
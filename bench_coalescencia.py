@@ -0,0 +1,71 @@
+# Pico de leituras do mesmo usuario com o cache desligado: compara quantas
+# consultas e checkouts do pool sao feitos com e sem o single-flight
+# (COALESCENCIA_ATIVA), nos dois DB_MODE.
+# Uso: python bench_coalescencia.py [requisicoes_simultaneas] [rodadas]
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+USUARIOS = 1_000
+
+
+async def pico(simultaneas: int, rodadas: int) -> dict:
+    import httpx
+
+    from app import app
+    from database import status_pool
+    from metricas import metricas
+
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url='http://bench') as client:
+        # Aquece o app (rotas, pool) antes de zerar as contagens
+        await client.get('/usuarios/2')
+        consultas_antes = metricas.consultas['SELECT'].total
+        checkouts_antes = status_pool()['esperas']
+
+        inicio = time.perf_counter()
+        for rodada in range(rodadas):
+            # Todo mundo pede o mesmo perfil ao mesmo tempo
+            respostas = await asyncio.gather(*(
+                client.get(f'/usuarios/{rodada % USUARIOS + 1}') for _ in range(simultaneas)
+            ))
+            assert all(r.status_code == 200 for r in respostas)
+        duracao = time.perf_counter() - inicio
+
+    total = simultaneas * rodadas
+    return {
+        'modo': os.environ['DB_MODE'],
+        'coalescencia': os.environ['COALESCENCIA_ATIVA'],
+        'requisicoes': total,
+        'consultas': metricas.consultas['SELECT'].total - consultas_antes,
+        'checkouts_pool': status_pool()['esperas'] - checkouts_antes,
+        'req_por_segundo': round(total / duracao, 1),
+    }
+
+
+def roda(modo: str, ativa: bool, simultaneas: int, rodadas: int) -> dict:
+    env = dict(os.environ, DB_MODE=modo, COALESCENCIA_ATIVA=str(ativa).lower(), CACHE_BACKEND='desligado')
+    saida = subprocess.run(
+        [sys.executable, __file__, '--filho', str(simultaneas), str(rodadas)],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--filho']:
+        print(json.dumps(asyncio.run(pico(int(sys.argv[2]), int(sys.argv[3])))))
+        sys.exit(0)
+
+    from bench_comum import prepara_banco
+
+    simultaneas = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rodadas = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    prepara_banco(USUARIOS)
+
+    for modo in ('sync', 'async'):
+        for ativa in (False, True):
+            print(roda(modo, ativa, simultaneas, rodadas))
@@ -0,0 +1,69 @@
+# GET /usuarios?limit=100 em cada formato: JSON sem compressao, gzip/br/zstd,
+# fields=id,username e MessagePack. Pra cada um mostra os bytes que vao pela
+# rede e a CPU por requisicao (process_time da rota inteira, cliente incluso),
+# e depois o custo so de codificar/comprimir o corpo.
+# Os nomes do prepara_banco (usuario0, usuario1...) comprimem bem demais, entao
+# os usuarios ganham nomes e emails aleatorios antes de medir.
+# Uso: python bench_compressao.py [por_pagina]
+import random
+import string
+import sys
+import time
+
+from bench_comum import mede, prepara_banco
+
+POR_PAGINA = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+REPETICOES = 300
+
+prepara_banco(1000)
+
+import msgpack  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import update  # noqa: E402
+
+from app import app  # noqa: E402
+from compressao import CODIFICADORES  # noqa: E402
+from database import get_engine  # noqa: E402
+from models import User  # noqa: E402
+
+sorteio = random.Random(0)
+dominios = ['gmail.com', 'hotmail.com', 'outlook.com', 'yahoo.com.br', 'uol.com.br']
+with get_engine().begin() as conn:
+    for id in range(1, 1001):
+        nome = ''.join(sorteio.choices(string.ascii_lowercase, k=sorteio.randint(5, 12))) + str(sorteio.randint(1, 999))
+        conn.execute(update(User).where(User.id == id).values(
+            username=nome, email=f'{nome}.{sorteio.randint(1, 99)}@{sorteio.choice(dominios)}',
+        ))
+
+client = TestClient(app)
+URL = f'/usuarios?limit={POR_PAGINA}'
+CASOS = [
+    ('json', URL, {'accept-encoding': 'identity'}),
+    ('json gzip', URL, {'accept-encoding': 'gzip'}),
+    ('json br', URL, {'accept-encoding': 'br'}),
+    ('json zstd', URL, {'accept-encoding': 'zstd'}),
+    ('fields=id,username', URL + '&fields=id,username', {'accept-encoding': 'identity'}),
+    ('fields=id,username br', URL + '&fields=id,username', {'accept-encoding': 'br'}),
+    ('msgpack', URL, {'accept': 'application/msgpack', 'accept-encoding': 'identity'}),
+    ('msgpack br', URL, {'accept': 'application/msgpack', 'accept-encoding': 'br'}),
+    ('msgpack zstd', URL, {'accept': 'application/msgpack', 'accept-encoding': 'zstd'}),
+]
+
+print(f'rota inteira, {POR_PAGINA} usuarios, {REPETICOES} requisicoes')
+for nome, url, cabecalhos in CASOS:
+    resposta = client.get(url, headers=cabecalhos)
+    assert resposta.status_code == 200, resposta.text
+    # Content-Length e o tamanho na rede (o httpx ja devolve o corpo descomprimido)
+    tamanho = int(resposta.headers['content-length'])
+    inicio = time.process_time()
+    for _ in range(REPETICOES):
+        client.get(url, headers=cabecalhos)
+    cpu = (time.process_time() - inicio) * 1000 / REPETICOES
+    print(f'  {nome:24} {tamanho:7} bytes  {cpu:6.3f} ms de CPU/req  ({resposta.headers.get("content-encoding", "identity")})')
+
+print('so codificar/comprimir o corpo')
+corpo = client.get(URL, headers={'accept-encoding': 'identity'}).content
+dados = client.get(URL).json()
+print(f'  msgpack.packb:  {len(msgpack.packb(dados)):7} bytes  {mede(lambda: msgpack.packb(dados), 2000)}')
+for algoritmo, (um_so, _, _) in CODIFICADORES.items():
+    print(f'  {algoritmo:14} {len(um_so(corpo)):7} bytes  {mede(lambda: um_so(corpo), 2000)}')
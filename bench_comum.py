@@ -0,0 +1,68 @@
+# Funcoes usadas pelos scripts bench_*.py
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+
+from models import User, table_registry
+
+
+def prepara_banco(quantidade: int, caminho: str | None = None, migracoes: bool = False) -> str:
+    # Cria um banco SQLite temporario com `quantidade` usuarios e aponta o
+    # DATABASE_URL pra ele. Tem que rodar antes de importar app/database.
+    # Com migracoes=True o schema vem do alembic (indices, FTS...) em vez do
+    # create_all dos models.
+    if caminho is None:
+        caminho = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    url = f'sqlite:///{caminho}'
+    os.environ['DATABASE_URL'] = url
+
+    engine = create_engine(url)
+    if migracoes:
+        from alembic import command
+        from alembic.config import Config
+
+        command.upgrade(Config(os.path.join(os.path.dirname(__file__), 'alembic.ini')), 'head')
+    else:
+        table_registry.metadata.create_all(engine)
+    with engine.begin() as conn:
+        lote = []
+        for i in range(quantidade):
+            lote.append({
+                'username': f'usuario{i}',
+                'email': f'usuario{i}@bench.com',
+                'password': f'senha{i}abc',
+            })
+            if len(lote) == 10_000:
+                conn.execute(insert(User), lote)
+                lote = []
+        if lote:
+            conn.execute(insert(User), lote)
+    engine.dispose()
+    return url
+
+
+def mede(funcao, repeticoes: int = 50) -> dict:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return resumo(tempos)
+
+
+def resumo(tempos_ms: list[float]) -> dict:
+    tempos = sorted(tempos_ms)
+
+    def percentil(p):
+        return tempos[min(len(tempos) - 1, int(len(tempos) * p / 100))]
+
+    return {
+        'n': len(tempos),
+        'media_ms': round(statistics.fmean(tempos), 3),
+        'p50_ms': round(percentil(50), 3),
+        'p95_ms': round(percentil(95), 3),
+        'p99_ms': round(percentil(99), 3),
+    }
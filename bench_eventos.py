@@ -0,0 +1,180 @@
+# Latencia do fan-out de eventos (eventos.py) com muitos clientes conectados.
+# Sobe o app num uvicorn separado, abre --clientes conexoes SSE (ou WebSocket)
+# e faz --eventos PATCHs, um por vez. Pra cada evento mede o tempo do envio do
+# PATCH ate cada cliente receber e ate o ultimo cliente receber.
+# --transporte barramento mede so o barramento, sem rede nem uvicorn.
+#
+# Uso: python bench_eventos.py [--clientes 5000] [--eventos 20] [--transporte sse|ws|barramento]
+# (precisa de ulimit -n maior que o numero de clientes; ws precisa do pacote websockets)
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench_comum import prepara_banco, resumo
+
+PORTA = 8799
+
+
+async def cliente_sse(chegadas: dict, prontos: list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORTA)
+    writer.write(b'GET /usuarios/eventos HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n')
+    await writer.drain()
+    await reader.readuntil(b'\r\n\r\n')
+    prontos.append(1)
+    try:
+        # O corpo vem em chunked; as linhas 'data: ' sempre comecam linha
+        while linha := await reader.readline():
+            if linha.startswith(b'data: '):
+                chegadas.setdefault(json.loads(linha[6:])['seq'], []).append(time.perf_counter())
+    finally:
+        writer.close()
+
+
+async def cliente_ws(chegadas: dict, prontos: list):
+    import websockets
+
+    async with websockets.connect(f'ws://127.0.0.1:{PORTA}/usuarios/eventos/ws', ping_interval=None) as ws:
+        prontos.append(1)
+        async for mensagem in ws:
+            chegadas.setdefault(json.loads(mensagem)['seq'], []).append(time.perf_counter())
+
+
+async def conecta(cliente, quantidade: int, chegadas: dict):
+    # Abre as conexoes aos poucos pra nao estourar o backlog do listen
+    prontos = []
+    tarefas = []
+    limite = asyncio.Semaphore(200)
+
+    async def abre():
+        async with limite:
+            while True:
+                antes = len(prontos)
+                tarefa = asyncio.create_task(cliente(chegadas, prontos))
+                while len(prontos) == antes and not tarefa.done():
+                    await asyncio.sleep(0.005)
+                if len(prontos) > antes:
+                    tarefas.append(tarefa)
+                    return
+                await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(abre() for _ in range(quantidade)))
+    print(f'{quantidade} clientes conectados em {time.perf_counter() - inicio:.1f}s', flush=True)
+    return tarefas
+
+
+async def mede_http(args):
+    chegadas = {}
+    cliente = cliente_ws if args.transporte == 'ws' else cliente_sse
+    tarefas = await conecta(cliente, args.clientes, chegadas)
+    latencias = []
+    ultimos = []
+    perdidos = 0
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{PORTA}') as http:
+        seq = 0
+        for numero in range(args.eventos):
+            seq += 1
+            inicio = time.perf_counter()
+            resposta = await http.patch('/usuarios/1', json={'email': f'evento{numero}@bench.com'})
+            assert resposta.status_code == 200, resposta.text
+            # Espera todo mundo receber (ou desiste depois de 10s)
+            limite = inicio + 10
+            while len(chegadas.get(seq, ())) < args.clientes and time.perf_counter() < limite:
+                await asyncio.sleep(0.001)
+            recebidos = chegadas.get(seq, [])
+            perdidos += args.clientes - len(recebidos)
+            latencias += [(chegada - inicio) * 1000 for chegada in recebidos]
+            if recebidos:
+                ultimos.append((max(recebidos) - inicio) * 1000)
+            await asyncio.sleep(args.intervalo)
+        metricas = (await http.get('/metrics')).text
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+    return latencias, ultimos, perdidos, [linha for linha in metricas.splitlines() if linha.startswith('crud_eventos')]
+
+
+async def mede_barramento(args):
+    from eventos import Barramento
+
+    barramento = Barramento(1000, 'descarta')
+    chegadas = {}
+
+    async def assinante():
+        assinatura = barramento.assina()
+        while True:
+            for evento in await assinatura.espera(60):
+                chegadas.setdefault(evento.seq, []).append(time.perf_counter())
+
+    tarefas = [asyncio.create_task(assinante()) for _ in range(args.clientes)]
+    await asyncio.sleep(0.1)
+    latencias = []
+    ultimos = []
+    for seq in range(1, args.eventos + 1):
+        inicio = time.perf_counter()
+        barramento.publica('atualizado', {'id': 1, 'username': 'usuario0', 'email': f'evento{seq}@bench.com'})
+        while len(chegadas.get(seq, ())) < args.clientes:
+            await asyncio.sleep(0)
+        recebidos = chegadas[seq]
+        latencias += [(chegada - inicio) * 1000 for chegada in recebidos]
+        ultimos.append((max(recebidos) - inicio) * 1000)
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+    return latencias, ultimos, 0, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latencia do fan-out de eventos')
+    parser.add_argument('--clientes', type=int, default=5000)
+    parser.add_argument('--eventos', type=int, default=20)
+    parser.add_argument('--intervalo', type=float, default=0.2, help='segundos entre um evento e o proximo')
+    parser.add_argument('--transporte', choices=('sse', 'ws', 'barramento'), default='sse')
+    parser.add_argument('--modo', choices=('sync', 'async'), default=os.environ.get('DB_MODE', 'sync'))
+    args = parser.parse_args()
+
+    if args.transporte == 'barramento':
+        latencias, ultimos, perdidos, metricas = asyncio.run(mede_barramento(args))
+    else:
+        prepara_banco(10, migracoes=True)
+        ambiente = {
+            **os.environ,
+            'DB_MODE': args.modo,
+            'RATE_LIMIT_BACKEND': 'desligado',
+            'COMPACTACAO_ATIVA': 'false',
+            'EVENTOS_MAX_ASSINANTES': str(args.clientes + 100),
+        }
+        servidor = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(PORTA),
+             '--backlog', '4096', '--log-level', 'warning', '--no-access-log'],
+            env=ambiente, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        try:
+            for _ in range(200):
+                try:
+                    httpx.get(f'http://127.0.0.1:{PORTA}/metrics/cache')
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            latencias, ultimos, perdidos, metricas = asyncio.run(mede_http(args))
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+    print(f'{args.transporte}, {args.clientes} clientes, {args.eventos} eventos')
+    print('por cliente (envio -> chegada):', resumo(latencias))
+    print('ate o ultimo cliente:          ', resumo(ultimos))
+    if perdidos:
+        print(f'nao recebidos em 10s: {perdidos}')
+    for linha in metricas:
+        print(linha)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Exporta 1M de usuarios de um SQLite local e confere que a memoria (RSS)
+# nao cresce junto com a tabela.
+# Uso: python bench_export.py [linhas] [formato]
+import asyncio
+import sys
+import time
+
+from bench_comum import prepara_banco
+
+LINHAS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+FORMATO = sys.argv[2] if len(sys.argv) > 2 else 'ndjson'
+# Quanto o RSS pode subir durante a exportacao inteira
+LIMITE_MB = 50
+
+prepara_banco(LINHAS)
+
+from app import app  # noqa: E402
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as arquivo:
+        for linha in arquivo:
+            if linha.startswith('VmRSS:'):
+                return int(linha.split()[1]) / 1024
+    return 0.0
+
+
+async def exporta():
+    # Chama o app direto pelo ASGI e joga os bytes fora; o TestClient
+    # guardaria a resposta inteira na memoria e estragaria a medicao
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/usuarios/export',
+        'raw_path': b'/usuarios/export', 'root_path': '',
+        'query_string': f'formato={FORMATO}'.encode(), 'headers': [],
+        'http_version': '1.1', 'scheme': 'http',
+        'server': ('bench', 80), 'client': ('bench', 1234),
+    }
+    estado = {'bytes': 0, 'linhas': 0, 'pico': rss_mb(), 'status': None}
+
+    pedido_enviado = False
+
+    async def receive():
+        # Primeiro o corpo (vazio) do GET, depois fica esperando como um
+        # cliente que nao desconecta
+        nonlocal pedido_enviado
+        if not pedido_enviado:
+            pedido_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(mensagem):
+        if mensagem['type'] == 'http.response.start':
+            estado['status'] = mensagem['status']
+        elif mensagem['type'] == 'http.response.body':
+            corpo = mensagem.get('body', b'')
+            estado['bytes'] += len(corpo)
+            estado['linhas'] += corpo.count(b'\n')
+            estado['pico'] = max(estado['pico'], rss_mb())
+
+    await app(scope, receive, send)
+    return estado
+
+
+antes = rss_mb()
+inicio = time.perf_counter()
+estado = asyncio.run(exporta())
+duracao = time.perf_counter() - inicio
+crescimento = estado['pico'] - antes
+
+print(f'status {estado["status"]}, {estado["linhas"]:,} linhas, {estado["bytes"] / 1e6:.1f} MB em {duracao:.1f}s')
+print(f'RSS antes {antes:.1f} MB, pico {estado["pico"]:.1f} MB (+{crescimento:.1f} MB)')
+assert estado['status'] == 200
+assert crescimento < LIMITE_MB, f'RSS subiu {crescimento:.1f} MB durante a exportacao'
@@ -0,0 +1,58 @@
+# Vazao do hash de senha e latencia do POST /usuarios com cadastros simultaneos.
+# Uso: python bench_hash.py [cadastros_simultaneos]
+# (HASH_SCHEME, HASH_MAX_WORKERS etc. vem do ambiente/.env como no app)
+import asyncio
+import os
+import sys
+import time
+
+from bench_comum import prepara_banco, resumo
+
+SIMULTANEOS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+HASHES = 100
+
+# Todos os cadastros saem do mesmo "IP"
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'desligado')
+prepara_banco(0)
+
+import httpx  # noqa: E402
+
+from app import app  # noqa: E402
+from seguranca import senhas  # noqa: E402
+from settings import get_settings  # noqa: E402
+
+settings = get_settings()
+
+inicio = time.perf_counter()
+for i in range(HASHES):
+    senhas.padrao.gera(f'senha{i}')
+serial = HASHES / (time.perf_counter() - inicio)
+
+inicio = time.perf_counter()
+senhas.gera_varios([f'senha{i}' for i in range(HASHES)])
+no_pool = HASHES / (time.perf_counter() - inicio)
+
+print(f'esquema {settings.HASH_SCHEME}, {settings.HASH_MAX_WORKERS} threads')
+print(f'hashes/s em uma thread: {serial:.1f}')
+print(f'hashes/s no pool: {no_pool:.1f}')
+
+
+async def cadastros():
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url='http://bench') as client:
+        async def cadastra(i):
+            comeco = time.perf_counter()
+            resposta = await client.post('/usuarios', json={
+                'username': f'novo{i}', 'email': f'novo{i}@bench.com', 'password': f'senha{i}x',
+            })
+            return resposta.status_code, (time.perf_counter() - comeco) * 1000
+
+        return await asyncio.gather(*(cadastra(i) for i in range(SIMULTANEOS)))
+
+
+resultados = asyncio.run(cadastros())
+status = {}
+for codigo, _ in resultados:
+    status[codigo] = status.get(codigo, 0) + 1
+print(f'{SIMULTANEOS} cadastros simultaneos ({settings.DB_MODE}): status {status}')
+print(f'latencia dos criados: {resumo([ms for codigo, ms in resultados if codigo == 201])}')
@@ -0,0 +1,80 @@
+# Tempo do import do app ate ele estar pronto pra responder.
+# Cada rodada e um processo novo (import frio): mede o import do app, o
+# startup do lifespan (aquecimento do pool e das consultas) e as duas
+# primeiras requisicoes, com AQUECIMENTO_ATIVO ligado e desligado.
+#
+# Uso: python bench_inicio.py [--rodadas 5] [--modo sync|async]
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_comum import prepara_banco
+
+USUARIOS = 10_000
+
+
+def filho():
+    # Roda dentro do processo novo e imprime os tempos em JSON
+    import httpx
+
+    inicio = time.perf_counter()
+    from app import app
+
+    importado = time.perf_counter()
+
+    async def mede():
+        tempos = {'import_ms': (importado - inicio) * 1000}
+        async with app.router.lifespan_context(app):
+            tempos['startup_ms'] = (time.perf_counter() - importado) * 1000
+            transporte = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transporte, base_url='http://bench') as client:
+                for nome, id in (('primeira_ms', 1), ('segunda_ms', 2)):
+                    antes = time.perf_counter()
+                    resposta = await client.get(f'/usuarios/{id}')
+                    assert resposta.status_code == 200, resposta.text
+                    tempos[nome] = (time.perf_counter() - antes) * 1000
+            tempos['pronto_ms'] = tempos['import_ms'] + tempos['startup_ms'] + tempos['primeira_ms']
+        return tempos
+
+    print(json.dumps(asyncio.run(mede())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de import ate o app ficar pronto')
+    parser.add_argument('--rodadas', type=int, default=5)
+    parser.add_argument('--modo', choices=('sync', 'async'), default=os.environ.get('DB_MODE', 'sync'))
+    parser.add_argument('--filho', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.filho:
+        filho()
+        return
+
+    prepara_banco(USUARIOS, migracoes=True)
+    print(f'{args.rodadas} rodadas, {args.modo}, mediana em ms')
+    print(f'{"aquecimento":12} {"import":>8} {"startup":>8} {"1a req":>8} {"2a req":>8} {"pronto":>8}')
+    for aquecimento in ('true', 'false'):
+        ambiente = {
+            **os.environ,
+            'DB_MODE': args.modo,
+            'AQUECIMENTO_ATIVO': aquecimento,
+            'COMPACTACAO_ATIVA': 'false',
+        }
+        rodadas = []
+        for _ in range(args.rodadas):
+            saida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--filho'],
+                env=ambiente, capture_output=True, text=True, check=True,
+            )
+            rodadas.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+        mediana = {nome: statistics.median(r[nome] for r in rodadas) for nome in rodadas[0]}
+        print(f'{aquecimento:12} {mediana["import_ms"]:8.1f} {mediana["startup_ms"]:8.1f} '
+              f'{mediana["primeira_ms"]:8.1f} {mediana["segunda_ms"]:8.1f} {mediana["pronto_ms"]:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
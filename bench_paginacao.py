@@ -0,0 +1,32 @@
+# Compara a latencia da pagina 1000 com OFFSET e com cursor (keyset)
+# Uso: python bench_paginacao.py
+from bench_comum import mede, prepara_banco
+
+POR_PAGINA = 100
+PAGINA = 1000
+
+prepara_banco(POR_PAGINA * (PAGINA + 1))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import app  # noqa: E402
+
+client = TestClient(app)
+
+# Caminha pelas paginas uma vez pra pegar o cursor da pagina 1000
+cursor = ''
+for _ in range(PAGINA - 1):
+    resposta = client.get('/usuarios', params={
+        'paginacao': 'cursor', 'cursor': cursor, 'limit': POR_PAGINA,
+    })
+    cursor = resposta.json()['next_cursor']
+
+offset = mede(lambda: client.get('/usuarios', params={
+    'skip': POR_PAGINA * (PAGINA - 1), 'limit': POR_PAGINA,
+}))
+keyset = mede(lambda: client.get('/usuarios', params={
+    'paginacao': 'cursor', 'cursor': cursor, 'limit': POR_PAGINA,
+}))
+
+print(f'pagina {PAGINA} com offset: {offset}')
+print(f'pagina {PAGINA} com cursor: {keyset}')
@@ -0,0 +1,57 @@
+# Listagem de 100 usuarios: caminho antigo (User do ORM -> response_model com
+# from_attributes -> JSON) contra o novo (colunas como linhas -> TypeAdapter
+# -> Response pronta). Mede so a serializacao e depois a rota inteira.
+# Uso: python bench_serializacao.py [por_pagina]
+import json
+import sys
+from typing import List
+
+from bench_comum import mede, prepara_banco
+
+POR_PAGINA = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+prepara_banco(10_000)
+
+from fastapi import Depends  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import app  # noqa: E402
+from database import get_engine, get_session  # noqa: E402
+from models import User  # noqa: E402
+from regras import COLUNAS_LISTAGEM, monta_lista  # noqa: E402
+from schema import UsuarioPublic  # noqa: E402
+
+modelos = TypeAdapter(List[UsuarioPublic])
+
+
+def antigo(session):
+    # O que o FastAPI faz com response_model=List[UsuarioPublic]
+    users = session.scalars(select(User).limit(POR_PAGINA)).all()
+    validados = modelos.validate_python(users, from_attributes=True)
+    return json.dumps(modelos.dump_python(validados, mode='json'), separators=(',', ':')).encode()
+
+
+def novo(session):
+    return monta_lista(session.execute(select(*COLUNAS_LISTAGEM).limit(POR_PAGINA)).all()).body
+
+
+with Session(get_engine()) as session:
+    assert json.loads(antigo(session)) == json.loads(novo(session))
+    print(f'serializacao antigo: {mede(lambda: antigo(session), 500)}')
+    print(f'serializacao novo:   {mede(lambda: novo(session), 500)}')
+
+
+# Rota antiga montada so aqui pra comparar ponta a ponta
+@app.get('/bench/usuarios-antigo', response_model=List[UsuarioPublic])
+def rota_antiga(limit: int = 100, session: Session = Depends(get_session)):
+    return session.scalars(select(User).limit(limit)).all()
+
+
+client = TestClient(app)
+assert client.get('/bench/usuarios-antigo', params={'limit': POR_PAGINA}).json() == \
+    client.get('/usuarios', params={'limit': POR_PAGINA}).json()
+print(f'rota antiga: {mede(lambda: client.get("/bench/usuarios-antigo", params={"limit": POR_PAGINA}), 300)}')
+print(f'rota nova:   {mede(lambda: client.get("/usuarios", params={"limit": POR_PAGINA}), 300)}')
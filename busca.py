@@ -0,0 +1,73 @@
+# Busca de usuarios por prefixo ou trecho do username/email (GET /usuarios/busca)
+#
+# No SQLite usa a tabela FTS5 users_busca (tokenizer trigram), criada pela
+# migration 81ece3d306d0 e mantida por triggers. No PostgreSQL o ILIKE usa os
+# indices GIN de pg_trgm da mesma migration. Sem o indice (banco criado com
+# create_all, por exemplo) cai num LIKE comum, que varre a tabela.
+from sqlalchemy import column, or_, select, table, text
+from sqlalchemy.orm import Session
+
+from models import User
+
+# Trigrama precisa de pelo menos 3 letras pra usar o indice
+MINIMO_TRIGRAMA = 3
+
+COLUNAS = (User.id, User.username, User.email)
+
+# Tabela FTS5 da migration (fora dos models, o create_all nao cria)
+users_busca = table('users_busca', column('rowid'), column('username'), column('email'))
+
+_tem_fts = {}
+
+
+def _escapa_like(termo: str) -> str:
+    return termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _frase_fts(termo: str) -> str:
+    # Entre aspas o FTS5 trata como texto literal (aspas dentro viram "")
+    return '"' + termo.replace('"', '""') + '"'
+
+
+def _fts_disponivel(session: Session) -> bool:
+    engine = session.get_bind()
+    if engine.url not in _tem_fts:
+        _tem_fts[engine.url] = session.scalar(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_busca'")
+        ) is not None
+    return _tem_fts[engine.url]
+
+
+def _filtro_like(padrao: str, postgres: bool):
+    if postgres:
+        return or_(User.username.ilike(padrao, escape='\\'), User.email.ilike(padrao, escape='\\'))
+    return or_(User.username.like(padrao, escape='\\'), User.email.like(padrao, escape='\\'))
+
+
+def busca_usuarios(session: Session, termo: str, modo: str, skip: int, limit: int):
+    dialeto = session.get_bind().dialect.name
+    escapado = _escapa_like(termo)
+    padrao = escapado + '%' if modo == 'prefixo' else '%' + escapado + '%'
+
+    if dialeto == 'sqlite' and len(termo) >= MINIMO_TRIGRAMA and _fts_disponivel(session):
+        # O FTS5 devolve os rowids ja em ordem, entao a paginacao fica dentro
+        # do MATCH e para nas primeiras linhas mesmo com milhares de acertos.
+        # No modo prefixo o LIKE so confere o comeco das linhas que o indice achou
+        ids = select(users_busca.c.rowid).where(
+            text('users_busca MATCH :frase').bindparams(frase='{username email}: ' + _frase_fts(termo))
+        )
+        # Lapides ainda estao no indice ate a compactacao; sao poucas e saem
+        # pelo indice parcial ix_users_removidos
+        ids = ids.where(users_busca.c.rowid.not_in(select(User.id).where(User.deleted_at.is_not(None))))
+        if modo == 'prefixo':
+            ids = ids.where(or_(
+                users_busca.c.username.like(padrao, escape='\\'),
+                users_busca.c.email.like(padrao, escape='\\'),
+            ))
+        ids = ids.order_by(users_busca.c.rowid).offset(skip).limit(limit)
+        query = select(*COLUNAS).where(User.id.in_(ids))
+    else:
+        query = select(*COLUNAS).where(_filtro_like(padrao, postgres=dialeto == 'postgresql'), User.deleted_at.is_(None))
+        query = query.offset(skip).limit(limit)
+
+    return session.execute(query.order_by(User.id)).all()
@@ -0,0 +1,291 @@
+# Cache das leituras de usuario (GET /usuarios/{id} e /usuarios/busca/{nome})
+#
+# O payload (UsuarioPublic em dict) fica guardado so pela chave do id. A chave
+# do username guarda apenas o id, e na leitura confere se o username do payload
+# ainda bate. Assim, invalidar pelo id ja basta, mesmo que o username tenha
+# mudado e a gente nao saiba qual era o antigo.
+#
+# Corrida leitura x escrita: quem le o banco num miss pega uma marca() antes
+# do SELECT. Toda invalidacao carimba o id com uma geracao nova (contador
+# global), e o guarda() so grava se o id nao foi invalidado depois da marca.
+# Senao um leitor que leu v1 antes do commit de um PUT gravaria v1 depois do
+# invalida() e o dado velho ficaria no cache pelo TTL inteiro.
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from settings import Settings, get_settings
+
+
+class CacheMemoria:
+    # LRU em processo com TTL
+    def __init__(self, max_itens: int, ttl: float):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirados = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        # id -> geracao da ultima invalidacao, limitado a max_itens. O que sai
+        # pela ponta sobe o piso, entao esquecer um id so faz o guarda()
+        # desistir a mais, nunca gravar dado velho
+        self._geracoes = OrderedDict()
+        self._contador = 0
+        self._piso = 0
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            valor, expira_em = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                self.expirados += 1
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def get_varios(self, chaves) -> list:
+        return [self.get(chave) for chave in chaves]
+
+    def _set(self, chave, valor):
+        self._itens[chave] = (valor, time.monotonic() + self.ttl)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._set(chave, valor)
+
+    def delete(self, *chaves):
+        with self._lock:
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def marca(self) -> int:
+        with self._lock:
+            return self._contador
+
+    def invalida_ids(self, ids, chaves):
+        # Carimba os ids e apaga as chaves sob o mesmo lock do set_se_valido
+        with self._lock:
+            for id in ids:
+                self._contador += 1
+                self._geracoes[id] = self._contador
+                self._geracoes.move_to_end(id)
+            while len(self._geracoes) > self.max_itens:
+                _id, geracao = self._geracoes.popitem(last=False)
+                self._piso = max(self._piso, geracao)
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def set_se_valido(self, marca: int, itens_por_id: dict):
+        # itens_por_id: id -> {chave: valor}. Grava so os ids que nao foram
+        # invalidados depois da marca
+        with self._lock:
+            for id, itens in itens_por_id.items():
+                if self._geracoes.get(id, self._piso) > marca:
+                    continue
+                for chave, valor in itens.items():
+                    self._set(chave, valor)
+
+    def estatisticas(self) -> dict:
+        return {
+            'backend': 'memoria',
+            'itens': len(self._itens),
+            'evictions': self.evictions,
+            'expirados': self.expirados,
+        }
+
+
+class CacheRedis:
+    # Qualquer cliente com get/set(ex=)/delete no estilo do redis-py serve
+    # (inclusive o fakeredis pra testar local)
+    def __init__(self, cliente, ttl: float, prefixo: str = 'crud:'):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefixo = prefixo
+
+    def get(self, chave):
+        bruto = self.cliente.get(self.prefixo + chave)
+        return None if bruto is None else json.loads(bruto)
+
+    def get_varios(self, chaves) -> list:
+        # Um MGET so em vez de uma ida ao redis por chave
+        if not chaves:
+            return []
+        brutos = self.cliente.mget([self.prefixo + c for c in chaves])
+        return [None if bruto is None else json.loads(bruto) for bruto in brutos]
+
+    def set(self, chave, valor):
+        self.cliente.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(self.ttl)))
+
+    def delete(self, *chaves):
+        if chaves:
+            self.cliente.delete(*(self.prefixo + c for c in chaves))
+
+    # A geracao vem de um INCR global e cada id invalidado ganha uma chave
+    # usuario:inval:{id} com ela, que vive so o TTL do cache (leitura mais
+    # longa que isso ja nao e uma corrida com a escrita)
+    def marca(self) -> int:
+        return int(self.cliente.get(self.prefixo + 'usuario:geracao') or 0)
+
+    def invalida_ids(self, ids, chaves):
+        pipe = self.cliente.pipeline(transaction=False)
+        if ids:
+            geracao = self.cliente.incr(self.prefixo + 'usuario:geracao')
+            for id in ids:
+                pipe.set(f'{self.prefixo}usuario:inval:{id}', geracao, ex=max(1, int(self.ttl)))
+        if chaves:
+            pipe.delete(*(self.prefixo + c for c in chaves))
+        pipe.execute()
+
+    def set_se_valido(self, marca: int, itens_por_id: dict):
+        # WATCH nas marcas de invalidacao: se um invalida_ids mexer nelas entre
+        # a conferida e o EXEC, a gravacao inteira e descartada
+        if not itens_por_id:
+            return
+        from redis.exceptions import WatchError
+
+        marcas = [f'{self.prefixo}usuario:inval:{id}' for id in itens_por_id]
+        with self.cliente.pipeline() as pipe:
+            try:
+                pipe.watch(*marcas)
+                geracoes = pipe.mget(marcas)
+                pipe.multi()
+                for (id, itens), geracao in zip(itens_por_id.items(), geracoes):
+                    if geracao is not None and int(geracao) > marca:
+                        continue
+                    for chave, valor in itens.items():
+                        pipe.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(self.ttl)))
+                pipe.execute()
+            except WatchError:
+                pass
+
+    def estatisticas(self) -> dict:
+        # Eviction e expiracao acontecem no servidor, ver INFO stats do redis
+        return {'backend': 'redis'}
+
+
+class CacheDesligado:
+    def get(self, chave):
+        return None
+
+    def get_varios(self, chaves) -> list:
+        return [None] * len(chaves)
+
+    def set(self, chave, valor):
+        pass
+
+    def delete(self, *chaves):
+        pass
+
+    def marca(self) -> int:
+        return 0
+
+    def invalida_ids(self, ids, chaves):
+        pass
+
+    def set_se_valido(self, marca: int, itens_por_id: dict):
+        pass
+
+    def estatisticas(self) -> dict:
+        return {'backend': 'desligado'}
+
+
+def _chave_nome(nome: str) -> str:
+    # O username e unico sem diferenciar maiusculas, entao a chave tambem
+    return f'usuario:nome:{nome.lower()}'
+
+
+class CacheUsuarios:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def _conta(self, achou: bool):
+        # Contador aproximado, nao vale um lock por leitura
+        if achou:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def por_id(self, id: int):
+        payload = self.backend.get(f'usuario:id:{id}')
+        self._conta(payload is not None)
+        return payload
+
+    def por_nome(self, nome: str):
+        payload = None
+        id = self.backend.get(_chave_nome(nome))
+        if id is not None:
+            payload = self.backend.get(f'usuario:id:{id}')
+            if payload is not None and payload['username'].lower() != nome.lower():
+                payload = None
+        self._conta(payload is not None)
+        return payload
+
+    def por_ids(self, ids) -> dict:
+        # id -> payload so dos que estavam no cache
+        achados = {}
+        for id, payload in zip(ids, self.backend.get_varios([f'usuario:id:{id}' for id in ids])):
+            if payload is not None:
+                achados[id] = payload
+        self.hits += len(achados)
+        self.misses += len(ids) - len(achados)
+        return achados
+
+    def marca(self) -> int:
+        # Pegar antes do SELECT e passar pro guarda/guarda_varios
+        return self.backend.marca()
+
+    def guarda(self, payload: dict, marca: int):
+        self.guarda_varios([payload], marca)
+
+    def guarda_varios(self, payloads, marca: int):
+        itens = {}
+        for payload in payloads:
+            itens[payload['id']] = {
+                f'usuario:id:{payload["id"]}': payload,
+                _chave_nome(payload['username']): payload['id'],
+            }
+        self.backend.set_se_valido(marca, itens)
+
+    def invalida(self, id: int, *nomes: str):
+        self.backend.invalida_ids([id], [f'usuario:id:{id}', *(_chave_nome(n) for n in nomes)])
+
+    def invalida_varios(self, linhas):
+        # linhas de (id, username); uma ida so ao backend
+        ids, chaves = [], []
+        for id, nome in linhas:
+            ids.append(id)
+            chaves += [f'usuario:id:{id}', _chave_nome(nome)]
+        self.backend.invalida_ids(ids, chaves)
+
+    def estatisticas(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            **self.backend.estatisticas(),
+        }
+
+
+def cria_cache(settings: Settings) -> CacheUsuarios:
+    if settings.CACHE_BACKEND == 'redis':
+        import redis
+
+        cliente = redis.Redis.from_url(settings.REDIS_URL or 'redis://localhost:6379/0')
+        return CacheUsuarios(CacheRedis(cliente, settings.CACHE_TTL))
+    if settings.CACHE_BACKEND == 'memoria':
+        return CacheUsuarios(CacheMemoria(settings.CACHE_MAX_ITENS, settings.CACHE_TTL))
+    return CacheUsuarios(CacheDesligado())
+
+
+cache_usuarios = cria_cache(get_settings())
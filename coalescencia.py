@@ -0,0 +1,116 @@
+# Single-flight das leituras por id/username (GET /usuarios/{id} e
+# /usuarios/busca/{nome})
+#
+# Quando varias requisicoes pedem o mesmo usuario ao mesmo tempo (e ele nao
+# esta no cache), so a primeira (a lider) vai ao banco; as outras esperam o
+# resultado dela. Um pico num perfil popular vira uma consulta e uma conexao
+# do pool em vez de uma por requisicao. O resultado nao fica guardado aqui:
+# acabou a consulta, a chave sai e a proxima leitura ja pega o cache.
+import asyncio
+import threading
+
+from settings import get_settings
+
+
+class _Chamada:
+    __slots__ = ('pronta', 'resultado', 'erro')
+
+    def __init__(self):
+        self.pronta = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class VooUnico:
+    # Versao com threads, pras rotas sync (rodam no threadpool)
+    def __init__(self, ativo: bool = True):
+        self.ativo = ativo
+        self.lideres = 0
+        self.coalescidas = 0
+        self._em_voo = {}
+        self._lock = threading.Lock()
+
+    def faz(self, chave, funcao):
+        if not self.ativo:
+            return funcao()
+        with self._lock:
+            chamada = self._em_voo.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = self._em_voo[chave] = _Chamada()
+                self.lideres += 1
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            chamada.pronta.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+
+        try:
+            chamada.resultado = funcao()
+        except BaseException as erro:
+            chamada.erro = erro
+            raise
+        finally:
+            with self._lock:
+                del self._em_voo[chave]
+            chamada.pronta.set()
+        return chamada.resultado
+
+
+class VooUnicoAsync:
+    # Versao asyncio, pras rotas de rotas_async.py (tudo no mesmo event loop,
+    # entao nao precisa de lock)
+    def __init__(self, ativo: bool = True):
+        self.ativo = ativo
+        self.lideres = 0
+        self.coalescidas = 0
+        self._em_voo = {}
+
+    async def faz(self, chave, funcao):
+        if not self.ativo:
+            return await funcao()
+        futuro = self._em_voo.get(chave)
+        if futuro is not None:
+            self.coalescidas += 1
+            try:
+                # shield: se esta requisicao cair, a consulta da lider continua
+                return await asyncio.shield(futuro)
+            except asyncio.CancelledError:
+                if not futuro.cancelled():
+                    raise
+            # A lider foi cancelada (cliente desconectou): consulta por conta
+            return await funcao()
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._em_voo[chave] = futuro
+        self.lideres += 1
+        try:
+            resultado = await funcao()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except BaseException as erro:
+            futuro.set_exception(erro)
+            # Marca como lida, senao o asyncio avisa se ninguem estava esperando
+            futuro.exception()
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            del self._em_voo[chave]
+
+
+def estatisticas(*voos) -> dict:
+    return {
+        'lideres': sum(voo.lideres for voo in voos),
+        'coalescidas': sum(voo.coalescidas for voo in voos),
+    }
+
+
+_settings = get_settings()
+voo_unico = VooUnico(_settings.COALESCENCIA_ATIVA)
+voo_unico_async = VooUnicoAsync(_settings.COALESCENCIA_ATIVA)
@@ -0,0 +1,101 @@
+# Compactacao das lapides do delete logico (models.User.deleted_at)
+#
+# Apaga de vez, em lotes de COMPACTACAO_LOTE, os usuarios removidos ha mais de
+# COMPACTACAO_RETENCAO segundos. So roda quando o app esta quieto (menos de
+# COMPACTACAO_MAX_RPS requisicoes por segundo desde a ultima olhada), pra nao
+# disputar o banco (no SQLite, o lock de escrita) com as rotas. Cada lote e
+# uma transacao curta, entao um pico de trafego no meio espera no maximo um lote.
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select
+
+from metricas import metricas
+from models import User
+from settings import Settings
+
+logger = logging.getLogger('crud.compactacao')
+
+# Espera entre um lote e o proximo quando ainda tem lapide pra apagar
+PAUSA_ENTRE_LOTES = 0.2
+
+
+def agora_do_banco(conexao):
+    # "Agora" pelo relogio do banco, que e quem preenche deleted_at/updated_at.
+    # A retencao e conferida sempre por ele, aqui e no feed de mudancas, pra
+    # os dois concordarem mesmo com o banco fora de UTC
+    agora = conexao.scalar(select(func.now()))
+    if agora.tzinfo is not None:
+        # Postgres devolve com fuso; a coluna guarda a hora local da sessao
+        agora = agora.replace(tzinfo=None)
+    return agora
+
+
+def compacta_lote(engine, tamanho: int, retencao: float) -> int:
+    with engine.begin() as conn:
+        limite = agora_do_banco(conn) - timedelta(seconds=retencao)
+        # Os ids primeiro e o DELETE por lista: o MySQL recusa
+        # DELETE ... WHERE id IN (SELECT ... LIMIT n)
+        ids = conn.scalars(
+            select(User.id)
+            .where(User.deleted_at.is_not(None), User.deleted_at < limite)
+            .order_by(User.deleted_at)
+            .limit(tamanho)
+        ).all()
+        if not ids:
+            return 0
+        return conn.execute(delete(User).where(User.id.in_(ids), User.deleted_at.is_not(None))).rowcount
+
+
+class Compactador:
+    def __init__(self, motor, settings: Settings):
+        # motor: fabrica do engine (database.get_engine), chamada so na
+        # hora de compactar
+        self.motor = motor
+        self.lote = settings.COMPACTACAO_LOTE
+        self.retencao = settings.COMPACTACAO_RETENCAO
+        self.intervalo = settings.COMPACTACAO_INTERVALO
+        self.max_rps = settings.COMPACTACAO_MAX_RPS
+        self.apagados = 0
+        self.adiadas = 0
+
+    def _quieto(self, requisicoes: int, segundos: float) -> bool:
+        return requisicoes / segundos <= self.max_rps
+
+    async def compacta(self) -> int:
+        # Lotes seguidos enquanto vierem cheios e o trafego continuar baixo
+        total = 0
+        while True:
+            apagados = await asyncio.to_thread(compacta_lote, self.motor(), self.lote, self.retencao)
+            total += apagados
+            self.apagados += apagados
+            if apagados < self.lote:
+                return total
+            antes = metricas.total_requisicoes
+            await asyncio.sleep(PAUSA_ENTRE_LOTES)
+            if not self._quieto(metricas.total_requisicoes - antes, PAUSA_ENTRE_LOTES):
+                return total
+
+    async def roda(self):
+        ultimo_total = metricas.total_requisicoes
+        ultima_olhada = time.monotonic()
+        while True:
+            await asyncio.sleep(self.intervalo)
+            agora = time.monotonic()
+            total = metricas.total_requisicoes
+            quieto = self._quieto(total - ultimo_total, agora - ultima_olhada)
+            if not quieto:
+                self.adiadas += 1
+            else:
+                try:
+                    apagados = await self.compacta()
+                except Exception:
+                    # Banco ocupado/fora do ar: tenta de novo na proxima volta
+                    logger.exception('falha na compactacao')
+                else:
+                    if apagados:
+                        logger.info('compactacao apagou %d usuarios', apagados)
+            ultimo_total = metricas.total_requisicoes
+            ultima_olhada = time.monotonic()
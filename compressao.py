@@ -0,0 +1,205 @@
+# Compressao das respostas negociada pelo Accept-Encoding (zstd, br, gzip)
+#
+# Middleware ASGI puro, como os outros. Resposta menor que COMPRESSAO_MINIMO
+# sai como esta: nesse tamanho o ganho nao paga a CPU. Resposta em streaming
+# (export) e comprimida pedaco por pedaco, com flush, pro cliente continuar
+# recebendo na hora. Ficam de fora os eventos (text/event-stream), o que ja
+# vem com Content-Encoding e o que tem ETag: os validadores de condicional.py
+# sao da representacao sem compressao (e sao payloads de um usuario, pequenos).
+#
+# br e zstd sao opcionais: so entram com os pacotes brotli/zstandard instalados.
+import gzip
+import zlib
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from settings import Settings
+
+# Niveis pensados pra resposta dinamica: o padrao do brotli (11) custa dezenas
+# de vezes mais CPU pra ganhar poucos por cento
+NIVEL_GZIP = 6
+NIVEL_BROTLI = 4
+NIVEL_ZSTD = 3
+
+# Pedaco maior que isso e comprimido no threadpool (as libs soltam o GIL), pra
+# nao travar o event loop
+PEDACO_GRANDE = 256 * 1024
+
+COMPRIMIVEIS = (
+    'application/json', 'application/x-ndjson', 'application/msgpack',
+    'text/csv', 'text/plain', 'text/html',
+)
+
+
+class _FluxoGzip:
+    def __init__(self):
+        self._obj = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+
+    def comprime(self, dados: bytes, fim: bool) -> bytes:
+        return self._obj.compress(dados) + self._obj.flush(zlib.Z_FINISH if fim else zlib.Z_SYNC_FLUSH)
+
+
+class _FluxoBrotli:
+    def __init__(self):
+        import brotli
+
+        self._obj = brotli.Compressor(quality=NIVEL_BROTLI)
+
+    def comprime(self, dados: bytes, fim: bool) -> bytes:
+        return self._obj.process(dados) + (self._obj.finish() if fim else self._obj.flush())
+
+
+class _FluxoZstd:
+    def __init__(self):
+        import zstandard
+
+        self._zstd = zstandard
+        self._obj = zstandard.ZstdCompressor(level=NIVEL_ZSTD).compressobj()
+
+    def comprime(self, dados: bytes, fim: bool) -> bytes:
+        modo = self._zstd.COMPRESSOBJ_FLUSH_FINISH if fim else self._zstd.COMPRESSOBJ_FLUSH_BLOCK
+        return self._obj.compress(dados) + self._obj.flush(modo)
+
+
+def _gzip(dados: bytes) -> bytes:
+    return gzip.compress(dados, NIVEL_GZIP, mtime=0)
+
+
+def _brotli(dados: bytes) -> bytes:
+    import brotli
+
+    return brotli.compress(dados, quality=NIVEL_BROTLI)
+
+
+def _zstd(dados: bytes) -> bytes:
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(dados)
+
+
+def _instalado(nome: str) -> bool:
+    try:
+        __import__(nome)
+    except ImportError:
+        return False
+    return True
+
+
+# nome no Content-Encoding -> (corpo inteiro, streaming, pacote necessario)
+CODIFICADORES = {
+    'gzip': (_gzip, _FluxoGzip, None),
+    'br': (_brotli, _FluxoBrotli, 'brotli'),
+    'zstd': (_zstd, _FluxoZstd, 'zstandard'),
+}
+
+
+def escolhe(accept_encoding: str, disponiveis: tuple[str, ...]) -> str | None:
+    # Maior q do cliente; no empate vale a ordem do servidor. q=0 recusa
+    pesos = {}
+    for parte in accept_encoding.split(','):
+        nome, *parametros = parte.split(';')
+        peso = 1.0
+        for parametro in parametros:
+            chave, _, valor = parametro.strip().partition('=')
+            if chave == 'q':
+                try:
+                    peso = float(valor)
+                except ValueError:
+                    peso = 0.0
+        pesos[nome.strip().lower()] = peso
+
+    escolhido, maior = None, 0.0
+    for nome in disponiveis:
+        peso = pesos.get(nome, pesos.get('*', 0.0))
+        if peso > maior:
+            escolhido, maior = nome, peso
+    return escolhido
+
+
+def _comprimivel(cabecalhos: MutableHeaders) -> bool:
+    tipo = cabecalhos.get('content-type', '').split(';')[0].strip().lower()
+    return (
+        tipo in COMPRIMIVEIS
+        and 'content-encoding' not in cabecalhos
+        and 'etag' not in cabecalhos
+    )
+
+
+async def _roda(funcao, *args):
+    if len(args[0]) > PEDACO_GRANDE:
+        return await run_in_threadpool(funcao, *args)
+    return funcao(*args)
+
+
+class MiddlewareCompressao:
+    def __init__(self, app, algoritmos: tuple[str, ...], minimo: int):
+        self.app = app
+        self.algoritmos = algoritmos
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.algoritmos:
+            await self.app(scope, receive, send)
+            return
+        aceitos = Headers(scope=scope).get('accept-encoding')
+        algoritmo = escolhe(aceitos, self.algoritmos) if aceitos else None
+        if algoritmo is None:
+            await self.app(scope, receive, send)
+            return
+
+        um_so, fluxo_novo, _ = CODIFICADORES[algoritmo]
+        inicio = None
+        fluxo = None
+        sem_compressao = False
+
+        async def envia(mensagem):
+            nonlocal inicio, fluxo, sem_compressao
+            if mensagem['type'] == 'http.response.start':
+                # Segura os cabecalhos ate ver o primeiro pedaco do corpo
+                inicio = mensagem
+                return
+            if mensagem['type'] != 'http.response.body' or sem_compressao:
+                await send(mensagem)
+                return
+
+            corpo = mensagem.get('body', b'')
+            mais = mensagem.get('more_body', False)
+            if fluxo is not None:
+                await send({'type': 'http.response.body', 'body': await _roda(fluxo.comprime, corpo, not mais),
+                            'more_body': mais})
+                return
+
+            cabecalhos = MutableHeaders(raw=list(inicio['headers']))
+            if not _comprimivel(cabecalhos) or (not mais and len(corpo) < self.minimo):
+                sem_compressao = True
+                await send(inicio)
+                await send(mensagem)
+                return
+
+            cabecalhos['Content-Encoding'] = algoritmo
+            cabecalhos.add_vary_header('Accept-Encoding')
+            if mais:
+                # Streaming: tamanho final desconhecido
+                del cabecalhos['Content-Length']
+                fluxo = fluxo_novo()
+                corpo = await _roda(fluxo.comprime, corpo, False)
+            else:
+                corpo = await _roda(um_so, corpo)
+                cabecalhos['Content-Length'] = str(len(corpo))
+            await send({**inicio, 'headers': cabecalhos.raw})
+            await send({'type': 'http.response.body', 'body': corpo, 'more_body': mais})
+
+        await self.app(scope, receive, envia)
+
+
+def algoritmos_compressao(settings: Settings) -> tuple[str, ...]:
+    # Os de COMPRESSAO_ALGORITMOS (ordem de preferencia do servidor) que
+    # estao instalados; vazio = sem compressao
+    if not settings.COMPRESSAO_ATIVA:
+        return ()
+    nomes = [nome.strip().lower() for nome in settings.COMPRESSAO_ALGORITMOS.split(',') if nome.strip()]
+    return tuple(
+        nome for nome in nomes
+        if nome in CODIFICADORES and (CODIFICADORES[nome][2] is None or _instalado(CODIFICADORES[nome][2]))
+    )
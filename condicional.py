@@ -0,0 +1,78 @@
+# GET condicional (ETag / Last-Modified) e If-Match pra concorrencia otimista
+#
+# O ETag sai do updated_at junto com o conteudo publico: o CURRENT_TIMESTAMP do
+# SQLite so tem segundos, entao duas mudancas no mesmo segundo teriam o mesmo
+# updated_at mas nao o mesmo username/email.
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http import HTTPStatus
+
+from fastapi import HTTPException, Request, Response
+
+
+def etag(payload: dict) -> str:
+    base = f'{payload["id"]}|{payload["updated_at"]}|{payload["username"]}|{payload["email"]}'
+    return '"' + hashlib.sha1(base.encode()).hexdigest()[:20] + '"'
+
+
+def _updated_at(payload: dict) -> datetime:
+    # updated_at vem do banco sem fuso, mas o CURRENT_TIMESTAMP e UTC
+    data = datetime.fromisoformat(payload['updated_at'])
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return data.replace(microsecond=0)
+
+
+def _etags(cabecalho: str) -> list[str]:
+    # Comparacao fraca: W/"x" e "x" sao a mesma coisa no If-None-Match
+    return [e.strip().removeprefix('W/') for e in cabecalho.split(',') if e.strip()]
+
+
+def cabecalhos(payload: dict) -> dict:
+    return {
+        'ETag': etag(payload),
+        'Last-Modified': format_datetime(_updated_at(payload), usegmt=True),
+    }
+
+
+def nao_modificado(request: Request, payload: dict) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        lista = _etags(if_none_match)
+        return '*' in lista or etag(payload) in lista
+
+    # If-Modified-Since so vale quando nao veio If-None-Match
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            desde = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if desde.tzinfo is None:
+            desde = desde.replace(tzinfo=timezone.utc)
+        return _updated_at(payload) <= desde
+    return False
+
+
+def responde(request: Request, response: Response, payload: dict):
+    # Resposta dos GETs: 304 vazio se o cliente ja tem a versao atual
+    headers = cabecalhos(payload)
+    if nao_modificado(request, payload):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return payload
+
+
+def confere_if_match(request: Request, payload: dict):
+    # PUT/PATCH/DELETE com If-Match so seguem se o cliente viu a versao atual
+    if_match = request.headers.get('if-match')
+    if if_match is None:
+        return
+    lista = [e.strip() for e in if_match.split(',') if e.strip()]
+    if '*' in lista or etag(payload) in lista:
+        return
+    raise HTTPException(
+        status_code=HTTPStatus.PRECONDITION_FAILED,
+        detail='O usuario foi alterado por outra requisicao',
+    )
@@ -0,0 +1,137 @@
+# Confere o plano (EXPLAIN QUERY PLAN do SQLite) de todo SQL que as rotas do
+# app.py mandam pro banco: nenhum pode varrer a tabela users sem indice
+# (SCAN users) nem ordenar numa B-tree temporaria (USE TEMP B-TREE).
+#
+# Cria um banco com as migracoes, chama cada rota com o TestClient gravando
+# o SQL executado e roda o EXPLAIN de cada comando. Rota do app sem chamada
+# aqui tambem conta como falha, pra rota nova nao passar sem conferir.
+#
+# Uso: python confere_planos.py [--modo sync|async]   (sai com 1 se falhar)
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+from bench_comum import prepara_banco
+
+USUARIOS = 20_000
+
+# Plano que le a tabela inteira (o nome vem sozinho, sem USING INDEX) ou
+# ordena o resultado fora do indice
+VARREDURA = re.compile(r'^SCAN users(?: AS \w+)?$')
+ORDENACAO = 'USE TEMP B-TREE'
+
+# (metodo, rota do app, caminho, corpo JSON)
+CHAMADAS = (
+    ('POST', '/usuarios', '/usuarios', {'username': 'Planos', 'email': 'Planos@x.com', 'password': 'senha123'}),
+    ('POST', '/usuarios', '/usuarios', {'username': 'PLANOS', 'email': 'outro@x.com', 'password': 'senha123'}),
+    ('POST', '/login', '/login', {'username': 'planos', 'password': 'senha123'}),
+    ('GET', '/usuarios', '/usuarios?skip=100&limit=10', None),
+    ('GET', '/usuarios', '/usuarios?paginacao=cursor&limit=10', None),
+    ('GET', '/usuarios', '/usuarios?paginacao=cursor&ordem=created_at&limit=10', None),
+    ('GET', '/usuarios', '/usuarios?paginacao=cursor&ordem=created_at&fields=username&limit=10', None),
+    ('GET', '/usuarios/{id}', '/usuarios/10', None),
+    ('GET', '/usuarios/busca/{nome}', '/usuarios/busca/USUARIO11', None),
+    ('GET', '/usuarios/busca', '/usuarios/busca?q=usuario12&modo=prefixo', None),
+    ('GET', '/usuarios/busca', '/usuarios/busca?q=bench&modo=contem', None),
+    ('POST', '/usuarios/lookup', '/usuarios/lookup', {'ids': [1, 2, 3, 999_999]}),
+    ('PUT', '/usuarios/{id}', '/usuarios/20', {'username': 'trocado', 'email': 'trocado@x.com', 'password': 'senha123'}),
+    ('PATCH', '/usuarios/{id}', '/usuarios/21', {'email': 'usuario20@bench.com'}),
+    ('PATCH', '/usuarios/{id}', '/usuarios/21', {'username': 'remendado'}),
+    ('DELETE', '/usuarios/{id}', '/usuarios/22', None),
+    ('DELETE', '/usuarios', '/usuarios', {'ids': [23, 24, 999_999]}),
+    ('POST', '/usuarios/bulk', '/usuarios/bulk', [
+        {'username': 'lote1', 'email': 'lote1@x.com', 'password': 'senha123'},
+        {'username': 'USUARIO30', 'email': 'lote2@x.com', 'password': 'senha123'},
+    ]),
+    ('GET', '/usuarios/changes', '/usuarios/changes?limit=10', None),
+    ('GET', '/usuarios/changes', '/usuarios/changes?since=2000-01-01T00:00:00&limit=10', None),
+    ('GET', '/usuarios/export', '/usuarios/export', None),
+    ('GET', '/usuarios/export', '/usuarios/export?formato=csv', None),
+    ('GET', '/metrics', '/metrics', None),
+    ('GET', '/metrics/pool', '/metrics/pool', None),
+    ('GET', '/metrics/cache', '/metrics/cache', None),
+)
+
+
+# Rotas que nao vao ao banco e nem terminam (fluxo de eventos): ficam de fora
+SEM_CHAMADA = {'GET /usuarios/eventos'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Confere que as rotas usam indice')
+    parser.add_argument('--modo', choices=('sync', 'async'), default=os.environ.get('DB_MODE', 'sync'))
+    args = parser.parse_args()
+
+    caminho = prepara_banco(USUARIOS, migracoes=True).removeprefix('sqlite:///')
+    os.environ.update({
+        'DB_MODE': args.modo,
+        # Sem cache as leituras repetidas tambem vao ao banco; o resto so
+        # tira o que atrapalharia rodar tudo em sequencia
+        'CACHE_BACKEND': 'desligado',
+        'CREATE_PRECHECK': 'true',
+        'RATE_LIMIT_BACKEND': 'desligado',
+        'COMPACTACAO_ATIVA': 'false',
+        'MUDANCAS_ATRASO': '0',
+    })
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from app import app
+    from database import get_async_engine, get_engine
+
+    comandos = []
+    rota_atual = 'startup'  # consultas do aquecimento (lifespan)
+
+    def grava(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'WITH'):
+            comandos.append((rota_atual, statement, parameters))
+
+    motores = [get_engine()]
+    if args.modo == 'async':
+        motores.append(get_async_engine().sync_engine)
+    for motor in motores:
+        event.listen(motor, 'before_cursor_execute', grava)
+
+    falhas = []
+    with TestClient(app) as client:
+        for metodo, rota, caminho_url, corpo in CHAMADAS:
+            rota_atual = f'{metodo} {rota}'
+            resposta = client.request(metodo, caminho_url, json=corpo)
+            if resposta.status_code >= 500:
+                falhas.append(f'{rota_atual}: {caminho_url} respondeu {resposta.status_code}')
+
+    # Pelo OpenAPI pra pegar tambem as rotas dos routers incluidos
+    rotas_app = {
+        f'{metodo.upper()} {caminho_rota}'
+        for caminho_rota, metodos in app.openapi()['paths'].items()
+        for metodo in metodos
+    }
+    for rota in sorted(rotas_app - SEM_CHAMADA - {f'{metodo} {rota}' for metodo, rota, _, _ in CHAMADAS}):
+        falhas.append(f'{rota}: sem chamada em confere_planos.CHAMADAS')
+
+    banco = sqlite3.connect(caminho)
+    vistos = set()
+    for rota, statement, parameters in comandos:
+        if (rota, statement) in vistos:
+            continue
+        vistos.add((rota, statement))
+        plano = [linha[3] for linha in banco.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        ruins = [passo for passo in plano if VARREDURA.match(passo) or passo.startswith(ORDENACAO)]
+        print(f'{"FALHA" if ruins else "ok":5} {rota:28} {" | ".join(plano)}')
+        if ruins:
+            falhas.append(f'{rota}: {", ".join(ruins)}\n      {" ".join(statement.split())}')
+    banco.close()
+
+    if falhas:
+        print(f'\n{len(falhas)} problema(s):')
+        for falha in falhas:
+            print(f'  {falha}')
+        sys.exit(1)
+    print(f'\n{len(vistos)} consultas em {len(rotas_app)} rotas, todas usando indice')
+
+
+if __name__ == '__main__':
+    main()
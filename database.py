@@ -1,11 +1,396 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from settings import Settings
+import inspect
+import math
+import threading
+import time
+from functools import wraps
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, configure_mappers
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metricas import metricas
+from replicas import Replica, Replicas, le_primario
+from settings import Settings, get_settings
+
+
+def motores_no_primario(settings: Settings) -> int:
+    # Engines de cada worker apontando pro primario. No modo async sao dois: o
+    # async das rotas de usuario e o sync de quem continua sync (bulk, login,
+    # busca, lookup, DELETE /usuarios, changes, export e o Compactador)
+    return 2 if settings.DB_MODE == 'async' else 1
+
+
+def tamanho_pool(settings: Settings, motores: int = 1) -> tuple[int, int]:
+    # (pool_size, max_overflow) de cada um dos `motores` engines deste
+    # processo no mesmo banco. Com DB_CONEXOES_TOTAL o teto e dividido entre
+    # os WEB_WORKERS do serve.py e entre esses engines, pra subir mais workers
+    # nao estourar o max_connections do banco
+    if settings.DB_CONEXOES_TOTAL is None:
+        return settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW
+    por_motor = max(1, settings.DB_CONEXOES_TOTAL // max(1, settings.WEB_WORKERS) // motores)
+    pool_size = min(settings.DB_POOL_SIZE, por_motor)
+    return pool_size, por_motor - pool_size
+
+
+def opcoes_engine(settings: Settings, url: str, async_: bool = False, motores: int = 1) -> dict:
+    opcoes = {
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'query_cache_size': settings.DB_QUERY_CACHE_SIZE,
+    }
+    url = make_url(url)
+    em_memoria = url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+    # SQLite em memoria usa SingletonThreadPool, que nao tem overflow/timeout
+    if not em_memoria:
+        pool_size, max_overflow = tamanho_pool(settings, motores)
+        opcoes.update(
+            poolclass=PoolMedidoAsync if async_ else PoolMedido,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return opcoes
+
+
+def aplica_pragmas(engine, settings: Settings):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = []
+    if settings.SQLITE_JOURNAL_MODE:
+        pragmas.append(f'PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}')
+    if settings.SQLITE_SYNCHRONOUS:
+        pragmas.append(f'PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}')
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_conn, _registro):
+        cursor = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def mede_consultas(engine):
+    # Cronometra cada consulta e soma no contador da requisicao atual (ver
+    # metricas.py). O inicio fica no contexto de execucao, que e de uma
+    # consulta so: se ela falhar o after_cursor_execute nao roda, e o inicio
+    # vai embora junto com o contexto em vez de ficar preso na conexao do pool
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(_conn, _cursor, _sql, _parametros, contexto, _executemany):
+        if contexto is not None:
+            contexto.inicio_consulta = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _depois(_conn, _cursor, sql, _parametros, contexto, _executemany):
+        inicio = getattr(contexto, 'inicio_consulta', None)
+        if inicio is not None:
+            metricas.registra_consulta(sql, time.perf_counter() - inicio)
+
+
+# Media recente da espera pelo pool: cada checkout pesa PESO_RECENTE e o que
+# ja estava decai pela metade a cada MEIA_VIDA_RECENTE segundos. Sem checkout
+# nenhum (o controle de admissao recusando tudo, por exemplo) ela cai sozinha
+PESO_RECENTE = 0.2
+MEIA_VIDA_RECENTE = 1.0
+
+
+class EstatisticasPool:
+    # Quanto tempo as rotas esperam para conseguir uma conexao do pool
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts = 0
+        self._recente = 0.0
+        self._recente_em = time.monotonic()
+
+    def _decaida(self, agora: float) -> float:
+        return self._recente * math.pow(0.5, (agora - self._recente_em) / MEIA_VIDA_RECENTE)
+
+    def _atualiza_recente(self, segundos: float):
+        agora = time.monotonic()
+        recente = self._decaida(agora)
+        self._recente = recente + PESO_RECENTE * (segundos - recente)
+        self._recente_em = agora
+
+    def registra(self, segundos: float):
+        with self._lock:
+            self.esperas += 1
+            self.espera_total += segundos
+            self.espera_max = max(self.espera_max, segundos)
+            self._atualiza_recente(segundos)
+
+    def registra_timeout(self, segundos: float):
+        with self._lock:
+            self.timeouts += 1
+            self._atualiza_recente(segundos)
+
+    def espera_recente(self) -> float:
+        with self._lock:
+            return self._decaida(time.monotonic())
+
+    def resumo(self, pool) -> dict:
+        with self._lock:
+            media = self.espera_total / self.esperas if self.esperas else 0.0
+            dados = {
+                'pool': type(pool).__name__,
+                'esperas': self.esperas,
+                'espera_media_ms': round(media * 1000, 3),
+                'espera_max_ms': round(self.espera_max * 1000, 3),
+                'timeouts': self.timeouts,
+                'espera_recente_ms': round(self._decaida(time.monotonic()) * 1000, 3),
+            }
+        return {**dados, **contagens_pool(pool)}
+
+
+def contagens_pool(pool) -> dict:
+    # Nem todo pool tem essas contagens (SingletonThreadPool, NullPool...)
+    dados = {}
+    for nome in ('size', 'checkedin', 'checkedout', 'overflow'):
+        metodo = getattr(pool, nome, None)
+        if metodo is not None:
+            dados[nome] = metodo()
+    return dados
+
+
+estatisticas_pool = EstatisticasPool()
+
+
+class PoolMedido(QueuePool):
+    # Mede quanto tempo cada checkout espera por uma conexao livre
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except PoolTimeoutError:
+            estatisticas_pool.registra_timeout(time.perf_counter() - inicio)
+            raise
+        estatisticas_pool.registra(time.perf_counter() - inicio)
+        return conexao
+
+
+class PoolMedidoAsync(PoolMedido, AsyncAdaptedQueuePool):
+    pass
+
+
+# Drivers async equivalentes aos sync mais comuns
+DRIVERS_ASYNC = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def url_async(url: str) -> str:
+    url = make_url(url)
+    driver = DRIVERS_ASYNC.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'Sem driver async conhecido para {url.drivername}')
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def urls_replicas(settings: Settings) -> list[str]:
+    return [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(',') if url.strip()]
+
+
+_lock_motores = threading.RLock()
+
+
+def _uma_vez(funcao):
+    # Cache de fabrica sem argumentos. Nada e criado no import: o lifespan do
+    # app chama as fabricas no startup, e fora dele (scripts, TestClient sem
+    # `with`) a primeira rota que precisar cria. O lock evita duas threads do
+    # threadpool criando dois engines ao mesmo tempo
+    resultado = []
+
+    @wraps(funcao)
+    def fabrica():
+        if not resultado:
+            with _lock_motores:
+                if not resultado:
+                    resultado.append(funcao())
+        return resultado[0]
+
+    fabrica.cache_clear = resultado.clear
+    fabrica.criado = lambda: resultado[0] if resultado else None
+    return fabrica
+
+
+def _cria_engine(settings: Settings, url: str, motores: int = 1):
+    motor = create_engine(url, **opcoes_engine(settings, url, motores=motores))
+    aplica_pragmas(motor, settings)
+    mede_consultas(motor)
+    return motor
+
+
+def _cria_async_engine(settings: Settings, url: str, motores: int = 1):
+    # Import aqui pra nao exigir greenlet e o driver (aiosqlite, asyncpg...)
+    # de quem usa so o modo sync
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    motor = create_async_engine(url, **opcoes_engine(settings, url, async_=True, motores=motores))
+    aplica_pragmas(motor.sync_engine, settings)
+    mede_consultas(motor.sync_engine)
+    return motor
+
+
+def url_primario(settings: Settings) -> str:
+    # Sem DATABASE_URL falha aqui, em vez de criar um banco vazio em algum lugar
+    if not settings.DATABASE_URL:
+        raise RuntimeError('DATABASE_URL nao configurada: defina no ambiente ou no .env')
+    return settings.DATABASE_URL
+
 
 # Cria o motor de conexão com o banco definido no .env
-engine = create_engine(Settings().DATABASE_URL)
+@_uma_vez
+def get_engine():
+    settings = get_settings()
+    metricas.configura(settings.SLOW_QUERY_MS)
+    return _cria_engine(settings, url_primario(settings), motores_no_primario(settings))
+
+
+# Motor async, so usado com DB_MODE=async
+@_uma_vez
+def get_async_engine():
+    settings = get_settings()
+    metricas.configura(settings.SLOW_QUERY_MS)
+    url = settings.ASYNC_DATABASE_URL or url_async(url_primario(settings))
+    return _cria_async_engine(settings, url, motores_no_primario(settings))
+
+
+# Replicas de leitura, com as mesmas opcoes e hooks do primario. None se
+# nao tem DATABASE_REPLICA_URLS
+@_uma_vez
+def get_replicas():
+    settings = get_settings()
+    urls = urls_replicas(settings)
+    if not urls:
+        return None
+    lista = []
+    for url in urls:
+        if settings.DB_MODE == 'async':
+            motor = _cria_async_engine(settings, url_async(url))
+        else:
+            motor = _cria_engine(settings, url)
+        lista.append(Replica(url, motor))
+    return Replicas(lista, settings.DB_REPLICA_BALANCEAMENTO)
+
+
+def motor_principal():
+    # O que as rotas de usuario usam no modo atual
+    if get_settings().DB_MODE == 'async':
+        return get_async_engine().sync_engine
+    return get_engine()
+
+
+async def aquece(consultas=()):
+    # Roda no startup: abre as conexoes do pool (pool_size) e executa as
+    # consultas mais quentes uma vez, pra compilar o SQL e encher o statement
+    # cache. Assim a primeira requisicao nao paga connect + PRAGMAs + compilacao
+    configure_mappers()
+    settings = get_settings()
+    replicas = get_replicas()
+    motores = [replica.engine for replica in replicas.replicas] if replicas is not None else []
+    if settings.DB_MODE == 'async':
+        for motor in [get_async_engine(), *motores]:
+            conexoes = [await motor.connect() for _ in range(_conexoes_aquecidas(motor.sync_engine))]
+            for consulta in consultas:
+                await conexoes[0].execute(consulta)
+            for conexao in conexoes:
+                await conexao.close()
+    else:
+        for motor in [get_engine(), *motores]:
+            # No threadpool do anyio (o mesmo das rotas sync), que ja fica
+            # carregado tambem
+            await run_in_threadpool(_aquece_sync, motor, consultas)
+
+
+def _conexoes_aquecidas(motor) -> int:
+    # SingletonThreadPool (SQLite em memoria) tem uma conexao por thread
+    return motor.pool.size() if hasattr(motor.pool, 'checkedout') else 1
+
+
+def _aquece_sync(motor, consultas):
+    conexoes = [motor.connect() for _ in range(_conexoes_aquecidas(motor))]
+    for consulta in consultas:
+        conexoes[0].execute(consulta)
+    for conexao in conexoes:
+        conexao.close()
+
+
+async def descarta():
+    # Shutdown: fecha as conexoes dos pools do que chegou a ser criado
+    motores = [get_engine.criado(), get_async_engine.criado()]
+    replicas = get_replicas.criado()
+    if replicas is not None:
+        motores += [replica.engine for replica in replicas.replicas]
+    for motor in motores:
+        if motor is None:
+            continue
+        fechando = motor.dispose()
+        if inspect.isawaitable(fechando):
+            await fechando
+    for fabrica in (get_engine, get_async_engine, get_replicas):
+        fabrica.cache_clear()
+
+
+def status_pool() -> dict:
+    # O pool das rotas de usuario; no modo async tambem o do engine sync do
+    # primario (que divide o DB_CONEXOES_TOTAL com ele), se ja foi criado
+    status = estatisticas_pool.resumo(motor_principal().pool)
+    if get_settings().DB_MODE == 'async' and (motor := get_engine.criado()) is not None:
+        status['sync'] = contagens_pool(motor.pool)
+    return status
+
 
 # Função que vai entregar uma sessão para cada rota da API usar
 def get_session():
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+    with Session(get_engine()) as session:
+        yield session
+
+
+# Sessao das rotas so de leitura: uma replica, ou o primario se nao tem
+# replica saudavel ou o cliente escreveu ha pouco. info['primario'] avisa a
+# rota pra nao confiar no cache, e info['replica'] pra nao encher o cache com
+# o que veio de uma replica atrasada (ver regras.busca_payload)
+def motor_leitura(request: Request, primario):
+    replicas = get_replicas()
+    if replicas is None:
+        return primario, False
+    if le_primario(request.cookies):
+        return primario, True
+    return replicas.escolhe() or primario, False
+
+
+def get_session_leitura(request: Request):
+    primario = get_engine()
+    motor, le_do_primario = motor_leitura(request, primario)
+    with Session(motor, info={'primario': le_do_primario, 'replica': motor is not primario}) as session:
+        yield session
+
+
+# Mesma coisa para as rotas async. expire_on_commit=False porque no async
+# nao da pra recarregar atributo "escondido" depois do commit
+async def get_async_session():
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+
+async def get_async_session_leitura(request: Request):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    primario = get_async_engine()
+    motor, le_do_primario = motor_leitura(request, primario)
+    info = {'primario': le_do_primario, 'replica': motor is not primario}
+    async with AsyncSession(motor, expire_on_commit=False, info=info) as session:
+        yield session
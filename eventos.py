@@ -0,0 +1,215 @@
+# Eventos de usuario em tempo real: SSE em GET /usuarios/eventos e WebSocket
+# em /usuarios/eventos/ws
+#
+# Barramento em processo: as rotas de escrita publicam depois do commit e
+# cada conexao e um assinante com uma fila propria de ate EVENTOS_FILA
+# eventos. O JSON (e o bloco SSE) de um evento e montado uma vez so na
+# publicacao, nao por assinante, e quem acorda leva tudo que estiver na fila
+# numa escrita so.
+#
+# Cliente lento (fila cheia): com EVENTOS_POLITICA='descarta' o evento mais
+# antigo da fila sai e o cliente recebe um aviso 'perdidos' com quantos foram;
+# com 'desconecta' a conexao dele e fechada.
+#
+# O barramento so ve as escritas do proprio worker (serve.py com varios
+# workers: cada um tem o seu). Quem nao pode perder nada usa os eventos so
+# como aviso e busca as mudancas em /usuarios/changes.
+import asyncio
+import itertools
+import json
+from collections import deque
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from settings import Settings, get_settings
+
+
+class Evento:
+    __slots__ = ('seq', 'tipo', 'json', 'sse')
+
+    def __init__(self, seq: int, tipo: str, dados: dict):
+        self.seq = seq
+        self.tipo = tipo
+        self.json = json.dumps({'seq': seq, 'tipo': tipo, **dados}, separators=(',', ':'))
+        self.sse = f'id: {seq}\nevent: {tipo}\ndata: {self.json}\n\n'.encode()
+
+
+class Assinante:
+    # Fila de uma conexao. Tudo roda no event loop do barramento, sem lock
+    def __init__(self):
+        self.fila = deque()
+        self.perdidos = 0
+        self.encerrado = False
+        self._espera = None
+
+    def acorda(self):
+        if self._espera is not None and not self._espera.done():
+            self._espera.set_result(None)
+
+    def encerra(self):
+        self.encerrado = True
+        self.acorda()
+
+    async def espera(self, segundos: float) -> list[Evento]:
+        # Tudo que esta na fila; lista vazia se passou `segundos` sem evento
+        # (hora do ping) ou se a conexao foi encerrada
+        if not self.fila and not self.encerrado:
+            loop = asyncio.get_running_loop()
+            self._espera = loop.create_future()
+            timer = loop.call_later(segundos, self.acorda)
+            try:
+                await self._espera
+            finally:
+                timer.cancel()
+                self._espera = None
+        eventos = list(self.fila)
+        self.fila.clear()
+        return eventos
+
+    def pega_perdidos(self) -> int:
+        perdidos, self.perdidos = self.perdidos, 0
+        return perdidos
+
+
+class Barramento:
+    def __init__(self, tamanho_fila: int, politica: str, max_assinantes: int | None = None):
+        self.tamanho_fila = tamanho_fila
+        self.politica = politica
+        self.max_assinantes = max_assinantes
+        self.assinantes = set()
+        self.publicados = 0
+        self.descartados = 0
+        self.desconectados = 0
+        self._seq = itertools.count(1)
+        self._loop = None
+
+    def lotado(self) -> bool:
+        return self.max_assinantes is not None and len(self.assinantes) >= self.max_assinantes
+
+    def assina(self) -> Assinante:
+        # Chamado dentro do event loop da conexao, que passa a ser o do barramento
+        self._loop = asyncio.get_running_loop()
+        assinante = Assinante()
+        self.assinantes.add(assinante)
+        return assinante
+
+    def cancela(self, assinante: Assinante):
+        self.assinantes.discard(assinante)
+
+    def publica(self, tipo: str, dados: dict):
+        # Chamado pelas rotas depois do commit: as sync rodam no threadpool,
+        # as async no proprio loop. A entrega fica pra proxima volta do loop,
+        # pra resposta da escrita nao esperar o fan-out
+        loop = self._loop
+        if loop is None or not self.assinantes:
+            return
+        evento = Evento(next(self._seq), tipo, dados)
+        try:
+            no_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            no_loop = False
+        if no_loop:
+            loop.call_soon(self._entrega, evento)
+        else:
+            try:
+                loop.call_soon_threadsafe(self._entrega, evento)
+            except RuntimeError:
+                # Loop ja fechado (app desligando)
+                pass
+
+    def _entrega(self, evento: Evento):
+        self.publicados += 1
+        for assinante in self.assinantes:
+            if assinante.encerrado:
+                continue
+            if len(assinante.fila) >= self.tamanho_fila:
+                if self.politica == 'desconecta':
+                    self.desconectados += 1
+                    assinante.encerra()
+                    continue
+                assinante.fila.popleft()
+                assinante.perdidos += 1
+                self.descartados += 1
+            assinante.fila.append(evento)
+            assinante.acorda()
+
+    def estatisticas(self) -> dict:
+        return {
+            'assinantes': len(self.assinantes),
+            'publicados': self.publicados,
+            'descartados': self.descartados,
+            'desconectados': self.desconectados,
+        }
+
+
+def cria_barramento(settings: Settings) -> Barramento:
+    return Barramento(settings.EVENTOS_FILA, settings.EVENTOS_POLITICA, settings.EVENTOS_MAX_ASSINANTES)
+
+
+barramento = cria_barramento(get_settings())
+
+
+def publica_usuario(tipo: str, id: int, username: str | None = None, email: str | None = None):
+    # tipo: 'criado', 'atualizado' ou 'removido' (removido vai so com o id)
+    dados = {'id': id} if tipo == 'removido' else {'id': id, 'username': username, 'email': email}
+    barramento.publica(tipo, dados)
+
+
+def aviso_perdidos(quantidade: int) -> str:
+    return json.dumps({'tipo': 'perdidos', 'quantidade': quantidade}, separators=(',', ':'))
+
+
+async def fluxo_sse(ping: float):
+    # Corpo do StreamingResponse. Se o cliente desconecta o Starlette cancela
+    # o gerador e o finally tira o assinante do barramento. A assinatura fica
+    # aqui dentro e nao na rota: se o cliente cair antes do primeiro bloco o
+    # gerador nem comeca, e um assinante criado na rota nunca sairia
+    assinante = barramento.assina()
+    try:
+        # Primeiro bloco na hora: o cliente ja recebe os cabecalhos e o
+        # intervalo de reconexao
+        yield b'retry: 3000\n\n'
+        while not assinante.encerrado:
+            eventos = await assinante.espera(ping)
+            if assinante.encerrado:
+                break
+            partes = []
+            perdidos = assinante.pega_perdidos()
+            if perdidos:
+                partes.append(f'event: perdidos\ndata: {aviso_perdidos(perdidos)}\n\n'.encode())
+            partes.extend(evento.sse for evento in eventos)
+            # Comentario SSE como ping, mantem proxies e o TCP vivos
+            yield b''.join(partes) if partes else b': ping\n\n'
+    finally:
+        barramento.cancela(assinante)
+
+
+async def fluxo_ws(websocket: WebSocket, ping: float):
+    # Um evento por mensagem de texto. O cliente nao manda nada, mas alguem
+    # precisa ler o socket pra notar que ele fechou
+    assinante = barramento.assina()
+
+    async def le_ate_fechar():
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+        assinante.encerra()
+
+    leitor = asyncio.create_task(le_ate_fechar())
+    try:
+        while not assinante.encerrado:
+            eventos = await assinante.espera(ping)
+            if assinante.encerrado:
+                break
+            perdidos = assinante.pega_perdidos()
+            if perdidos:
+                await websocket.send_text(aviso_perdidos(perdidos))
+            for evento in eventos:
+                await websocket.send_text(evento.json)
+        if not leitor.done():
+            # Quem encerrou foi o barramento: cliente lento com 'desconecta'
+            await websocket.close(code=1013, reason='cliente lento')
+    except (WebSocketDisconnect, OSError):
+        pass
+    finally:
+        leitor.cancel()
+        barramento.cancela(assinante)
@@ -0,0 +1,68 @@
+# Exportacao da tabela de usuarios em streaming (GET /usuarios/export)
+#
+# Le so as colunas (sem montar objetos User) em lotes por keyset
+# (WHERE id > ultimo ORDER BY id LIMIT n) e manda um lote por vez, entao a
+# memoria fica parada no tamanho de um lote nao importa o tamanho da tabela.
+# Cada lote e uma transacao curta: nada fica aberto enquanto o cliente baixa.
+# Com um cursor so, a leitura segurava o lock SHARED do SQLite (no modo
+# rollback journal todo commit de escrita esperava e estourava o busy timeout)
+# e, no Postgres, o mesmo snapshot durante a exportacao inteira.
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from models import User
+
+LINHAS_POR_LOTE = 1000
+
+COLUNAS = (User.id, User.username, User.email, User.created_at, User.updated_at)
+CABECALHO = [coluna.key for coluna in COLUNAS]
+
+
+def _lotes(engine):
+    query = select(*COLUNAS).where(User.deleted_at.is_(None)).order_by(User.id).limit(LINHAS_POR_LOTE)
+    ultimo = None
+    while True:
+        # A conexao volta pro pool antes do yield, enquanto o lote e enviado
+        with engine.connect() as conn:
+            lote = conn.execute(query if ultimo is None else query.where(User.id > ultimo)).all()
+        if not lote:
+            return
+        yield lote
+        if len(lote) < LINHAS_POR_LOTE:
+            return
+        ultimo = lote[-1].id
+
+
+def exporta_ndjson(engine):
+    for lote in _lotes(engine):
+        yield ''.join(
+            json.dumps({
+                'id': id,
+                'username': username,
+                'email': email,
+                'created_at': created_at.isoformat(),
+                'updated_at': updated_at.isoformat(),
+            }) + '\n'
+            for id, username, email, created_at, updated_at in lote
+        )
+
+
+def exporta_csv(engine):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(CABECALHO)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for lote in _lotes(engine):
+        escritor.writerows(
+            (id, username, email, created_at.isoformat(), updated_at.isoformat())
+            for id, username, email, created_at, updated_at in lote
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
@@ -0,0 +1,165 @@
+# Importacao em massa de usuarios (POST /usuarios/bulk)
+#
+# Em vez de SELECT + INSERT + commit por usuario, cada lote faz uma consulta
+# de duplicados pra todos os usernames/emails e um INSERT ... RETURNING com
+# todas as linhas validas.
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from eventos import publica_usuario
+from models import User
+from regras import senha_eh_forte
+from schema import BaseUsuario, ResultadoImportacao, ResultadoLinha
+from seguranca import senhas
+
+
+def le_linhas(corpo: bytes):
+    # Aceita um array JSON ou JSON-lines (um objeto por linha).
+    # Devolve (numero_da_linha, dict ou mensagem de erro)
+    texto = corpo.decode('utf-8').strip()
+    if texto.startswith('['):
+        try:
+            itens = json.loads(texto)
+        except ValueError as erro:
+            raise ValueError(f'JSON invalido: {erro}')
+        return list(enumerate(itens, start=1))
+
+    linhas = []
+    for numero, linha in enumerate(texto.splitlines(), start=1):
+        if not linha.strip():
+            continue
+        try:
+            linhas.append((numero, json.loads(linha)))
+        except ValueError:
+            linhas.append((numero, 'JSON invalido'))
+    return linhas
+
+
+def _primeiro_erro(erro: ValidationError) -> str:
+    detalhe = erro.errors()[0]
+    campo = '.'.join(str(p) for p in detalhe['loc'])
+    return f'{campo}: {detalhe["msg"]}' if campo else detalhe['msg']
+
+
+def valida(linhas):
+    # Validacao que nao precisa do banco: schema, senha e repetidos no proprio lote.
+    # Devolve a lista de (numero, BaseUsuario) validos e os resultados de erro
+    validos = []
+    erros = []
+    nomes = set()
+    emails = set()
+    for numero, dados in linhas:
+        if isinstance(dados, str):
+            erros.append(ResultadoLinha(linha=numero, status='erro', detalhe=dados))
+            continue
+        try:
+            user = BaseUsuario.model_validate(dados)
+        except ValidationError as erro:
+            erros.append(ResultadoLinha(linha=numero, status='erro', detalhe=_primeiro_erro(erro)))
+            continue
+
+        if not senha_eh_forte(user.password):
+            detalhe = 'A senha precisa ter letras e numeros'
+        elif user.username.lower() in nomes:
+            detalhe = 'Nome de usuario repetido no arquivo'
+        elif user.email.lower() in emails:
+            detalhe = 'Email repetido no arquivo'
+        else:
+            detalhe = None
+
+        if detalhe:
+            erros.append(ResultadoLinha(linha=numero, status='erro', detalhe=detalhe))
+            continue
+        nomes.add(user.username.lower())
+        emails.add(user.email.lower())
+        validos.append((numero, user))
+    return validos, erros
+
+
+def _insere_um_por_um(session: Session, lote, linhas):
+    # Caminho lento, so quando o lote bateu numa unique constraint
+    # (alguem criou o mesmo usuario entre o SELECT e o INSERT)
+    resultados = []
+    criados = []
+    for (numero, _), linha in zip(lote, linhas):
+        try:
+            with session.begin_nested():
+                id = session.scalar(insert(User).returning(User.id), linha)
+            resultados.append(ResultadoLinha(linha=numero, status='criado', id=id))
+            criados.append((id, linha))
+        except IntegrityError:
+            resultados.append(ResultadoLinha(linha=numero, status='erro', detalhe='Nome ou Email ja existe'))
+    session.commit()
+    for id, linha in criados:
+        publica_usuario('criado', id, linha['username'], linha['email'])
+    return resultados
+
+
+def importa_lote(session: Session, lote):
+    # username/email sao unicos sem diferenciar maiusculas: compara tudo em
+    # minusculas (e o banco usa os indices de lower())
+    nomes = [user.username.lower() for _, user in lote]
+    emails = [user.email.lower() for _, user in lote]
+    existentes = session.execute(
+        select(User.username, User.email).where(
+            or_(func.lower(User.username).in_(nomes), func.lower(User.email).in_(emails))
+        )
+    ).all()
+    # Devolve a conexao ao pool enquanto os hashes sao calculados; o INSERT
+    # pega outra. Quem entrar no meio cai na unique constraint e no
+    # _insere_um_por_um, como ja acontecia
+    session.close()
+    nomes_existentes = {username.lower() for username, _ in existentes}
+    emails_existentes = {email.lower() for _, email in existentes}
+
+    resultados = []
+    novos = []
+    for numero, user in lote:
+        if user.username.lower() in nomes_existentes:
+            resultados.append(ResultadoLinha(linha=numero, status='erro', detalhe='Nome de usuario ja existe'))
+        elif user.email.lower() in emails_existentes:
+            resultados.append(ResultadoLinha(linha=numero, status='erro', detalhe='Email ja existe'))
+        else:
+            novos.append((numero, user))
+
+    if not novos:
+        return resultados
+
+    # So calcula hash de quem vai mesmo ser inserido
+    hashes = senhas.gera_varios([user.password for _, user in novos])
+    linhas = [
+        {'username': user.username, 'email': user.email, 'password': hash}
+        for (_, user), hash in zip(novos, hashes)
+    ]
+    try:
+        ids = session.scalars(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            linhas,
+        ).all()
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return resultados + _insere_um_por_um(session, novos, linhas)
+
+    for (numero, _), id, linha in zip(novos, ids, linhas):
+        resultados.append(ResultadoLinha(linha=numero, status='criado', id=id))
+        publica_usuario('criado', id, linha['username'], linha['email'])
+    return resultados
+
+
+def importa(session: Session, corpo: bytes, tamanho_lote: int) -> ResultadoImportacao:
+    validos, resultados = valida(le_linhas(corpo))
+    for inicio in range(0, len(validos), tamanho_lote):
+        resultados.extend(importa_lote(session, validos[inicio:inicio + tamanho_lote]))
+
+    resultados.sort(key=lambda r: r.linha)
+    criados = sum(1 for r in resultados if r.status == 'criado')
+    return ResultadoImportacao(
+        criados=criados,
+        erros=len(resultados) - criados,
+        resultados=resultados,
+    )
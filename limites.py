@@ -0,0 +1,250 @@
+# Limite de requisicoes nas rotas de escrita e controle de admissao
+#
+# Rate limit: token bucket por IP do cliente e por rota (o template, entao
+# PUT /usuarios/1 e PUT /usuarios/2 gastam do mesmo balde). Cada balde
+# enche RATE_LIMIT_TAXA fichas por segundo ate RATE_LIMIT_RAJADA; sem ficha
+# a rota responde 429 com Retry-After. O backend 'memoria' vale por
+# processo; o 'redis' e compartilhado entre workers/instancias (script Lua,
+# atomico, usando o relogio do Redis).
+#
+# Atras de proxy reverso o IP da conexao e o do proxy, e todo mundo cairia no
+# mesmo balde. Quando a conexao vem de um dos PROXIES_CONFIAVEIS o cliente e
+# o ultimo endereco do X-Forwarded-For que nao e de um proxy confiavel (os da
+# esquerda o proprio cliente pode forjar).
+#
+# Admissao: com o app ja sobrecarregado (requisicoes em andamento demais no
+# worker ou espera media pelo pool alta), responde 503 + Retry-After na
+# entrada em vez de enfileirar mais trabalho, pra latencia de quem entrou
+# continuar boa e o resto tentar de novo em vez de estourar o timeout.
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from database import estatisticas_pool
+from settings import Settings, get_settings
+
+
+class BaldesMemoria:
+    # Baldes em processo. Guarda no maximo max_baldes (LRU): um balde que
+    # some volta cheio, o que so favorece o cliente
+    bloqueante = False
+
+    def __init__(self, max_baldes: int = 100_000):
+        self.max_baldes = max_baldes
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consome(self, chave: str, taxa: float, rajada: int) -> tuple[bool, float]:
+        # (permitido, segundos ate ter uma ficha)
+        agora = time.monotonic()
+        with self._lock:
+            fichas, visto_em = self._baldes.get(chave, (rajada, agora))
+            fichas = min(rajada, fichas + (agora - visto_em) * taxa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            self._baldes[chave] = (fichas, agora)
+            self._baldes.move_to_end(chave)
+            while len(self._baldes) > self.max_baldes:
+                self._baldes.popitem(last=False)
+        return permitido, 0.0 if permitido else (1 - fichas) / taxa
+
+    def estatisticas(self) -> dict:
+        return {'backend': 'memoria', 'baldes': len(self._baldes)}
+
+
+# KEYS[1] = balde; ARGV = taxa, rajada. Devolve {permitido, espera}; a espera
+# vai como texto porque o Redis trunca numero do Lua pra inteiro
+CONSOME_LUA = """
+local taxa = tonumber(ARGV[1])
+local rajada = tonumber(ARGV[2])
+local relogio = redis.call('TIME')
+local agora = tonumber(relogio[1]) + tonumber(relogio[2]) / 1000000
+local estado = redis.call('HMGET', KEYS[1], 'fichas', 'visto_em')
+local fichas = tonumber(estado[1]) or rajada
+local visto_em = tonumber(estado[2]) or agora
+fichas = math.min(rajada, fichas + math.max(0, agora - visto_em) * taxa)
+local permitido = 0
+local espera = 0
+if fichas >= 1 then
+    fichas = fichas - 1
+    permitido = 1
+else
+    espera = (1 - fichas) / taxa
+end
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'visto_em', tostring(agora))
+redis.call('PEXPIRE', KEYS[1], math.ceil(rajada / taxa * 1000) + 1000)
+return {permitido, tostring(espera)}
+"""
+
+
+class BaldesRedis:
+    # Compartilhado entre processos. O cliente redis e sync, entao a
+    # dependencia chama no threadpool
+    bloqueante = True
+
+    def __init__(self, cliente, prefixo: str = 'limite:'):
+        self.cliente = cliente
+        self.prefixo = prefixo
+        self._consome = cliente.register_script(CONSOME_LUA)
+
+    def consome(self, chave: str, taxa: float, rajada: int) -> tuple[bool, float]:
+        permitido, espera = self._consome(keys=[self.prefixo + chave], args=[taxa, rajada])
+        return bool(permitido), float(espera)
+
+    def estatisticas(self) -> dict:
+        return {'backend': 'redis'}
+
+
+def le_redes(texto: str) -> list:
+    # '10.0.0.0/8, 127.0.0.1' -> redes; endereco solto vira /32 (ou /128)
+    return [ipaddress.ip_network(parte.strip(), strict=False) for parte in texto.split(',') if parte.strip()]
+
+
+def _confiavel(endereco: str, redes) -> bool:
+    try:
+        ip = ipaddress.ip_address(endereco)
+    except ValueError:
+        return False
+    return any(ip in rede for rede in redes)
+
+
+def ip_do_cliente(request: Request, proxies) -> str:
+    cliente = request.client.host if request.client else 'desconhecido'
+    if not proxies or not _confiavel(cliente, proxies):
+        return cliente
+    encaminhados = [
+        parte.strip()
+        for cabecalho in request.headers.getlist('x-forwarded-for')
+        for parte in cabecalho.split(',')
+        if parte.strip()
+    ]
+    # Da direita pra esquerda: cada proxy confiavel acrescenta quem falou com ele
+    for endereco in reversed(encaminhados):
+        if not _confiavel(endereco, proxies):
+            return endereco
+        cliente = endereco
+    return cliente
+
+
+class Limitador:
+    def __init__(self, backend, taxa: float, rajada: int, proxies=()):
+        self.backend = backend
+        self.taxa = taxa
+        self.rajada = rajada
+        self.proxies = list(proxies)
+        self.recusadas = 0
+
+    async def confere(self, request: Request):
+        if self.backend is None:
+            return
+        rota = getattr(request.scope.get('route'), 'path', request.url.path)
+        cliente = ip_do_cliente(request, self.proxies)
+        chave = f'{request.method}:{rota}:{cliente}'
+        if self.backend.bloqueante:
+            permitido, espera = await run_in_threadpool(self.backend.consome, chave, self.taxa, self.rajada)
+        else:
+            permitido, espera = self.backend.consome(chave, self.taxa, self.rajada)
+        if not permitido:
+            self.recusadas += 1
+            raise HTTPException(
+                status_code=429,
+                detail='Muitas requisicoes, tente novamente mais tarde',
+                headers={'Retry-After': str(max(1, math.ceil(espera)))},
+            )
+
+    def estatisticas(self) -> dict:
+        if self.backend is None:
+            return {'backend': 'desligado', 'recusadas': self.recusadas}
+        return {**self.backend.estatisticas(), 'recusadas': self.recusadas}
+
+
+def cria_limitador(settings: Settings) -> Limitador:
+    backend = None
+    if settings.RATE_LIMIT_BACKEND == 'redis':
+        import redis
+
+        backend = BaldesRedis(redis.Redis.from_url(settings.REDIS_URL or 'redis://localhost:6379/0'))
+    elif settings.RATE_LIMIT_BACKEND == 'memoria':
+        backend = BaldesMemoria()
+    return Limitador(
+        backend, settings.RATE_LIMIT_TAXA, settings.RATE_LIMIT_RAJADA, le_redes(settings.PROXIES_CONFIAVEIS),
+    )
+
+
+limitador = cria_limitador(get_settings())
+
+
+# Dependencia das rotas de escrita (app.py e rotas_async.py). async pra nao
+# ocupar thread do threadpool so pra contar ficha
+async def limita_escrita(request: Request):
+    await limitador.confere(request)
+
+
+ESCRITA = [Depends(limita_escrita)]
+
+
+class Admissao:
+    # Requisicoes em andamento neste worker e os limites. Tudo roda no mesmo
+    # event loop, entao os contadores nao precisam de lock
+    def __init__(self, max_em_andamento: int | None, max_espera_pool_ms: float | None, retry_after: int = 1):
+        self.max_em_andamento = max_em_andamento
+        self.max_espera_pool = None if max_espera_pool_ms is None else max_espera_pool_ms / 1000
+        self.retry_after = retry_after
+        self.em_andamento = 0
+        self.recusadas = 0
+
+    @property
+    def ativa(self) -> bool:
+        return self.max_em_andamento is not None or self.max_espera_pool is not None
+
+    def sobrecarregado(self) -> bool:
+        if self.max_em_andamento is not None and self.em_andamento >= self.max_em_andamento:
+            return True
+        return self.max_espera_pool is not None and estatisticas_pool.espera_recente() >= self.max_espera_pool
+
+
+def cria_admissao(settings: Settings) -> Admissao:
+    return Admissao(
+        settings.ADMISSAO_MAX_EM_ANDAMENTO, settings.ADMISSAO_MAX_ESPERA_POOL_MS, settings.ADMISSAO_RETRY_AFTER,
+    )
+
+
+admissao = cria_admissao(get_settings())
+
+
+class MiddlewareAdmissao:
+    # ASGI puro, como o MiddlewareMetricas. /metrics nunca e recusado, pra
+    # continuar dando pra ver o que esta acontecendo. Os fluxos de eventos
+    # ficam de fora: ficam abertos por horas e nao carregam o banco
+    def __init__(self, app, admissao: Admissao):
+        self.app = app
+        self.admissao = admissao
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(('/metrics', '/usuarios/eventos')):
+            await self.app(scope, receive, send)
+            return
+
+        admissao = self.admissao
+        if admissao.sobrecarregado():
+            admissao.recusadas += 1
+            resposta = JSONResponse(
+                status_code=503,
+                content={'detail': 'Servidor ocupado, tente novamente'},
+                headers={'Retry-After': str(admissao.retry_after)},
+            )
+            await resposta(scope, receive, send)
+            return
+
+        admissao.em_andamento += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admissao.em_andamento -= 1
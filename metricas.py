@@ -0,0 +1,199 @@
+# Metricas das rotas e das consultas no formato texto do Prometheus (GET /metrics)
+#
+# O MiddlewareMetricas mede cada requisicao (latencia por rota e status) e abre
+# um contador de consultas que os hooks before/after_cursor_execute do
+# database.py vao somando, via contextvar. Assim da pra ver, por rota, quantas
+# idas ao banco e quanto tempo de banco cada requisicao gastou.
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+logger = logging.getLogger('crud.consultas')
+
+# Limites dos buckets em segundos (os mesmos do client oficial do Prometheus)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Consultas por requisicao
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observa(self, valor: float):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+class ConsultasRequisicao:
+    # Consultas feitas durante uma requisicao (compartilhado com a thread do
+    # threadpool, que recebe uma copia do contexto com o mesmo objeto)
+    __slots__ = ('quantidade', 'segundos')
+
+    def __init__(self):
+        self.quantidade = 0
+        self.segundos = 0.0
+
+
+_consultas_atual: ContextVar[ConsultasRequisicao | None] = ContextVar('consultas_atual', default=None)
+
+
+def _escapa(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra: str = '') -> str:
+    pares = [f'{nome}="{_escapa(str(valor))}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor) -> str:
+    if isinstance(valor, float):
+        return repr(valor) if valor != int(valor) else str(int(valor))
+    return str(valor)
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (metodo, rota) -> Histograma
+        self.latencia = {}
+        self.consultas_por_requisicao = {}
+        self.tempo_banco = {}
+        # (metodo, rota, status) -> contagem
+        self.respostas = {}
+        # operacao (SELECT, INSERT...) -> Histograma
+        self.consultas = {}
+        self.consultas_lentas = 0
+        self.limite_lenta = None
+        # Requisicoes terminadas desde o inicio (a compactacao usa pra saber se
+        # o app esta quieto)
+        self.total_requisicoes = 0
+
+    def configura(self, limite_lenta_ms: float | None):
+        self.limite_lenta = None if limite_lenta_ms is None else limite_lenta_ms / 1000
+
+    def registra_requisicao(self, metodo: str, rota: str, status: int, segundos: float,
+                            consultas: ConsultasRequisicao):
+        chave = (metodo, rota)
+        with self._lock:
+            if chave not in self.latencia:
+                self.latencia[chave] = Histograma(BUCKETS)
+                self.consultas_por_requisicao[chave] = Histograma(BUCKETS_CONSULTAS)
+                self.tempo_banco[chave] = Histograma(BUCKETS)
+            self.latencia[chave].observa(segundos)
+            self.consultas_por_requisicao[chave].observa(consultas.quantidade)
+            self.tempo_banco[chave].observa(consultas.segundos)
+            chave_status = (metodo, rota, status)
+            self.respostas[chave_status] = self.respostas.get(chave_status, 0) + 1
+            self.total_requisicoes += 1
+
+    def registra_consulta(self, sql: str, segundos: float):
+        atual = _consultas_atual.get()
+        if atual is not None:
+            atual.quantidade += 1
+            atual.segundos += segundos
+        operacao = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'VAZIA'
+        lenta = self.limite_lenta is not None and segundos >= self.limite_lenta
+        with self._lock:
+            if operacao not in self.consultas:
+                self.consultas[operacao] = Histograma(BUCKETS)
+            self.consultas[operacao].observa(segundos)
+            if lenta:
+                self.consultas_lentas += 1
+        if lenta:
+            logger.warning('consulta lenta (%.1f ms): %s', segundos * 1000, sql)
+
+    def _histogramas(self, nome, ajuda, rotulos, dados, linhas):
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} histogram')
+        for valores, histograma in sorted(dados.items()):
+            acumulado = 0
+            for limite, contagem in zip(histograma.limites, histograma.contagens):
+                acumulado += contagem
+                le = 'le="' + _numero(limite) + '"'
+                linhas.append(f'{nome}_bucket{_rotulos(rotulos, valores, le)} {acumulado}')
+            le = 'le="+Inf"'
+            linhas.append(f'{nome}_bucket{_rotulos(rotulos, valores, le)} {histograma.total}')
+            linhas.append(f'{nome}_sum{_rotulos(rotulos, valores)} {_numero(histograma.soma)}')
+            linhas.append(f'{nome}_count{_rotulos(rotulos, valores)} {histograma.total}')
+
+    def exporta(self, extras: dict[str, tuple[str, str, float]] | None = None) -> str:
+        # extras: nome -> (tipo, ajuda, valor) de gauges/contadores de fora
+        # (pool, cache) que entram no mesmo texto
+        linhas = []
+        with self._lock:
+            self._histogramas(
+                'crud_requisicao_segundos', 'Latencia das requisicoes por rota',
+                ('metodo', 'rota'), self.latencia, linhas,
+            )
+            linhas.append('# HELP crud_respostas_total Respostas por rota e status')
+            linhas.append('# TYPE crud_respostas_total counter')
+            for valores, contagem in sorted(self.respostas.items()):
+                linhas.append(f'crud_respostas_total{_rotulos(("metodo", "rota", "status"), valores)} {contagem}')
+            self._histogramas(
+                'crud_consultas_por_requisicao', 'Consultas ao banco feitas por requisicao',
+                ('metodo', 'rota'), self.consultas_por_requisicao, linhas,
+            )
+            self._histogramas(
+                'crud_banco_segundos_por_requisicao', 'Tempo gasto em consultas por requisicao',
+                ('metodo', 'rota'), self.tempo_banco, linhas,
+            )
+            self._histogramas(
+                'crud_consulta_segundos', 'Duracao de cada consulta por operacao',
+                ('operacao',), {(operacao,): h for operacao, h in self.consultas.items()}, linhas,
+            )
+            linhas.append('# HELP crud_consultas_lentas_total Consultas acima de SLOW_QUERY_MS')
+            linhas.append('# TYPE crud_consultas_lentas_total counter')
+            linhas.append(f'crud_consultas_lentas_total {self.consultas_lentas}')
+        for nome, (tipo, ajuda, valor) in (extras or {}).items():
+            linhas.append(f'# HELP {nome} {ajuda}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+            linhas.append(f'{nome} {_numero(valor)}')
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = Metricas()
+
+
+class MiddlewareMetricas:
+    # Middleware ASGI puro (o BaseHTTPMiddleware roda a rota em outra task e
+    # custa mais por requisicao). A rota vem do scope depois do roteamento,
+    # entao o rotulo e o template (/usuarios/{id}) e nao o caminho com o id
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # A requisicao de aquecimento do startup (app.aquece_rotas) fica de fora
+        if scope['type'] != 'http' or scope.get('aquecimento'):
+            await self.app(scope, receive, send)
+            return
+
+        consultas = ConsultasRequisicao()
+        token = _consultas_atual.set(consultas)
+        status = 500
+        inicio = time.perf_counter()
+
+        async def envia(mensagem):
+            nonlocal status
+            if mensagem['type'] == 'http.response.start':
+                status = mensagem['status']
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, envia)
+        finally:
+            _consultas_atual.reset(token)
+            rota = scope.get('route')
+            metricas.registra_requisicao(
+                scope['method'], getattr(rota, 'path', 'sem_rota'), status,
+                time.perf_counter() - inicio, consultas,
+            )
@@ -11,7 +11,10 @@ from models import table_registry
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option('sqlalchemy.url', Settings().DATABASE_URL)
+url_banco = Settings().DATABASE_URL
+if not url_banco:
+    raise RuntimeError('DATABASE_URL nao configurada: defina no ambiente ou no .env')
+config.set_main_option('sqlalchemy.url', url_banco)
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,135 @@
+"""users lower unique indexes
+
+Revision ID: 22fcea93a019
+Revises: 6537daa356a8
+Create Date: 2026-10-18 13:12:40.517309
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '22fcea93a019'
+down_revision: Union[str, Sequence[str], None] = '6537daa356a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TAMANHO_USERNAME = 50
+TAMANHO_EMAIL = 254
+
+# Mesmos triggers da busca de 81ece3d306d0: somem junto quando a tabela e
+# recriada no SQLite
+TRIGGERS_BUSCA = (
+    "CREATE TRIGGER users_busca_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_busca(rowid, username, email) VALUES (new.id, new.username, new.email); "
+    "END",
+    "CREATE TRIGGER users_busca_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_busca(users_busca, rowid, username, email) "
+    "VALUES ('delete', old.id, old.username, old.email); "
+    "END",
+    "CREATE TRIGGER users_busca_au AFTER UPDATE OF username, email ON users BEGIN "
+    "INSERT INTO users_busca(users_busca, rowid, username, email) "
+    "VALUES ('delete', old.id, old.username, old.email); "
+    "INSERT INTO users_busca(rowid, username, email) VALUES (new.id, new.username, new.email); "
+    "END",
+)
+
+
+def _confere_dados() -> None:
+    # Falha antes de mexer em algo se os dados atuais nao cabem nas regras
+    # novas (nomes que so diferem em maiusculas ou maiores que o limite)
+    if context.is_offline_mode():
+        return
+    conn = op.get_bind()
+    for coluna, tamanho in (('username', TAMANHO_USERNAME), ('email', TAMANHO_EMAIL)):
+        repetidos = conn.execute(sa.text(
+            f'SELECT lower({coluna}) FROM users GROUP BY lower({coluna}) HAVING count(*) > 1 LIMIT 5'
+        )).scalars().all()
+        if repetidos:
+            raise RuntimeError(f'{coluna} repetido ignorando maiusculas, resolva antes de migrar: {repetidos}')
+        longos = conn.execute(sa.text(
+            f'SELECT count(*) FROM users WHERE length({coluna}) > {tamanho}'
+        )).scalar()
+        if longos:
+            raise RuntimeError(f'{longos} usuarios com {coluna} maior que {tamanho}, resolva antes de migrar')
+
+
+def _recria_sqlite(username: sa.String, email: sa.String, *restricoes) -> None:
+    # O SQLite nao tira UNIQUE nem muda tipo com ALTER: copia pra uma tabela
+    # nova. Os ids ficam os mesmos, entao o indice FTS (users_busca) continua
+    # valendo e so os triggers precisam voltar
+    for trigger in ('users_busca_au', 'users_busca_ad', 'users_busca_ai'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.create_table(
+        'users_novo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', username, nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('email', email, nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        *restricoes,
+    )
+    colunas = 'id, username, password, email, created_at, updated_at, deleted_at'
+    op.execute(f'INSERT INTO users_novo ({colunas}) SELECT {colunas} FROM users')
+    op.drop_table('users')
+    op.rename_table('users_novo', 'users')
+    op.create_index(
+        'ix_users_ativos', 'users', ['id'],
+        sqlite_where=sa.text('deleted_at IS NULL'),
+    )
+    op.create_index(
+        'ix_users_removidos', 'users', ['deleted_at'],
+        sqlite_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    for trigger in TRIGGERS_BUSCA:
+        op.execute(trigger)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _confere_dados()
+    if op.get_bind().dialect.name == 'sqlite':
+        _recria_sqlite(sa.String(TAMANHO_USERNAME), sa.String(TAMANHO_EMAIL))
+    else:
+        op.alter_column('users', 'username', type_=sa.String(TAMANHO_USERNAME), existing_nullable=False)
+        op.alter_column('users', 'email', type_=sa.String(TAMANHO_EMAIL), existing_nullable=False)
+
+    # Unicos sem diferenciar maiusculas: o lookup por username/email compara
+    # lower(coluna) = lower(valor) e usa esses indices. Os UNIQUE antigos
+    # (case-sensitive) ficariam sobrando, entao saem
+    op.create_index('ix_users_username_lower', 'users', [sa.text('lower(username)')], unique=True)
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('users_username_key', 'users', type_='unique')
+        op.drop_constraint('users_email_key', 'users', type_='unique')
+
+    # Listagem ordenada por created_at (cursor em created_at, id), so ativos
+    op.create_index(
+        'ix_users_ativos_criacao', 'users', ['created_at', 'id'],
+        sqlite_where=sa.text('deleted_at IS NULL'),
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_ativos_criacao', table_name='users')
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.drop_index('ix_users_username_lower', table_name='users')
+    if op.get_bind().dialect.name == 'sqlite':
+        _recria_sqlite(
+            sa.String(), sa.String(),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username'),
+        )
+    else:
+        op.create_unique_constraint('users_username_key', 'users', ['username'])
+        op.create_unique_constraint('users_email_key', 'users', ['email'])
+        op.alter_column('users', 'email', type_=sa.String(), existing_nullable=False)
+        op.alter_column('users', 'username', type_=sa.String(), existing_nullable=False)
@@ -0,0 +1,45 @@
+"""add users deleted_at
+
+Revision ID: 6537daa356a8
+Revises: 81ece3d306d0
+Create Date: 2026-10-18 11:03:38.935378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6537daa356a8'
+down_revision: Union[str, Sequence[str], None] = '81ece3d306d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_users_ativos', 'users', ['id'],
+        sqlite_where=sa.text('deleted_at IS NULL'),
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+    op.create_index(
+        'ix_users_removidos', 'users', ['deleted_at'],
+        sqlite_where=sa.text('deleted_at IS NOT NULL'),
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_removidos', table_name='users')
+    op.drop_index('ix_users_ativos', table_name='users')
+    if op.get_bind().dialect.name == 'sqlite':
+        # DROP COLUMN nativo (SQLite 3.35+). O batch_alter_table recriaria a
+        # tabela e levaria junto os triggers da busca (81ece3d306d0)
+        op.execute('ALTER TABLE users DROP COLUMN deleted_at')
+    else:
+        op.drop_column('users', 'deleted_at')
@@ -0,0 +1,77 @@
+"""add users search index
+
+Revision ID: 81ece3d306d0
+Revises: 189ce0080d2a
+Create Date: 2026-10-18 10:05:12.418233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '81ece3d306d0'
+down_revision: Union[str, Sequence[str], None] = '189ce0080d2a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialeto = op.get_bind().dialect.name
+
+    if dialeto == 'sqlite':
+        # Indice FTS5 de trigramas (external content: guarda so o indice, os
+        # dados continuam em users) mantido em dia por triggers
+        op.execute(
+            "CREATE VIRTUAL TABLE users_busca USING fts5("
+            "username, email, content='users', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            "CREATE TRIGGER users_busca_ai AFTER INSERT ON users BEGIN "
+            "INSERT INTO users_busca(rowid, username, email) VALUES (new.id, new.username, new.email); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER users_busca_ad AFTER DELETE ON users BEGIN "
+            "INSERT INTO users_busca(users_busca, rowid, username, email) "
+            "VALUES ('delete', old.id, old.username, old.email); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER users_busca_au AFTER UPDATE OF username, email ON users BEGIN "
+            "INSERT INTO users_busca(users_busca, rowid, username, email) "
+            "VALUES ('delete', old.id, old.username, old.email); "
+            "INSERT INTO users_busca(rowid, username, email) VALUES (new.id, new.username, new.email); "
+            "END"
+        )
+        # Indexa o que ja existe
+        op.execute("INSERT INTO users_busca(users_busca) VALUES ('rebuild')")
+
+    elif dialeto == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index(
+            'ix_users_username_trgm', 'users', ['username'],
+            postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'},
+        )
+        op.create_index(
+            'ix_users_email_trgm', 'users', ['email'],
+            postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'},
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialeto = op.get_bind().dialect.name
+
+    if dialeto == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS users_busca_au')
+        op.execute('DROP TRIGGER IF EXISTS users_busca_ad')
+        op.execute('DROP TRIGGER IF EXISTS users_busca_ai')
+        op.execute('DROP TABLE IF EXISTS users_busca')
+
+    elif dialeto == 'postgresql':
+        op.drop_index('ix_users_email_trgm', table_name='users')
+        op.drop_index('ix_users_username_trgm', table_name='users')
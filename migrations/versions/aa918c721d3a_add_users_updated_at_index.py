@@ -0,0 +1,30 @@
+"""add users updated_at index
+
+Revision ID: aa918c721d3a
+Revises: 22fcea93a019
+Create Date: 2026-10-18 14:20:07.861542
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'aa918c721d3a'
+down_revision: Union[str, Sequence[str], None] = '22fcea93a019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Feed de mudancas (GET /usuarios/changes), ordenado por (updated_at, id).
+    # Nao e parcial: as lapides (deleted_at preenchido) tambem saem no feed
+    op.create_index('ix_users_atualizacao', 'users', ['updated_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_atualizacao', table_name='users')
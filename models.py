@@ -1,24 +1,78 @@
 from datetime import datetime
-from sqlalchemy import func
+from typing import Optional
+
+from sqlalchemy import DateTime, Index, String, func, text
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import Mapped, mapped_column, registry
 
 table_registry = registry()
 
+# Limites de username/email (o schema valida antes de chegar no banco)
+TAMANHO_USERNAME = 50
+TAMANHO_EMAIL = 254
+
+# No SQLite o CURRENT_TIMESTAMP grava 'AAAA-MM-DD HH:MM:SS' (sem microssegundos).
+# Os parametros precisam sair no mesmo formato senao as comparacoes de data
+# (cursor de paginacao por exemplo) comparam texto diferente.
+DataHora = DateTime().with_variant(
+    sqlite.DATETIME(
+        storage_format='%(year)04d-%(month)02d-%(day)02d '
+        '%(hour)02d:%(minute)02d:%(second)02d'
+    ),
+    'sqlite',
+)
+
 @table_registry.mapped_as_dataclass
 class User:
     __tablename__ = 'users'
+    # Indices parciais: um so com os ativos (listagens/lookup filtram
+    # deleted_at IS NULL), um pra listagem por created_at e outro so com os
+    # apagados, pra compactacao achar as lapides sem varrer a tabela.
+    # ix_users_atualizacao e o do feed de mudancas, com lapides e tudo
+    __table_args__ = (
+        Index(
+            'ix_users_ativos', 'id',
+            sqlite_where=text('deleted_at IS NULL'),
+            postgresql_where=text('deleted_at IS NULL'),
+        ),
+        Index(
+            'ix_users_ativos_criacao', 'created_at', 'id',
+            sqlite_where=text('deleted_at IS NULL'),
+            postgresql_where=text('deleted_at IS NULL'),
+        ),
+        Index('ix_users_atualizacao', 'updated_at', 'id'),
+        Index(
+            'ix_users_removidos', 'deleted_at',
+            sqlite_where=text('deleted_at IS NOT NULL'),
+            postgresql_where=text('deleted_at IS NOT NULL'),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
-    username: Mapped[str] = mapped_column(unique=True)
+    username: Mapped[str] = mapped_column(String(TAMANHO_USERNAME))
     password: Mapped[str]
-    email: Mapped[str] = mapped_column(unique=True)
+    email: Mapped[str] = mapped_column(String(TAMANHO_EMAIL))
     
     created_at: Mapped[datetime] = mapped_column(
-        init=False, server_default=func.now()
+        DataHora, init=False, server_default=func.now()
     )
     
     updated_at: Mapped[datetime] = mapped_column(
+        DataHora,
         init=False, 
         server_default=func.now(), 
         onupdate=func.now()
-    )
\ No newline at end of file
+    )
+
+    # Delete logico: a linha vira lapide e so sai de vez na compactacao
+    # (compactacao.py). Enquanto isso username/email continuam reservados
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(
+        DataHora, init=False, default=None
+    )
+
+
+# username/email sao unicos sem diferenciar maiusculas. As buscas comparam
+# lower(coluna) = lower(valor) (regras.mesmo_nome/mesmo_email) pra usar esses
+# indices
+Index('ix_users_username_lower', func.lower(User.username), unique=True)
+Index('ix_users_email_lower', func.lower(User.email), unique=True)
@@ -0,0 +1,91 @@
+# Feed de mudancas (GET /usuarios/changes?since=<watermark>)
+#
+# Devolve os usuarios criados, alterados ou apagados depois do watermark, em
+# ordem (updated_at, id), pra quem sincroniza nao precisar reler a listagem
+# inteira. O watermark e um cursor (paginacao.py) com o (updated_at, id) da
+# ultima linha entregue; o cliente guarda e manda de volta no proximo pedido.
+# Apagado sai como lapide enquanto a compactacao nao tira a linha de vez, entao
+# um watermark mais velho que COMPACTACAO_RETENCAO pode ter perdido remocoes e
+# recebe 410 (o cliente refaz a carga completa, /usuarios/export por exemplo).
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from compactacao import agora_do_banco
+from models import User
+from paginacao import codifica_cursor, decodifica_cursor, depois_de
+from regras import resposta_json
+from schema import MudancasLinhas
+from settings import Settings
+
+ORDEM = 'mudancas'
+COLUNAS = (User.id, User.username, User.email, User.updated_at, User.deleted_at)
+
+_json_mudancas = TypeAdapter(MudancasLinhas)
+
+
+def le_watermark(since: str) -> tuple[datetime, int]:
+    # Aceita o watermark devolvido pelo feed ou uma data ISO (primeira
+    # sincronizacao a partir de um instante)
+    try:
+        data = datetime.fromisoformat(since)
+    except ValueError:
+        try:
+            id, data = decodifica_cursor(since, ORDEM)
+        except ValueError as erro:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(erro))
+        return data, id
+    if data.tzinfo is not None:
+        # updated_at e gravado em UTC sem fuso
+        data = data.astimezone(timezone.utc).replace(tzinfo=None)
+    return data, 0
+
+
+def linha_mudanca(linha) -> dict:
+    removido = linha.deleted_at is not None
+    return {
+        'id': linha.id,
+        'username': None if removido else linha.username,
+        'email': None if removido else linha.email,
+        'updated_at': linha.updated_at.isoformat(),
+        'removido': removido,
+    }
+
+
+def lista_mudancas(session: Session, since: Optional[str], limit: int, settings: Settings):
+    desde = le_watermark(since) if since else None
+
+    agora = agora_do_banco(session)
+    if desde and settings.COMPACTACAO_ATIVA and desde[0] < agora - timedelta(seconds=settings.COMPACTACAO_RETENCAO):
+        raise HTTPException(
+            status_code=HTTPStatus.GONE,
+            detail='Watermark mais antigo que a retencao das remocoes, refaca a sincronizacao completa',
+        )
+
+    query = select(*COLUNAS).where(User.updated_at <= agora - timedelta(seconds=settings.MUDANCAS_ATRASO))
+    if desde:
+        query = query.where(depois_de(User.updated_at, User.id, *desde))
+    # Um a mais so pra saber se tem proxima pagina
+    linhas = session.execute(query.order_by(User.updated_at, User.id).limit(limit + 1)).all()
+    session.close()
+
+    tem_mais = len(linhas) > limit
+    linhas = linhas[:limit]
+    if linhas:
+        watermark = codifica_cursor(ORDEM, linhas[-1].id, linhas[-1].updated_at)
+    elif desde:
+        # Nada novo: o mesmo ponto, ja no formato de watermark
+        watermark = codifica_cursor(ORDEM, desde[1], desde[0])
+    else:
+        watermark = None
+
+    return resposta_json(_json_mudancas.dump_json({
+        'mudancas': [linha_mudanca(linha) for linha in linhas],
+        'watermark': watermark,
+        'tem_mais': tem_mais,
+    }))
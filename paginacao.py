@@ -0,0 +1,36 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+# O cursor e so um json em base64, o cliente nao precisa saber o que tem dentro
+def codifica_cursor(ordem: str, id: int, data: datetime | None = None) -> str:
+    dados = {'o': ordem, 'id': id}
+    if data is not None:
+        dados['d'] = data.isoformat()
+    bruto = json.dumps(dados, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodifica_cursor(cursor: str, ordem: str) -> tuple[int, datetime | None]:
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        if dados['o'] != ordem:
+            raise ValueError('cursor de outra ordenacao')
+        data = datetime.fromisoformat(dados['d']) if 'd' in dados else None
+        return int(dados['id']), data
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Cursor invalido')
+
+
+# Condicao "depois de (data, id)" escrita sem row values pra funcionar em qualquer banco.
+# O `coluna_data >= data` na frente vira um intervalo no indice (data, id); so
+# com o OR o SQLite varria o indice inteiro ou ordenava numa B-tree temporaria
+def depois_de(coluna_data, coluna_id, data: datetime, id: int):
+    return and_(
+        coluna_data >= data,
+        or_(coluna_data > data, coluna_id > id),
+    )
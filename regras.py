@@ -0,0 +1,276 @@
+# Regras compartilhadas entre as rotas sync (app.py) e async (rotas_async.py)
+from http import HTTPStatus
+from typing import List, Optional
+
+from fastapi import HTTPException, Response
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from cache import cache_usuarios
+from coalescencia import voo_unico, voo_unico_async
+from models import User
+from paginacao import codifica_cursor, decodifica_cursor, depois_de
+from schema import LinhaParcial, LinhaUsuario, LookupLinhas, PaginaLinhas, PaginaParcial
+
+
+def senha_eh_forte(senha: str) -> bool:
+    # Verifica se tem letras E numeros
+    tem_letra = any(c.isalpha() for c in senha)
+    tem_numero = any(c.isdigit() for c in senha)
+    return tem_letra and tem_numero
+
+
+# Usuario nao apagado (delete logico, ver models.User.deleted_at). Toda
+# leitura/escrita de usuario passa por isso
+ATIVO = User.deleted_at.is_(None)
+
+
+# username/email sao unicos sem diferenciar maiusculas. Comparando pelo
+# lower() o banco usa os indices ix_users_username_lower/ix_users_email_lower
+def mesmo_nome(nome):
+    return func.lower(User.username) == func.lower(nome)
+
+
+def mesmo_email(email):
+    return func.lower(User.email) == func.lower(email)
+
+
+# So as colunas que a resposta usa, sem carregar o User inteiro
+COLUNAS_LISTAGEM = (User.id, User.username, User.email)
+CAMPOS_LISTAGEM = ('id', 'username', 'email')
+
+MSGPACK = 'application/msgpack'
+
+# Compilados uma vez so; o dump_json roda todo no pydantic-core
+_json_lista = TypeAdapter(List[LinhaUsuario])
+_json_pagina = TypeAdapter(PaginaLinhas)
+_json_lista_parcial = TypeAdapter(List[LinhaParcial])
+_json_pagina_parcial = TypeAdapter(PaginaParcial)
+_json_lookup = TypeAdapter(LookupLinhas)
+
+
+def le_campos(fields: Optional[str]) -> Optional[tuple[str, ...]]:
+    # fields=id,username -> ('id', 'username'), na ordem de CAMPOS_LISTAGEM.
+    # None quando nao veio ou pediu todos (caminho normal da listagem)
+    if fields is None:
+        return None
+    pedidos = {campo.strip() for campo in fields.split(',') if campo.strip()}
+    invalidos = pedidos - set(CAMPOS_LISTAGEM)
+    if invalidos or not pedidos:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f"fields invalido: use {', '.join(CAMPOS_LISTAGEM)}",
+        )
+    campos = tuple(campo for campo in CAMPOS_LISTAGEM if campo in pedidos)
+    return None if campos == CAMPOS_LISTAGEM else campos
+
+
+def _msgpack():
+    # Pacote opcional: sem ele as listagens so respondem JSON
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def formato_pedido(accept: Optional[str]) -> str:
+    # 'msgpack' se o cliente pediu no Accept e o pacote esta instalado
+    if accept and ('application/msgpack' in accept or 'application/x-msgpack' in accept) and _msgpack():
+        return 'msgpack'
+    return 'json'
+
+
+def query_listagem(
+    skip: int,
+    limit: int,
+    paginacao: str,
+    cursor: Optional[str],
+    ordem: str,
+    campos: Optional[tuple[str, ...]] = None,
+):
+    # Devolve (query, modo_cursor). Com campos so busca essas colunas (o id
+    # vem sempre, e o que monta o cursor)
+    colunas = COLUNAS_LISTAGEM
+    if campos is not None:
+        colunas = (User.id, *(getattr(User, campo) for campo in campos if campo != 'id'))
+    if paginacao == 'offset' and cursor is None:
+        # Ordem explicita: sem ela a ordem seria a do indice que o planner
+        # escolhesse (ix_users_ativos_criacao por exemplo)
+        return select(*colunas).where(ATIVO).order_by(User.id).offset(skip).limit(limit), False
+
+    # Modo cursor (keyset): continua de onde a pagina anterior parou,
+    # entao o custo e o mesmo na pagina 1 ou na pagina 1000
+    if ordem == 'created_at':
+        # created_at so entra pra montar o proximo cursor
+        query = select(*colunas, User.created_at).where(ATIVO).order_by(User.created_at, User.id)
+    else:
+        query = select(*colunas).where(ATIVO).order_by(User.id)
+
+    if cursor:
+        try:
+            ultimo_id, ultima_data = decodifica_cursor(cursor, ordem)
+        except ValueError as erro:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(erro))
+
+        if ordem == 'created_at':
+            if ultima_data is None:
+                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail='Cursor invalido')
+            query = query.where(depois_de(User.created_at, User.id, ultima_data, ultimo_id))
+        else:
+            query = query.where(User.id > ultimo_id)
+
+    # Busca um a mais so pra saber se existe proxima pagina
+    return query.limit(limit + 1), True
+
+
+
+def resposta_json(corpo: bytes) -> Response:
+    # Corpo ja pronto: o FastAPI devolve como esta, sem passar pelo response_model
+    return Response(corpo, media_type='application/json')
+
+
+def _dicts(linhas, campos, formato: str) -> list:
+    if campos is None and formato == 'json':
+        # Caminho normal: o TypeAdapter ja deixa de fora o que sobra (created_at)
+        return [linha._asdict() for linha in linhas]
+    campos = campos or CAMPOS_LISTAGEM
+    return [{campo: getattr(linha, campo) for campo in campos} for linha in linhas]
+
+
+def _resposta_listagem(dados, adaptador: TypeAdapter, formato: str) -> Response:
+    if formato == 'msgpack':
+        resposta = Response(_msgpack().packb(dados), media_type=MSGPACK)
+    else:
+        resposta = resposta_json(adaptador.dump_json(dados))
+    # O formato depende do Accept: cache/proxy no caminho precisa saber
+    resposta.headers['Vary'] = 'Accept'
+    return resposta
+
+
+def monta_lista(linhas, campos: Optional[tuple[str, ...]] = None, formato: str = 'json') -> Response:
+    adaptador = _json_lista if campos is None else _json_lista_parcial
+    return _resposta_listagem(_dicts(linhas, campos, formato), adaptador, formato)
+
+
+def monta_pagina(
+    linhas,
+    limit: int,
+    ordem: str,
+    campos: Optional[tuple[str, ...]] = None,
+    formato: str = 'json',
+) -> Response:
+    proximo = None
+    if len(linhas) > limit:
+        linhas = linhas[:limit]
+        ultimo = linhas[-1]
+        data = ultimo.created_at if ordem == 'created_at' else None
+        proximo = codifica_cursor(ordem, ultimo.id, data)
+
+    adaptador = _json_pagina if campos is None else _json_pagina_parcial
+    return _resposta_listagem(
+        {'usuarios': _dicts(linhas, campos, formato), 'next_cursor': proximo},
+        adaptador,
+        formato,
+    )
+
+
+def detalhe_conflito(erro: IntegrityError) -> str:
+    # Descobre qual unique constraint estourou pela primeira linha do erro do
+    # driver. O ultimo pedaco e o nome da constraint/coluna, sem os valores:
+    #   sqlite:   UNIQUE constraint failed: index 'ix_users_username_lower'
+    #   postgres: duplicate key value violates unique constraint "ix_users_email_lower"
+    #   mysql:    Duplicate entry 'x' for key 'users.username'
+    linhas = str(erro.orig).splitlines()
+    alvo = linhas[0].rsplit(' ', 1)[-1] if linhas else ''
+    if 'username' in alvo:
+        return 'Nome de usuario ja existe'
+    if 'email' in alvo:
+        return 'Email ja existe'
+    return 'Nome ou Email ja existe'
+
+
+# Colunas que montam o payload publico (o que vai pro cache e pro ETag)
+COLUNAS_PAYLOAD = (User.id, User.username, User.email, User.updated_at)
+
+
+def carrega_payload(session, condicao, guarda: bool = True):
+    # Le o payload do usuario ativo que bate com a condicao e, com guarda, ja
+    # poe no cache. None se nao existe. Fecha a sessao na hora pra devolver a conexao
+    # ao pool: o teardown do get_session roda no threadpool, e num pico as
+    # threads ocupadas esperando conexao seguravam as conexoes que iam ser
+    # devolvidas (deadlock ate o DB_POOL_TIMEOUT). A marca vem antes do SELECT:
+    # se uma escrita invalidar o usuario no meio, o guarda nao grava
+    marca = cache_usuarios.marca()
+    linha = session.execute(select(*COLUNAS_PAYLOAD).where(condicao, ATIVO)).one_or_none()
+    session.close()
+    if linha is None:
+        return None
+    payload = payload_usuario(linha)
+    if guarda:
+        cache_usuarios.guarda(payload, marca)
+    return payload
+
+
+async def carrega_payload_async(session, condicao, guarda: bool = True):
+    marca = cache_usuarios.marca()
+    linha = (await session.execute(select(*COLUNAS_PAYLOAD).where(condicao, ATIVO))).one_or_none()
+    await session.close()
+    if linha is None:
+        return None
+    payload = payload_usuario(linha)
+    if guarda:
+        cache_usuarios.guarda(payload, marca)
+    return payload
+
+
+def _do_cache(chave):
+    tipo, valor = chave
+    return cache_usuarios.por_id(valor) if tipo == 'id' else cache_usuarios.por_nome(valor)
+
+
+def busca_payload(session, chave, condicao):
+    # Cache -> single-flight -> banco. chave e ('id', id) ou ('nome', nome).
+    # Sessao marcada como primario (cliente escreveu ha pouco, ver
+    # database.get_session_leitura) vai direto ao banco: o cache e a consulta
+    # em andamento podem ter vindo de uma replica atrasada. E o que vem de
+    # replica nao entra no cache: logo depois de uma escrita ela pode devolver
+    # a versao anterior, que ficaria no cache (com o ETag velho) pelo TTL
+    # inteiro, bem depois do cookie de leitura propria expirar
+    if session.info.get('primario'):
+        return carrega_payload(session, condicao)
+    guarda = not session.info.get('replica')
+    payload = _do_cache(chave)
+    if payload is None:
+        # Leituras simultaneas da mesma chave viram uma consulta so
+        payload = voo_unico.faz(chave, lambda: carrega_payload(session, condicao, guarda))
+    return payload
+
+
+async def busca_payload_async(session, chave, condicao):
+    if session.info.get('primario'):
+        return await carrega_payload_async(session, condicao)
+    guarda = not session.info.get('replica')
+    payload = _do_cache(chave)
+    if payload is None:
+        payload = await voo_unico_async.faz(chave, lambda: carrega_payload_async(session, condicao, guarda))
+    return payload
+
+
+def payload_usuario(linha) -> dict:
+    # Aceita um User ou uma linha com as COLUNAS_PAYLOAD
+    return {
+        'id': linha.id,
+        'username': linha.username,
+        'email': linha.email,
+        'updated_at': linha.updated_at.isoformat(),
+    }
+
+
+def monta_lookup(ids, achados: dict) -> Response:
+    # Na ordem pedida; os payloads do cache tem updated_at, que fica de fora
+    return resposta_json(_json_lookup.dump_json({
+        'usuarios': [achados[id] for id in ids if id in achados],
+        'nao_encontrados': [id for id in ids if id not in achados],
+    }))
@@ -0,0 +1,177 @@
+# Replicas de leitura (DATABASE_REPLICA_URLS)
+#
+# As rotas de leitura (listagem e GET por id/username) pegam a sessao de uma
+# replica escolhida aqui; as escritas continuam no primario. Uma replica que
+# falhar na checagem periodica sai da roda ate voltar a responder, e sem
+# nenhuma saudavel a leitura cai no primario.
+#
+# Leitura da propria escrita: a replica pode estar atrasada, entao depois de
+# uma escrita o MiddlewareLeituraPropria grava um cookie e, enquanto ele valer,
+# as leituras daquele cliente vao pro primario (sem cache nem single-flight).
+# O cache compartilhado so e preenchido por leituras do primario: o que vem de
+# uma replica atrasada voltaria pro cache depois da invalidacao e continuaria
+# la depois do cookie expirar.
+import asyncio
+import itertools
+import logging
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from models import User
+
+logger = logging.getLogger('crud.replicas')
+
+COOKIE_PRIMARIO = 'crud_le_primario'
+# Rotas que mudam usuarios, as unicas que renovam o cookie. POST /login e
+# POST /usuarios/lookup so leem: mandar o cliente pro primario depois delas
+# tiraria carga das replicas a toa
+ROTAS_ESCRITA = frozenset({('POST', '/usuarios'), ('POST', '/usuarios/bulk'), ('DELETE', '/usuarios')})
+METODOS_POR_ID = frozenset({'PUT', 'PATCH', 'DELETE'})
+CAMINHO_POR_ID = re.compile(r'/usuarios/\d+/?')
+
+
+def eh_escrita(metodo: str, caminho: str) -> bool:
+    if (metodo, caminho.rstrip('/') or '/') in ROTAS_ESCRITA:
+        return True
+    return metodo in METODOS_POR_ID and CAMINHO_POR_ID.fullmatch(caminho) is not None
+
+# So confirma que o banco responde e tem o schema (num arquivo SQLite que
+# sumiu o connect cria um banco vazio, e um SELECT 1 passaria)
+CHECAGEM = select(User.id).limit(1)
+
+
+class Replica:
+    def __init__(self, url: str, engine):
+        self.url = url
+        self.engine = engine
+        self.saudavel = True
+        self.leituras = 0
+
+    def pool(self):
+        motor = getattr(self.engine, 'sync_engine', self.engine)
+        return motor.pool
+
+    def em_uso(self) -> int:
+        # SingletonThreadPool (SQLite em memoria) nao conta checkouts
+        checkedout = getattr(self.pool(), 'checkedout', None)
+        return checkedout() if checkedout is not None else 0
+
+
+class Replicas:
+    def __init__(self, replicas: list[Replica], balanceamento: str = 'round_robin'):
+        self.replicas = replicas
+        self.balanceamento = balanceamento
+        self.leituras_primario = 0
+        self._vez = itertools.count()
+        self._lock = threading.Lock()
+
+    def escolhe(self):
+        # Engine da replica que atende a proxima leitura, ou None se nenhuma
+        # esta saudavel (quem chama usa o primario)
+        saudaveis = [replica for replica in self.replicas if replica.saudavel]
+        if not saudaveis:
+            with self._lock:
+                self.leituras_primario += 1
+            return None
+        if self.balanceamento == 'menos_conexoes':
+            escolhida = min(saudaveis, key=Replica.em_uso)
+        else:
+            escolhida = saudaveis[next(self._vez) % len(saudaveis)]
+        with self._lock:
+            escolhida.leituras += 1
+        return escolhida.engine
+
+    def _marca(self, replica: Replica, saudavel: bool, erro: Exception | None = None):
+        if saudavel and not replica.saudavel:
+            logger.warning('replica %s voltou', replica.url)
+        elif not saudavel and replica.saudavel:
+            logger.warning('replica %s fora da roda: %s', replica.url, erro)
+        replica.saudavel = saudavel
+
+    def verifica(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    conn.execute(CHECAGEM)
+            except Exception as erro:
+                self._marca(replica, False, erro)
+            else:
+                self._marca(replica, True)
+
+    async def verifica_async(self):
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as conn:
+                    await conn.execute(CHECAGEM)
+            except Exception as erro:
+                self._marca(replica, False, erro)
+            else:
+                self._marca(replica, True)
+
+    async def monitora(self, intervalo: float):
+        # Tarefa de fundo do lifespan do app
+        async_ = bool(self.replicas) and hasattr(self.replicas[0].engine, 'sync_engine')
+        while True:
+            if async_:
+                await self.verifica_async()
+            else:
+                await asyncio.to_thread(self.verifica)
+            await asyncio.sleep(intervalo)
+
+    def estatisticas(self) -> dict:
+        return {
+            'balanceamento': self.balanceamento,
+            'leituras_primario': self.leituras_primario,
+            'replicas': [
+                {
+                    'url': make_url(replica.url).render_as_string(hide_password=True),
+                    'saudavel': replica.saudavel,
+                    'leituras': replica.leituras,
+                    'em_uso': replica.em_uso(),
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+def le_primario(cookies: dict) -> bool:
+    # Cookie com o instante (epoch) ate quando as leituras vao pro primario
+    try:
+        return float(cookies.get(COOKIE_PRIMARIO, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class MiddlewareLeituraPropria:
+    # ASGI puro, como o MiddlewareMetricas: escrita que deu certo (status < 400)
+    # numa das ROTAS_ESCRITA renova o cookie por `segundos`
+    def __init__(self, app, segundos: float):
+        self.app = app
+        self.segundos = segundos
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not eh_escrita(scope['method'], scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        async def envia(mensagem):
+            if mensagem['type'] == 'http.response.start' and mensagem['status'] < 400:
+                cookie = SimpleCookie()
+                cookie[COOKIE_PRIMARIO] = str(round(time.time() + self.segundos, 3))
+                cookie[COOKIE_PRIMARIO]['max-age'] = int(self.segundos) + 1
+                cookie[COOKIE_PRIMARIO]['path'] = '/'
+                cookie[COOKIE_PRIMARIO]['httponly'] = True
+                cookie[COOKIE_PRIMARIO]['samesite'] = 'lax'
+                valor = cookie.output(header='').strip()
+                mensagem = {
+                    **mensagem,
+                    'headers': [*mensagem.get('headers', []), (b'set-cookie', valor.encode('latin-1'))],
+                }
+            await send(mensagem)
+
+        await self.app(scope, receive, envia)
@@ -0,0 +1,249 @@
+# Versao async das rotas de usuarios (DB_MODE=async).
+# Mesmos caminhos e respostas das rotas em app.py, mas sem ocupar uma
+# thread do threadpool enquanto espera o banco.
+from http import HTTPStatus
+from typing import List, Literal, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import cache_usuarios
+from condicional import cabecalhos, confere_if_match, responde
+from database import get_async_session, get_async_session_leitura
+from eventos import publica_usuario
+from limites import ESCRITA
+from models import User
+from regras import (
+    ATIVO,
+    COLUNAS_PAYLOAD,
+    busca_payload_async,
+    detalhe_conflito,
+    formato_pedido,
+    le_campos,
+    mesmo_email,
+    mesmo_nome,
+    monta_lista,
+    monta_pagina,
+    payload_usuario,
+    query_listagem,
+    senha_eh_forte,
+)
+from schema import BaseUsuario, PaginaUsuarios, UsuarioParcial, UsuarioPublic
+from seguranca import senhas
+from settings import get_settings
+
+settings = get_settings()
+
+rotas = APIRouter()
+
+
+@rotas.post("/usuarios", status_code=HTTPStatus.CREATED, response_model=UsuarioPublic, dependencies=ESCRITA)
+async def create_usuario(user: BaseUsuario, session: AsyncSession = Depends(get_async_session)):
+    if not senha_eh_forte(user.password):
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail='A senha precisa ter letras e numeros'
+        )
+
+    senha_hash = await senhas.gera_async(user.password)
+
+    if not settings.CREATE_PRECHECK:
+        # Um INSERT ... RETURNING so; se username/email ja existirem a unique
+        # constraint acusa e o erro vira o mesmo 409 do jeito antigo
+        try:
+            criado = await session.execute(
+                insert(User)
+                .values(username=user.username, email=user.email, password=senha_hash)
+                .returning(User.id, User.username, User.email)
+            )
+            novo_usuario = criado.one()._asdict()
+            await session.commit()
+        except IntegrityError as erro:
+            await session.rollback()
+            raise HTTPException(status_code=409, detail=detalhe_conflito(erro))
+        publica_usuario('criado', **novo_usuario)
+        return novo_usuario
+
+    db_user = await session.scalar(
+        select(User).where(
+            mesmo_nome(user.username) | mesmo_email(user.email)
+        )
+    )
+
+    if db_user:
+        if db_user.username.lower() == user.username.lower():
+            raise HTTPException(status_code=409, detail='Nome de usuario ja existe')
+        elif db_user.email.lower() == user.email.lower():
+            raise HTTPException(status_code=409, detail='Email ja existe')
+
+    novo_usuario = User(
+        username=user.username,
+        email=user.email,
+        password=senha_hash
+    )
+
+    session.add(novo_usuario)
+    await session.commit()
+    await session.refresh(novo_usuario)
+    publica_usuario('criado', novo_usuario.id, novo_usuario.username, novo_usuario.email)
+
+    return novo_usuario
+
+
+@rotas.get(
+    "/usuarios",
+    status_code=HTTPStatus.OK,
+    response_model=Union[List[UsuarioPublic], PaginaUsuarios],
+)
+async def get_todos_usuarios(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=settings.LISTAGEM_LIMITE_MAX),
+    paginacao: Literal['offset', 'cursor'] = 'offset',
+    cursor: Optional[str] = None,
+    ordem: Literal['id', 'created_at'] = 'id',
+    fields: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session_leitura),
+):
+    # fields=id,username: so essas chaves (e so essas colunas no SELECT).
+    # Accept: application/msgpack responde em MessagePack
+    campos = le_campos(fields)
+    formato = formato_pedido(request.headers.get('accept'))
+    query, modo_cursor = query_listagem(skip, limit, paginacao, cursor, ordem, campos)
+    linhas = (await session.execute(query)).all()
+
+    if not modo_cursor:
+        return monta_lista(linhas, campos, formato)
+    return monta_pagina(linhas, limit, ordem, campos, formato)
+
+
+@rotas.get("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
+async def get_usuario_por_id(id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session_leitura)):
+    payload = await busca_payload_async(session, ('id', id), User.id == id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    # 304 se o cliente mandou o ETag/data da versao atual
+    return responde(request, response, payload)
+
+
+@rotas.get("/usuarios/busca/{nome}", status_code=HTTPStatus.OK, response_model=UsuarioPublic)
+async def get_usuario_por_nome(nome: str, request: Request, response: Response, session: AsyncSession = Depends(get_async_session_leitura)):
+    # Busca exata pelo username (sem diferenciar maiusculas)
+    payload = await busca_payload_async(session, ('nome', nome), mesmo_nome(nome))
+    if payload is None:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    return responde(request, response, payload)
+
+
+@rotas.put("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+async def update_usuario(id: int, user: BaseUsuario, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    if not senha_eh_forte(user.password):
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail='A senha precisa ter letras e numeros'
+        )
+
+    # Hash antes de ir ao banco pra nao segurar conexao do pool enquanto calcula
+    senha_hash = await senhas.gera_async(user.password)
+
+    query = select(User).where(User.id == id, ATIVO)
+    if 'if-match' in request.headers:
+        # Trava a linha entre conferir a versao e gravar (no SQLite nao faz nada,
+        # la a escrita ja e serializada)
+        query = query.with_for_update()
+    db_user = await session.scalar(query)
+
+    if not db_user:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    confere_if_match(request, payload_usuario(db_user))
+
+    nome_antigo = db_user.username
+    try:
+        db_user.username = user.username
+        db_user.email = user.email
+        db_user.password = senha_hash
+
+        await session.commit()
+        await session.refresh(db_user)
+        cache_usuarios.invalida(id, nome_antigo, db_user.username)
+        publica_usuario('atualizado', id, db_user.username, db_user.email)
+        response.headers.update(cabecalhos(payload_usuario(db_user)))
+        return db_user
+
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail='Nome ou Email ja existe')
+
+
+@rotas.patch("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+async def patch_usuario(id: int, user: UsuarioParcial, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    # Atualiza so os campos enviados, num UPDATE ... RETURNING sem ler a linha antes
+    campos = user.model_dump(exclude_unset=True, exclude_none=True)
+
+    if 'password' in campos:
+        if not senha_eh_forte(campos['password']):
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail='A senha precisa ter letras e numeros'
+            )
+        campos['password'] = await senhas.gera_async(campos['password'])
+
+    if not campos or 'if-match' in request.headers:
+        # Sem nada pra mudar, ou com If-Match: ai precisa ler a versao atual
+        db_user = await session.scalar(select(User).where(User.id == id, ATIVO).with_for_update())
+        if not db_user:
+            raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+        confere_if_match(request, payload_usuario(db_user))
+        if not campos:
+            return db_user
+
+    # updated_at sobe sozinho pelo onupdate da coluna
+    try:
+        resultado = await session.execute(
+            update(User)
+            .where(User.id == id, ATIVO)
+            .values(**campos)
+            .returning(*COLUNAS_PAYLOAD),
+            execution_options={'synchronize_session': False},
+        )
+        linha = resultado.one_or_none()
+        await session.commit()
+    except IntegrityError as erro:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail=detalhe_conflito(erro))
+
+    if linha is None:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    # O username antigo nao e conhecido aqui, mas invalidar o id ja basta
+    # (ver cache.py); o novo tambem sai pra nao sobrar mapeamento velho
+    cache_usuarios.invalida(id, *([campos['username']] if 'username' in campos else []))
+    publica_usuario('atualizado', id, linha.username, linha.email)
+    response.headers.update(cabecalhos(payload_usuario(linha)))
+    return linha._asdict()
+
+
+@rotas.delete("/usuarios/{id}", status_code=HTTPStatus.OK, response_model=UsuarioPublic, dependencies=ESCRITA)
+async def delete_usuario(id: int, request: Request, session: AsyncSession = Depends(get_async_session)):
+    query = select(User).where(User.id == id, ATIVO)
+    if 'if-match' in request.headers:
+        query = query.with_for_update()
+    db_user = await session.scalar(query)
+
+    if not db_user:
+        raise HTTPException(status_code=404, detail='Usuario nao encontrado')
+
+    confere_if_match(request, payload_usuario(db_user))
+
+    # Vira lapide; a compactacao apaga de vez depois (compactacao.py)
+    db_user.deleted_at = func.now()
+    await session.commit()
+    cache_usuarios.invalida(id, db_user.username)
+    publica_usuario('removido', id)
+
+    return db_user
@@ -1,8 +1,25 @@
-from pydantic import BaseModel, ConfigDict, EmailStr
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing_extensions import TypedDict
+
+from models import TAMANHO_EMAIL, TAMANHO_USERNAME
 
 class BaseUsuario(BaseModel):
-    username: str
-    email: str  
+    username: str = Field(max_length=TAMANHO_USERNAME)
+    email: str = Field(max_length=TAMANHO_EMAIL)
+    password: str
+
+
+class UsuarioParcial(BaseModel):
+    # PATCH: so os campos enviados sao alterados
+    username: Optional[str] = Field(None, max_length=TAMANHO_USERNAME)
+    email: Optional[str] = Field(None, max_length=TAMANHO_EMAIL)
+    password: Optional[str] = None
+
+
+class Login(BaseModel):
+    username: str = Field(max_length=TAMANHO_USERNAME)
     password: str
 
 
@@ -14,4 +31,85 @@ class UsuarioPublic(BaseModel):
 
 class Usuario(BaseUsuario):
     id: int
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class PaginaUsuarios(BaseModel):
+    usuarios: List[UsuarioPublic]
+    next_cursor: Optional[str] = None
+
+# Mesmo formato do UsuarioPublic/PaginaUsuarios, mas como dict: as listagens
+# serializam as linhas do banco direto com um TypeAdapter, sem montar models
+# (chave a mais na linha, tipo created_at, fica de fora do JSON)
+class LinhaUsuario(TypedDict):
+    id: int
+    username: str
+    email: str
+
+class PaginaLinhas(TypedDict):
+    usuarios: List[LinhaUsuario]
+    next_cursor: Optional[str]
+
+# Listagem com fields=...: so as chaves pedidas
+class LinhaParcial(TypedDict, total=False):
+    id: int
+    username: str
+    email: str
+
+class PaginaParcial(TypedDict):
+    usuarios: List[LinhaParcial]
+    next_cursor: Optional[str]
+
+# Feed de mudancas (GET /usuarios/changes). Usuario apagado sai como lapide:
+# removido=True e sem username/email
+class Mudanca(BaseModel):
+    id: int
+    username: Optional[str] = None
+    email: Optional[str] = None
+    updated_at: str
+    removido: bool
+
+class PaginaMudancas(BaseModel):
+    mudancas: List[Mudanca]
+    watermark: Optional[str] = None
+    tem_mais: bool
+
+class LinhaMudanca(TypedDict):
+    id: int
+    username: Optional[str]
+    email: Optional[str]
+    updated_at: str
+    removido: bool
+
+class MudancasLinhas(TypedDict):
+    mudancas: List[LinhaMudanca]
+    watermark: Optional[str]
+    tem_mais: bool
+
+class PedidoLookup(BaseModel):
+    ids: List[int]
+
+class ResultadoLookup(BaseModel):
+    usuarios: List[UsuarioPublic]
+    nao_encontrados: List[int]
+
+class PedidoRemocao(BaseModel):
+    ids: List[int]
+
+class ResultadoRemocao(BaseModel):
+    removidos: List[int]
+    nao_encontrados: List[int]
+
+class LookupLinhas(TypedDict):
+    usuarios: List[LinhaUsuario]
+    nao_encontrados: List[int]
+
+class ResultadoLinha(BaseModel):
+    linha: int
+    status: Literal['criado', 'erro']
+    id: Optional[int] = None
+    detalhe: Optional[str] = None
+
+class ResultadoImportacao(BaseModel):
+    criados: int
+    erros: int
+    resultados: List[ResultadoLinha]
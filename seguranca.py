@@ -0,0 +1,223 @@
+# Hash de senha
+#
+# Cada esquema sabe gerar, conferir e dizer se um hash precisa ser refeito
+# (esquema diferente do configurado ou parametros antigos). Os calculos rodam
+# num pool de threads limitado: argon2, bcrypt e pbkdf2 soltam o GIL, entao
+# nao seguram as outras requisicoes, e o limite de pendentes impede que um
+# pico de cadastros coma toda a CPU.
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import Settings, get_settings
+
+
+class SobrecargaHash(Exception):
+    pass
+
+
+class HasherPbkdf2:
+    nome = 'pbkdf2_sha256'
+
+    def __init__(self, iteracoes: int):
+        self.iteracoes = iteracoes
+
+    def identifica(self, hash: str) -> bool:
+        return hash.startswith('pbkdf2_sha256$')
+
+    def _calcula(self, senha: str, sal: bytes, iteracoes: int) -> str:
+        bruto = hashlib.pbkdf2_hmac('sha256', senha.encode(), sal, iteracoes)
+        return base64.b64encode(bruto).decode()
+
+    def gera(self, senha: str) -> str:
+        sal = base64.b64encode(os.urandom(16)).decode()
+        return f'pbkdf2_sha256${self.iteracoes}${sal}${self._calcula(senha, sal.encode(), self.iteracoes)}'
+
+    def verifica(self, senha: str, hash: str) -> bool:
+        # Hash guardado corrompido nao confere (em vez de virar um 500)
+        try:
+            _, iteracoes, sal, esperado = hash.split('$')
+            return hmac.compare_digest(self._calcula(senha, sal.encode(), int(iteracoes)), esperado)
+        except (ValueError, TypeError):
+            return False
+
+    def precisa_rehash(self, hash: str) -> bool:
+        try:
+            return int(hash.split('$')[1]) != self.iteracoes
+        except (ValueError, IndexError):
+            return True
+
+
+class HasherArgon2:
+    nome = 'argon2id'
+
+    def __init__(self, time_cost: int, memory_cost: int, parallelism: int):
+        from argon2 import PasswordHasher
+
+        self.ph = PasswordHasher(
+            time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+        )
+
+    def identifica(self, hash: str) -> bool:
+        return hash.startswith('$argon2')
+
+    def gera(self, senha: str) -> str:
+        return self.ph.hash(senha)
+
+    def verifica(self, senha: str, hash: str) -> bool:
+        from argon2.exceptions import InvalidHashError, VerificationError
+
+        try:
+            return self.ph.verify(hash, senha)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def precisa_rehash(self, hash: str) -> bool:
+        return self.ph.check_needs_rehash(hash)
+
+
+class HasherBcrypt:
+    # O bcrypt so usa os primeiros 72 bytes (e a lib recusa senha maior)
+    nome = 'bcrypt'
+
+    def __init__(self, rounds: int):
+        import bcrypt
+
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+
+    def identifica(self, hash: str) -> bool:
+        return hash.startswith(('$2a$', '$2b$', '$2y$'))
+
+    def gera(self, senha: str) -> str:
+        return self.bcrypt.hashpw(senha.encode()[:72], self.bcrypt.gensalt(self.rounds)).decode()
+
+    def verifica(self, senha: str, hash: str) -> bool:
+        try:
+            return self.bcrypt.checkpw(senha.encode()[:72], hash.encode())
+        except ValueError:
+            return False
+
+    def precisa_rehash(self, hash: str) -> bool:
+        try:
+            return int(hash.split('$')[2]) != self.rounds
+        except (ValueError, IndexError):
+            return True
+
+
+class Senhas:
+    def __init__(self, esquemas: dict, padrao: str, max_workers: int, max_pendentes: int):
+        self.esquemas = esquemas
+        self.padrao = esquemas[padrao]
+        self.max_workers = max_workers
+        self.max_pendentes = max_pendentes
+        self.pendentes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hash')
+        # Hash qualquer pra gastar o mesmo tempo quando o usuario nem existe
+        self._hash_falso = None
+
+    def _esquema_de(self, hash: str):
+        for esquema in self.esquemas.values():
+            if esquema.identifica(hash):
+                return esquema
+        return None
+
+    def _gera(self, senha: str) -> str:
+        return self.padrao.gera(senha)
+
+    def _verifica(self, senha: str, hash: str | None):
+        # Devolve (confere, hash_novo). hash_novo vem preenchido quando o hash
+        # guardado precisa ser refeito com o esquema/parametros atuais
+        if hash is None:
+            if self._hash_falso is None:
+                self._hash_falso = self.padrao.gera('senha-que-nao-existe-123')
+            self.padrao.verifica(senha, self._hash_falso)
+            return False, None
+
+        esquema = self._esquema_de(hash)
+        if esquema is None and hash.startswith('$'):
+            # Hash de um esquema que nao esta disponivel aqui (argon2/bcrypt
+            # sem a lib instalada). Comparar como texto puro deixaria entrar
+            # quem mandasse o proprio hash como senha
+            return False, None
+        if esquema is None:
+            # Sem marca de esquema: senha antiga guardada em texto puro
+            confere = hmac.compare_digest(senha.encode(), hash.encode())
+        else:
+            confere = esquema.verifica(senha, hash)
+        if not confere:
+            return False, None
+
+        if esquema is not self.padrao or esquema.precisa_rehash(hash):
+            return True, self.padrao.gera(senha)
+        return True, None
+
+    def _envia(self, funcao, *args, recusa: bool = True):
+        with self._lock:
+            if recusa and self.pendentes >= self.max_pendentes:
+                raise SobrecargaHash()
+            self.pendentes += 1
+        futuro = self._pool.submit(funcao, *args)
+        futuro.add_done_callback(self._terminou)
+        return futuro
+
+    def _terminou(self, _futuro):
+        with self._lock:
+            self.pendentes -= 1
+
+    # Rotas sync: a thread da requisicao espera, mas a CPU fica limitada ao pool
+    def gera(self, senha: str) -> str:
+        return self._envia(self._gera, senha).result()
+
+    def gera_varios(self, senhas: list[str]) -> list[str]:
+        # Importacao em massa: no maximo uma tarefa por thread na fila de cada
+        # vez, entao um cadastro que chega no meio espera uma rodada de hashes
+        # e nao o lote inteiro. Conta nos pendentes, mas nao e recusada pelo
+        # limite (a requisicao ja foi aceita e parte pode estar gravada)
+        hashes = [None] * len(senhas)
+        em_andamento = deque()
+        for posicao, senha in enumerate(senhas):
+            if len(em_andamento) >= self.max_workers:
+                anterior, futuro = em_andamento.popleft()
+                hashes[anterior] = futuro.result()
+            em_andamento.append((posicao, self._envia(self._gera, senha, recusa=False)))
+        for posicao, futuro in em_andamento:
+            hashes[posicao] = futuro.result()
+        return hashes
+
+    def verifica(self, senha: str, hash: str | None):
+        return self._envia(self._verifica, senha, hash).result()
+
+    # Rotas async: o event loop segue livre enquanto o hash e calculado
+    async def gera_async(self, senha: str) -> str:
+        return await asyncio.wrap_future(self._envia(self._gera, senha))
+
+    async def verifica_async(self, senha: str, hash: str | None):
+        return await asyncio.wrap_future(self._envia(self._verifica, senha, hash))
+
+
+def cria_senhas(settings: Settings) -> Senhas:
+    esquemas = {'pbkdf2_sha256': HasherPbkdf2(settings.PBKDF2_ITERATIONS)}
+    # argon2 e bcrypt sao opcionais se nao forem o esquema configurado
+    try:
+        esquemas['argon2id'] = HasherArgon2(
+            settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST, settings.ARGON2_PARALLELISM
+        )
+    except ImportError:
+        if settings.HASH_SCHEME == 'argon2id':
+            raise
+    try:
+        esquemas['bcrypt'] = HasherBcrypt(settings.BCRYPT_ROUNDS)
+    except ImportError:
+        if settings.HASH_SCHEME == 'bcrypt':
+            raise
+    return Senhas(esquemas, settings.HASH_SCHEME, settings.HASH_MAX_WORKERS, settings.HASH_MAX_PENDING)
+
+
+senhas = cria_senhas(get_settings())
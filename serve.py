@@ -0,0 +1,103 @@
+# Servidor de producao: N workers do uvicorn com uvloop/httptools quando
+# estao instalados.
+#
+# No SIGTERM (ou Ctrl+C) cada worker para de aceitar conexao, espera as
+# requisicoes em andamento por ate --graceful segundos e roda o shutdown do
+# lifespan, que fecha o pool de conexoes (database.descarta).
+#
+# Cada worker tem o proprio engine/pool (dois no primario com DB_MODE=async).
+# Com DB_CONEXOES_TOTAL no .env o teto e dividido entre os workers e esses
+# engines (database.tamanho_pool), entao subir mais workers nao passa do
+# max_connections do banco.
+#
+# Uso: python serve.py [--workers N] [--host 0.0.0.0] [--port 8000]
+import argparse
+import importlib.util
+import os
+import sys
+
+import uvicorn
+
+from database import motores_no_primario, tamanho_pool
+from settings import get_settings
+
+
+def tem_modulo(nome: str) -> bool:
+    return importlib.util.find_spec(nome) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sobe a API com varios workers')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processos (padrao: numero de CPUs)')
+    parser.add_argument('--keep-alive', type=int, default=5,
+                        help='segundos que uma conexao ociosa fica aberta esperando a proxima requisicao')
+    parser.add_argument('--backlog', type=int, default=2048,
+                        help='conexoes esperando accept (o kernel limita em net.core.somaxconn)')
+    parser.add_argument('--graceful', type=int, default=30,
+                        help='segundos esperando as requisicoes em andamento no desligamento')
+    parser.add_argument('--limite-concorrencia', type=int, default=None,
+                        help='conexoes+tarefas por worker antes de responder 503')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers precisa ser pelo menos 1')
+
+    # Os workers sao processos novos que leem o ambiente: e assim que cada
+    # um sabe em quantos dividir o DB_CONEXOES_TOTAL
+    os.environ['WEB_WORKERS'] = str(args.workers)
+    settings = get_settings().model_copy(update={'WEB_WORKERS': args.workers})
+    motores = motores_no_primario(settings)
+    if settings.DB_CONEXOES_TOTAL is not None and settings.DB_CONEXOES_TOTAL < args.workers * motores:
+        parser.error(
+            f'DB_CONEXOES_TOTAL={settings.DB_CONEXOES_TOTAL} nao da uma conexao '
+            f'pra cada um dos {args.workers * motores} pools ({args.workers} workers x {motores})'
+        )
+    if not settings.DATABASE_URL:
+        parser.error('DATABASE_URL nao configurada: defina no ambiente ou no .env')
+    if args.workers > 1 and settings.CACHE_BACKEND == 'memoria':
+        # Cada worker teria o proprio cache: a escrita so invalida o do worker
+        # que a atendeu, e os outros devolvem o dado (e o ETag) velho pelo TTL
+        parser.error(
+            f'CACHE_BACKEND=memoria nao e compartilhado entre os {args.workers} workers: '
+            'use CACHE_BACKEND=redis (com REDIS_URL) ou desligado, ou --workers 1'
+        )
+    if args.workers > 1 and settings.DATABASE_URL.startswith('sqlite') and ':memory:' in settings.DATABASE_URL:
+        parser.error('SQLite em memoria nao e compartilhado entre workers, use --workers 1')
+
+    loop = 'uvloop' if tem_modulo('uvloop') and sys.platform != 'win32' else 'asyncio'
+    http = 'httptools' if tem_modulo('httptools') else 'h11'
+    pool_size, max_overflow = tamanho_pool(settings, motores)
+    pools = f'{motores}x ' if motores > 1 else ''
+    print(
+        f'{args.workers} workers, loop {loop}, http {http}, pool por worker {pools}{pool_size}+{max_overflow} '
+        f'(ate {args.workers * motores * (pool_size + max_overflow)} conexoes no primario)',
+        flush=True,
+    )
+
+    uvicorn.run(
+        'app:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful,
+        limit_concurrency=args.limite_concorrencia,
+        log_level=args.log_level,
+        # Sem access log por requisicao (as metricas ficam no /metrics)
+        access_log=False,
+        # Os mesmos proxies do rate limit: o uvicorn tambem troca o IP do
+        # cliente pelo do X-Forwarded-For quando a conexao vem deles
+        proxy_headers=True,
+        forwarded_allow_ips=settings.PROXIES_CONFIAVEIS or None,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -5,4 +8,148 @@ class Settings(BaseSettings):
         env_file='.env', env_file_encoding='utf-8'
     )
 
-    DATABASE_URL: str
\ No newline at end of file
+    # Obrigatoria, mas so e conferida quando o app sobe ou o primeiro engine
+    # e criado (database.url_primario): importar os modulos nao precisa do .env
+    DATABASE_URL: Optional[str] = None
+
+    # 'sync' usa Session normal, 'async' usa AsyncSession e rotas async def
+    DB_MODE: Literal['sync', 'async'] = 'sync'
+    # Se nao for informada e derivada do DATABASE_URL (sqlite -> aiosqlite)
+    ASYNC_DATABASE_URL: Optional[str] = None
+
+    # Replicas de leitura, separadas por virgula (replicas.py). Vazio = tudo
+    # no primario. As leituras vao pra uma replica saudavel por round_robin ou
+    # pela com menos conexoes em uso; depois de uma escrita, o mesmo cliente le
+    # do primario por DB_REPLICA_LEITURA_PROPRIA segundos (cookie)
+    DATABASE_REPLICA_URLS: str = ''
+    DB_REPLICA_BALANCEAMENTO: Literal['round_robin', 'menos_conexoes'] = 'round_robin'
+    DB_REPLICA_CHECAGEM: float = 10
+    DB_REPLICA_LEITURA_PROPRIA: float = 5
+
+    # Abre as conexoes do pool e compila as consultas mais usadas no startup
+    AQUECIMENTO_ATIVO: bool = True
+
+    # Pool de conexoes (ignorados no SQLite em memoria, que nao usa QueuePool)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_PRE_PING: bool = False
+    # Teto de conexoes com o banco somando os WEB_WORKERS (serve.py). Cada
+    # worker fica com DB_CONEXOES_TOTAL // WEB_WORKERS, DB_POOL_SIZE fixas no
+    # maximo e o resto de overflow (vale pra cada banco: primario e cada
+    # replica). None = cada worker usa DB_POOL_SIZE + DB_MAX_OVERFLOW
+    DB_CONEXOES_TOTAL: Optional[int] = None
+    # Quantos processos servem o app. O serve.py preenche pros workers
+    WEB_WORKERS: int = 1
+    # Segundos ate reciclar uma conexao, -1 desliga
+    DB_POOL_RECYCLE: int = -1
+    # Cache de statements compilados do SQLAlchemy, 0 desliga
+    DB_QUERY_CACHE_SIZE: int = 500
+
+    # PRAGMAs aplicados em cada conexao nova do SQLite (None = padrao do SQLite)
+    SQLITE_JOURNAL_MODE: Optional[Literal['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']] = None
+    SQLITE_SYNCHRONOUS: Optional[Literal['OFF', 'NORMAL', 'FULL', 'EXTRA']] = None
+
+    # Cache das leituras por id/username: 'memoria' (LRU com TTL), 'redis' ou 'desligado'
+    CACHE_BACKEND: Literal['memoria', 'redis', 'desligado'] = 'memoria'
+    CACHE_TTL: float = 60
+    CACHE_MAX_ITENS: int = 10_000
+    REDIS_URL: Optional[str] = None
+
+    # Junta leituras simultaneas do mesmo id/username numa consulta so
+    # (coalescencia.py)
+    COALESCENCIA_ATIVA: bool = True
+
+    # Linhas por lote no POST /usuarios/bulk. Cada lote faz um SELECT com
+    # IN (usernames) e IN (emails), entao 2x isso tem que caber no limite de
+    # variaveis do SQLite antigo (999)
+    BULK_CHUNK_SIZE: int = 400
+
+    # True volta ao jeito antigo do POST /usuarios (SELECT de duplicados antes
+    # do INSERT). O padrao e um INSERT ... RETURNING so, deixando as unique
+    # constraints acusarem o duplicado
+    CREATE_PRECHECK: bool = False
+
+    # GET /usuarios: maior limit aceito (offset ou cursor)
+    LISTAGEM_LIMITE_MAX: int = 1000
+
+    # POST /usuarios/lookup: maximo de ids por pedido e ids por SELECT ... IN
+    # (abaixo do limite de 999 variaveis do SQLite antigo)
+    LOOKUP_MAX_IDS: int = 5000
+    LOOKUP_CHUNK_SIZE: int = 900
+    # DELETE /usuarios: maximo de ids apagados num pedido
+    BULK_DELETE_MAX_IDS: int = 5000
+
+    # Compactacao das lapides do delete logico (compactacao.py): apaga de vez
+    # as com mais de COMPACTACAO_RETENCAO segundos, COMPACTACAO_LOTE por vez,
+    # olhando a cada COMPACTACAO_INTERVALO segundos se o app recebeu menos de
+    # COMPACTACAO_MAX_RPS requisicoes por segundo
+    COMPACTACAO_ATIVA: bool = True
+    COMPACTACAO_RETENCAO: float = 86400
+    COMPACTACAO_LOTE: int = 500
+    COMPACTACAO_INTERVALO: float = 30
+    COMPACTACAO_MAX_RPS: float = 5
+
+    # Feed de mudancas (GET /usuarios/changes): so devolve linhas com
+    # updated_at ate MUDANCAS_ATRASO segundos atras (relogio do banco), pra
+    # uma transacao que ainda nao commitou nao ficar pra tras do watermark.
+    # Precisa ser maior que 1s (o SQLite grava updated_at em segundos) mais
+    # a duracao da transacao de escrita mais longa
+    MUDANCAS_ATRASO: float = 2
+    MUDANCAS_LIMITE_MAX: int = 1000
+
+    # Eventos em tempo real (eventos.py, SSE e WebSocket): fila por conexao,
+    # o que fazer quando ela enche (cliente lento), intervalo do ping SSE e
+    # teto de conexoes por worker (None = sem teto)
+    EVENTOS_FILA: int = 1000
+    EVENTOS_POLITICA: Literal['descarta', 'desconecta'] = 'descarta'
+    EVENTOS_PING: float = 15
+    EVENTOS_MAX_ASSINANTES: Optional[int] = 10_000
+
+    # Compressao das respostas (compressao.py): algoritmos na ordem de
+    # preferencia (br precisa do pacote brotli e zstd do zstandard; os que
+    # nao estiverem instalados ficam de fora) e tamanho minimo em bytes
+    COMPRESSAO_ATIVA: bool = True
+    COMPRESSAO_ALGORITMOS: str = 'zstd,br,gzip'
+    COMPRESSAO_MINIMO: int = 1024
+
+    # Rate limit das rotas de escrita por IP e rota (limites.py): balde com
+    # RATE_LIMIT_RAJADA fichas que enche RATE_LIMIT_TAXA por segundo.
+    # 'memoria' conta por processo, 'redis' divide entre workers (REDIS_URL)
+    RATE_LIMIT_BACKEND: Literal['memoria', 'redis', 'desligado'] = 'memoria'
+    RATE_LIMIT_TAXA: float = 5
+    RATE_LIMIT_RAJADA: int = 20
+    # IPs/redes dos proxies reversos na frente da API, separados por virgula
+    # (ex.: '127.0.0.1,10.0.0.0/8'). Vindo deles, o IP do rate limit sai do
+    # X-Forwarded-For. Vazio = usa o IP da conexao
+    PROXIES_CONFIAVEIS: str = ''
+    # Controle de admissao: responde 503 na entrada quando o worker tem
+    # ADMISSAO_MAX_EM_ANDAMENTO requisicoes em andamento ou a espera recente
+    # pelo pool passa de ADMISSAO_MAX_ESPERA_POOL_MS. None desliga cada um
+    ADMISSAO_MAX_EM_ANDAMENTO: Optional[int] = None
+    ADMISSAO_MAX_ESPERA_POOL_MS: Optional[float] = None
+    ADMISSAO_RETRY_AFTER: int = 1
+
+    # Hash de senha: esquema usado nos hashes novos. Hash de outro esquema (ou
+    # com parametros antigos) e refeito no proximo login
+    HASH_SCHEME: Literal['argon2id', 'bcrypt', 'pbkdf2_sha256'] = 'argon2id'
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536
+    ARGON2_PARALLELISM: int = 1
+    BCRYPT_ROUNDS: int = 12
+    PBKDF2_ITERATIONS: int = 600_000
+    # Threads que calculam hash (as libs soltam o GIL) e quantos hashes podem
+    # estar na fila+rodando antes de recusar com 503
+    HASH_MAX_WORKERS: int = 4
+    HASH_MAX_PENDING: int = 64
+
+    # Consulta que demorar mais que isso (ms) vai pro log com o SQL
+    # (logger crud.consultas). None desliga o log
+    SLOW_QUERY_MS: Optional[float] = 200
+
+
+@lru_cache
+def get_settings() -> Settings:
+    # Uma leitura do ambiente/.env pro processo todo (database, cache,
+    # seguranca, coalescencia...)
+    return Settings()